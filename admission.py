@@ -0,0 +1,238 @@
+#Admission control: bounded diagnosis concurrency with a bounded, time-limited wait queue
+import os
+import math
+import time
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+from metrics import registry, span, Gauge, Counter
+from storage_manager import STATE_DIR, private_dir
+
+# Diagnoses running at once in one worker process
+MAX_CONCURRENT_DIAGNOSES=int(os.environ.get("MAX_CONCURRENT_DIAGNOSES", "4"))
+# Diagnoses running at once across all worker processes; 0 means only the per-worker limit applies
+MAX_CONCURRENT_DIAGNOSES_TOTAL=int(os.environ.get("MAX_CONCURRENT_DIAGNOSES_TOTAL", "0"))
+# Requests allowed to wait for a slot in one worker; further requests are rejected straight away
+ADMISSION_QUEUE_SIZE=int(os.environ.get("ADMISSION_QUEUE_SIZE", "16"))
+ADMISSION_MAX_WAIT_SECONDS=float(os.environ.get("ADMISSION_MAX_WAIT_SECONDS", "20"))
+# Report not-ready once the wait queue is this full, so load balancers back off before rejections start
+READY_QUEUE_FRACTION=float(os.environ.get("READY_QUEUE_FRACTION", "0.75"))
+SHARED_SLOT_DIR=os.environ.get("SHARED_SLOT_DIR", os.path.join(STATE_DIR, "slots"))
+SHARED_SLOT_POLL_SECONDS=float(os.environ.get("SHARED_SLOT_POLL_SECONDS", "0.05"))
+
+ADMISSION_RUNNING = registry.register(Gauge(
+    "arogya_admission_running", "Diagnoses holding an admission slot in this worker."))
+ADMISSION_WAITING = registry.register(Gauge(
+    "arogya_admission_waiting", "Requests waiting for an admission slot in this worker."))
+ADMISSION_REJECTED = registry.register(Counter(
+    "arogya_admission_rejected", "Requests turned away by admission control.", ("reason",)))
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; carries the HTTP status and a Retry-After hint."""
+
+    def __init__(self, reason, message, status_code, retry_after):
+        super().__init__(message)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class SharedLimit:
+    """
+    Diagnosis slots shared by all worker processes on this host.
+
+    Each slot is a lock file held with flock(), so the kernel frees the slots of a worker that
+    is killed mid-request. The running/waiting counters are for reporting only and are shared
+    with every worker forked from the process that created them.
+    """
+
+    def __init__(self, slots, directory=SHARED_SLOT_DIR):
+        private_dir(directory)
+        self.slots = slots
+        self.paths = [os.path.join(directory, f"slot-{index}.lock") for index in range(slots)]
+        self.running = multiprocessing.Value("i", 0)
+        self.waiting = multiprocessing.Value("i", 0)
+
+    def acquire(self, timeout):
+        """Return a held slot (a file descriptor), or None if none came free within timeout."""
+        import fcntl
+
+        deadline = time.monotonic() + timeout
+        while True:
+            for path in self.paths:
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(SHARED_SLOT_POLL_SECONDS)
+
+    def release(self, fd):
+        import fcntl
+
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def add(self, counter, amount):
+        with counter.get_lock():
+            counter.value += amount
+
+    def to_dict(self):
+        return {"slots": self.slots, "running": self.running.value, "waiting": self.waiting.value}
+
+
+class AdmissionController:
+    """
+    Lets at most max_concurrent diagnoses run in this process (and, with a shared limit, at
+    most shared.slots across all workers). Up to queue_size further requests wait in line for
+    at most max_wait seconds; anything beyond that is rejected at once with a Retry-After hint.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_DIAGNOSES, queue_size=ADMISSION_QUEUE_SIZE,
+                 max_wait=ADMISSION_MAX_WAIT_SECONDS, shared=None):
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.shared = shared
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._running = 0
+        self._waiting = 0
+        self._rejected = {"queue_full": 0, "wait_timeout": 0}
+        # Moving average of how long a diagnosis holds its slot, for Retry-After
+        self._service_seconds = None
+
+    def _update_gauges(self):
+        # Caller holds self._lock
+        ADMISSION_RUNNING.set(self._running)
+        ADMISSION_WAITING.set(self._waiting)
+
+    def retry_after(self):
+        """Seconds until a slot is likely to free up, from the queue length and recent service times."""
+        with self._lock:
+            service = self._service_seconds or 10.0
+            ahead = self._waiting + 1
+        return max(1, min(120, math.ceil(service * ahead / self.max_concurrent)))
+
+    def _reject(self, reason, message, status_code):
+        with self._lock:
+            self._rejected[reason] += 1
+        ADMISSION_REJECTED.inc(reason=reason)
+        logging.warning(f"Admission rejected ({reason}): {message}")
+        return AdmissionRejected(reason, message, status_code, self.retry_after())
+
+    def check(self):
+        """Reject early, before the request body is processed, when the wait queue is already full."""
+        with self._lock:
+            full = self._running >= self.max_concurrent and self._waiting >= self.queue_size
+        if full:
+            raise self._reject("queue_full", "Too many diagnoses are queued", 429)
+
+    @contextmanager
+    def slot(self, max_wait=None):
+        """
+        Hold a diagnosis slot for the enclosed block. Raises AdmissionRejected instead of waiting
+        forever: after max_wait seconds, or the controller's own limit when None.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        with self._lock:
+            if self._waiting >= self.queue_size:
+                queue_full = True
+            else:
+                queue_full = False
+                self._waiting += 1
+                self._update_gauges()
+        if queue_full:
+            raise self._reject("queue_full", "Too many diagnoses are queued", 429)
+
+        acquired_local = False
+        shared_slot = None
+        if self.shared:
+            self.shared.add(self.shared.waiting, 1)
+        try:
+            with span("admission_wait"):
+                deadline = time.monotonic() + max_wait
+                acquired_local = self._slots.acquire(timeout=max_wait)
+                if acquired_local and self.shared:
+                    shared_slot = self.shared.acquire(max(deadline - time.monotonic(), 0))
+        finally:
+            with self._lock:
+                self._waiting -= 1
+                self._update_gauges()
+            if self.shared:
+                self.shared.add(self.shared.waiting, -1)
+
+        if not acquired_local or (self.shared and shared_slot is None):
+            if acquired_local:
+                self._slots.release()
+            raise self._reject("wait_timeout", f"No diagnosis slot became free within {max_wait:.0f}s", 503)
+
+        with self._lock:
+            self._running += 1
+            self._update_gauges()
+        if self.shared:
+            self.shared.add(self.shared.running, 1)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self._running -= 1
+                self._service_seconds = elapsed if self._service_seconds is None else 0.8 * self._service_seconds + 0.2 * elapsed
+                self._update_gauges()
+            if self.shared:
+                self.shared.add(self.shared.running, -1)
+                self.shared.release(shared_slot)
+            self._slots.release()
+
+    def load(self):
+        """Diagnoses running and waiting per slot: 1.0 means every slot is busy, above it requests are queueing."""
+        with self._lock:
+            load = (self._running + self._waiting) / self.max_concurrent
+        if self.shared:
+            load = max(load, (self.shared.running.value + self.shared.waiting.value) / self.shared.slots)
+        return load
+
+    def ready(self):
+        """False once the wait queue passes READY_QUEUE_FRACTION of its size."""
+        with self._lock:
+            return self._waiting < max(1, math.ceil(self.queue_size * READY_QUEUE_FRACTION))
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "running": self._running,
+                "waiting": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "queue_size": self.queue_size,
+                "max_wait_seconds": self.max_wait,
+                "rejected": dict(self._rejected),
+                "service_seconds": round(self._service_seconds, 3) if self._service_seconds is not None else None
+            }
+        stats["shared"] = self.shared.to_dict() if self.shared else None
+        return stats
+
+
+_shared_limit = None
+
+
+def enable_shared_limit(slots=MAX_CONCURRENT_DIAGNOSES_TOTAL):
+    """
+    Create the cross-worker limit. Must run in the server's master process before the
+    workers are forked, so that they all inherit the same slots and counters.
+    """
+    global _shared_limit
+    if slots > 0 and _shared_limit is None:
+        _shared_limit = SharedLimit(slots)
+    return _shared_limit
+
+
+def create_admission_controller():
+    return AdmissionController(shared=_shared_limit)
@@ -0,0 +1,112 @@
+#Process-wide registry of pooled API clients for GROQ and ElevenLabs
+import os
+import logging
+import threading
+
+API_POOL_SIZE=int(os.environ.get("API_POOL_SIZE", "20"))
+API_KEEPALIVE_CONNECTIONS=int(os.environ.get("API_KEEPALIVE_CONNECTIONS", "10"))
+API_KEEPALIVE_EXPIRY=float(os.environ.get("API_KEEPALIVE_EXPIRY", "60"))
+API_CONNECT_TIMEOUT=float(os.environ.get("API_CONNECT_TIMEOUT", "5"))
+# Override the ElevenLabs endpoint (GROQ reads GROQ_BASE_URL itself), e.g. for local stand-ins
+ELEVENLABS_BASE_URL=os.environ.get("ELEVENLABS_BASE_URL")
+
+# Per-call timeouts (seconds), passed to the individual API calls
+STT_TIMEOUT=float(os.environ.get("STT_TIMEOUT", "30"))
+VISION_TIMEOUT=float(os.environ.get("VISION_TIMEOUT", "60"))
+TTS_TIMEOUT=float(os.environ.get("TTS_TIMEOUT", "30"))
+
+
+class ConnectionStats:
+    """Counts requests against new TCP connections and TLS handshakes for one pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+
+    def on_request(self, request):
+        with self._lock:
+            self.requests += 1
+        # httpcore reports connection lifecycle events through the "trace" extension
+        request.extensions["trace"] = self.trace
+
+    def trace(self, event_name, info):
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    def to_dict(self):
+        with self._lock:
+            reused = max(self.requests - self.connections_opened, 0)
+            return {
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "tls_handshakes": self.tls_handshakes,
+                "connection_reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0
+            }
+
+
+_lock = threading.Lock()
+_clients = {}
+_stats = {}
+
+
+def _pooled_http_client(name, timeout):
+    import httpx
+
+    stats = _stats.setdefault(name, ConnectionStats())
+    return httpx.Client(
+        limits=httpx.Limits(
+            max_connections=API_POOL_SIZE,
+            max_keepalive_connections=API_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=API_KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(timeout, connect=API_CONNECT_TIMEOUT),
+        event_hooks={"request": [stats.on_request]}
+    )
+
+
+def _get_or_create(name, api_key, factory):
+    key = (name, api_key)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = factory()
+            _clients[key] = client
+            logging.info(f"Created pooled {name} client")
+    return client
+
+
+def get_groq_client(api_key):
+    """Return the shared GROQ client for api_key; safe to use from several threads at once."""
+    from groq import Groq
+
+    return _get_or_create("groq", api_key, lambda: Groq(
+        api_key=api_key,
+        http_client=_pooled_http_client("groq", VISION_TIMEOUT)
+    ))
+
+
+def get_elevenlabs_client(api_key):
+    """Return the shared ElevenLabs client for api_key; safe to use from several threads at once."""
+    from elevenlabs.client import ElevenLabs
+
+    return _get_or_create("elevenlabs", api_key, lambda: ElevenLabs(
+        api_key=api_key,
+        base_url=ELEVENLABS_BASE_URL,
+        timeout=TTS_TIMEOUT,
+        httpx_client=_pooled_http_client("elevenlabs", TTS_TIMEOUT)
+    ))
+
+
+def client_stats():
+    """Connection reuse statistics per pool, e.g. for /api/stats."""
+    with _lock:
+        return {name: stats.to_dict() for name, stats in _stats.items()}
@@ -1,22 +1,38 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+# Loads .env and configures logging; must come before the modules that read their settings
+import environment
+
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context
 import os
 import logging
 import base64
 from werkzeug.utils import secure_filename
 import uuid
 import json
+import time
+import shutil
+from contextlib import ExitStack
 
 # Import our existing modules
-from brain_of_the_doctor import encode_image, analyze_image_with_query
-from voice_of_the_patient import transcribe_with_groq
-from voice_of_the_doctor import text_to_speech_with_gtts
-
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Load environment variables
-from dotenv import load_dotenv
-load_dotenv()
+from diagnosis_pipeline import (run_diagnosis, run_streaming_diagnosis, run_consultation_turn, system_prompt,
+                                STT_PREPROCESS_AUDIO)
+from diagnosis_jobs import JobManager, JobQueueFull, TERMINAL_EVENTS
+from diagnosis_cache import cache_stats
+from api_clients import client_stats
+from model_router import vision_router
+from storage_manager import storage, input_name, open_private, KEEP_UPLOADED_INPUTS
+from voice_of_the_doctor import negotiate_audio_format, AUDIO_FORMATS, AUDIO_OUTPUT_FORMAT
+from tts_engines import resolve_engine_name, tts_stats, TTS_ENGINE
+from stt_engines import stt_stats
+from warmup import start_prewarm, warmup_report
+from metrics import span, track_request, render_metrics, PAYLOAD_BYTES, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from admission import create_admission_controller, AdmissionRejected
+from brain_of_the_doctor import prepare_image
+from consultation_sessions import sessions
+from batch_diagnosis import run_batch, stage_limits, BATCH_MAX_ITEMS, BATCH_WORKERS, BATCH_ADMISSION_WAIT_SECONDS
+from quality_profiles import choose_profile, quality_stats, latency as quality_latency
+from logging_setup import request_id, stats as logging_stats
+from media_serving import send_media, digests
+from ingestion import IngestRequest, upload_spool, record_ingest, MAX_REQUEST_BYTES
 
 # Check if API keys are available
 GROQ_API_KEY = os.environ.get("GROQ_API_KEY")
@@ -25,11 +41,52 @@ GOOGLE_VISION_API_KEY = os.environ.get("GOOGLE_VISION_API_KEY")
 # Create Flask app
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
-# Configure upload folder
-UPLOAD_FOLDER = 'uploads'
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Uploads are hashed, sniffed and size-checked while they stream in; see ingestion.py
+app.request_class = IngestRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
+@app.errorhandler(413)
+def upload_too_large(error):
+    return jsonify({
+        "status": "error",
+        "message": error.description
+    }), 413
+
+@app.teardown_request
+def finish_ingest(error=None):
+    record_ingest(request)
+
+# Every log record of a request carries its ID; a caller's X-Request-ID is kept if it looks sane
+@app.before_request
+def assign_request_id():
+    incoming = request.headers.get("X-Request-ID", "")
+    valid = 0 < len(incoming) <= 64 and all(c.isalnum() or c in "-_." for c in incoming)
+    request_id.set(incoming if valid else uuid.uuid4().hex)
+
+@app.after_request
+def send_request_id(response):
+    response.headers["X-Request-ID"] = request_id.get()
+    return response
+
+# Configure upload folder; the storage manager owns its contents and expires old artifacts
+app.config['UPLOAD_FOLDER'] = storage.root
+storage.start_janitor()
+
+# Load the configured API clients and render the fixed error audio (so the TTS failure path never
+# hits the network) ahead of the first request; pydub is only needed to decode or convert audio
+start_prewarm(needs_pydub=STT_PREPROCESS_AUDIO or AUDIO_OUTPUT_FORMAT != "mp3")
+
+# Caps concurrent diagnoses and bounds the queue behind them; see serve.py for production serving
+admission = create_admission_controller()
+
+def busy_response(message, status_code, retry_after):
+    response = jsonify({
+        "status": "error",
+        "message": message
+    })
+    response.status_code = status_code
+    response.headers["Retry-After"] = str(retry_after)
+    return response
 
 # Configure allowed extensions
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'wav', 'mp3'}
@@ -37,109 +94,476 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'wav', 'mp3'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# System prompt for the doctor
-system_prompt = """You are Dr. Arogya, a professional dermatologist with expertise in skin conditions and medical diagnosis.
-            Analyze the uploaded image carefully and provide a detailed medical assessment.
-            If you identify any skin condition or medical issue, provide a clear diagnosis and suggest appropriate remedies or treatments.
-            Your response should be structured as follows:
-            1. Begin with a greeting and acknowledge what you see in the image
-            2. Provide your professional assessment of any medical conditions visible
-            3. Suggest possible treatments or next steps
-            4. End with reassurance and professional closing
-
-            Speak directly to the patient as if in a doctor's office. Be thorough but compassionate.
-            Do not use markdown formatting or mention that you are an AI. Respond as a real doctor would.
-            If the image is unclear or you cannot make a definitive diagnosis, be honest about limitations and suggest seeking in-person medical advice."""
-
 @app.route('/')
 def index():
     return render_template('index.html')
 
 # API status route removed as requested
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
+# Artifact kind each upload field is stored as
+UPLOAD_KINDS = {"audio": "recording", "image": "image"}
+
+def save_uploaded_files(fields=("audio", "image")):
+    """Validate and save the given file parts of the request (the audio and image by default).
+
+    Returns (inputs, None) on success, with one input per field in order, or (None, error_response)
+    otherwise. Each input is a path under uploads/, or an in-memory (filename, bytes) pair when
+    KEEP_UPLOADED_INPUTS is off.
+    """
     # Check if the post request has the file part
-    if 'audio' not in request.files or 'image' not in request.files:
-        return jsonify({
+    if any(field not in request.files for field in fields):
+        return None, (jsonify({
             "status": "error",
-            "message": "Missing audio or image file"
-        }), 400
+            "message": f"Missing {' or '.join(fields)} file"
+        }), 400)
 
-    audio_file = request.files['audio']
-    image_file = request.files['image']
+    files = [request.files[field] for field in fields]
 
     # If user does not select file, browser also
     # submit an empty part without filename
-    if audio_file.filename == '' or image_file.filename == '':
-        return jsonify({
+    if any(file.filename == '' for file in files):
+        return None, (jsonify({
             "status": "error",
             "message": "No selected file"
-        }), 400
+        }), 400)
 
-    if audio_file and allowed_file(audio_file.filename) and image_file and allowed_file(image_file.filename):
-        # Generate unique filenames
-        audio_filename = str(uuid.uuid4()) + '.' + audio_file.filename.rsplit('.', 1)[1].lower()
-        image_filename = str(uuid.uuid4()) + '.' + image_file.filename.rsplit('.', 1)[1].lower()
+    if not all(file and allowed_file(file.filename) for file in files) or \
+            not all(content_matches(field, file) for field, file in zip(fields, files)):
+        return None, (jsonify({
+            "status": "error",
+            "message": "Invalid file type"
+        }), 400)
+
+    with span("upload_save"):
+        inputs = tuple(store_upload(field, file) for field, file in zip(fields, files))
+
+    return inputs, None
 
+def content_matches(field, file):
+    """Whether the leading bytes sniffed during upload fit the field: images must be a known image
+    type, recordings anything but a known non-audio type (some browsers' containers aren't sniffed)."""
+    spool = upload_spool(file)
+    if spool is None:
+        return True
+    if field == "image":
+        return spool.media == "image"
+    return spool.media != "image"
+
+def store_upload(field, file):
+    """Save one validated upload and return it as a path, or as a (filename, bytes, sha256) input in memory."""
+    kind = UPLOAD_KINDS[field]
+    extension = '.' + file.filename.rsplit('.', 1)[1].lower()
+    spool = upload_spool(file)
+    if not KEEP_UPLOADED_INPUTS:
+        # Process straight from the upload buffer; nothing to copy or clean up afterwards
+        if spool is not None:
+            upload = (kind + extension, spool.data(), spool.sha256)
+        else:
+            upload = (kind + extension, file.read())
+        size = len(upload[1])
+    elif spool is not None:
+        upload = storage.new_path(kind, extension)
+        with open_private(upload, "wb") as f:
+            f.write(spool.data())
+        size = spool.size
+        storage.note_write(size)
+        digests.remember(upload, digest=spool.sha256)
+    else:
         # Save files
-        audio_path = os.path.join(app.config['UPLOAD_FOLDER'], audio_filename)
-        image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
+        upload = storage.new_path(kind, extension)
+        with open_private(upload, "wb") as f:
+            shutil.copyfileobj(file.stream, f)
+        size = os.path.getsize(upload)
+        storage.note_write(size)
+    PAYLOAD_BYTES.observe(size, kind=f"upload_{field}")
+    return upload
+
+def save_uploaded_batch():
+    """Validate and save the repeated audio and image parts of a batch request, paired in order.
+
+    Optional repeated id fields name the pairs in the result lines; they default to "0", "1", ...
+    Returns (items, None) on success or (None, error_response) otherwise.
+    """
+    audio_files = request.files.getlist("audio")
+    image_files = request.files.getlist("image")
+    ids = request.form.getlist("id") or [str(index) for index in range(len(audio_files))]
+
+    if not audio_files or len(audio_files) != len(image_files) or len(ids) != len(audio_files):
+        return None, (jsonify({
+            "status": "error",
+            "message": "Send the same number of audio and image files (and ids, if given)"
+        }), 400)
+
+    if len(audio_files) > BATCH_MAX_ITEMS:
+        return None, (jsonify({
+            "status": "error",
+            "message": f"At most {BATCH_MAX_ITEMS} pairs per batch"
+        }), 413)
+
+    files = audio_files + image_files
+    if any(file.filename == '' for file in files):
+        return None, (jsonify({
+            "status": "error",
+            "message": "No selected file"
+        }), 400)
+
+    if not all(allowed_file(file.filename) for file in files) or \
+            not all(content_matches("audio", file) for file in audio_files) or \
+            not all(content_matches("image", file) for file in image_files):
+        return None, (jsonify({
+            "status": "error",
+            "message": "Invalid file type"
+        }), 400)
+
+    with span("upload_save"):
+        items = [{
+            "id": item_id,
+            "audio": store_upload("audio", audio_file),
+            "image": store_upload("image", image_file)
+        } for item_id, audio_file, image_file in zip(ids, audio_files, image_files)]
+
+    return items, None
+
+def output_options():
+    """Response audio options for the current request.
+
+    quality names a profile (fast, standard or thorough; QUALITY_PROFILE by default), which may be
+    served one or two steps cheaper while the server is busy (see quality_profiles).
+    The format comes from an explicit audio_format field or the Accept header, then the profile (MP3 by default).
+    audio_delivery=inline returns the audio as a data URL instead of writing it to uploads/.
+    tts_engine names a registered voice engine, or "auto" for the fastest one (the profile's, or TTS_ENGINE by default).
+    """
+    profile, _ = choose_profile(request.form.get('quality'), admission.load())
+    return {
+        "audio_format": negotiate_audio_format(request.headers.get('Accept'), request.form.get('audio_format'),
+                                               default=profile.audio_format),
+        "inline": request.form.get('audio_delivery') == 'inline',
+        "tts_engine": resolve_engine_name(request.form.get('tts_engine') or profile.tts_engine),
+        "profile": profile
+    }
+
+def audio_data_url(audio, mime_type):
+    return f"data:{mime_type};base64,{base64.b64encode(audio).decode('ascii')}"
+
+def upload_url(path):
+    # The /uploads route serves files by name from UPLOAD_FOLDER, wherever that is; built by hand
+    # rather than with url_for, since segments are announced from pipeline threads without a request
+    return f"uploads/{os.path.basename(path)}"
+
+def diagnose(audio_path, image_path, on_stage=None, streaming=False, audio_format="mp3", inline=False, tts_engine=TTS_ENGINE,
+             profile=None):
+    """Run the full pipeline and shape the result for the JSON API.
+
+    With streaming=True each sentence's audio is delivered as soon as it is synthesized and
+    reported through on_stage as a "segment" event, ahead of the full response. The time each
+    run takes counts towards its quality profile's latency target.
+    """
+    with admission.slot(), track_request("api_stream" if streaming else "api"):
+        start = time.monotonic()
+        logging.info(f"Processing audio file: {input_name(audio_path)}")
+        logging.info(f"Processing image file: {input_name(image_path)}")
+
+        output_filepath = None if inline else storage.new_path("response")
 
-        audio_file.save(audio_path)
-        image_file.save(image_path)
+        if streaming:
+            def on_segment(index, sentence, audio):
+                if inline:
+                    audio_url = audio_data_url(audio, AUDIO_FORMATS["mp3"])
+                else:
+                    segment_path = storage.new_path("segment", ".mp3")
+                    with open_private(segment_path, "wb") as f:
+                        f.write(audio)
+                    storage.note_write(len(audio))
+                    digests.remember(segment_path, audio)
+                    audio_url = upload_url(segment_path)
+                if on_stage is not None:
+                    on_stage("segment", {
+                        "index": index,
+                        "text": sentence,
+                        "audio_url": audio_url
+                    })
 
+            result = run_streaming_diagnosis(audio_path, image_path, output_filepath, system_prompt,
+                                             on_stage=on_stage, on_segment=on_segment, audio_format=audio_format,
+                                             tts_engine=tts_engine, profile=profile)
+        else:
+            result = run_diagnosis(audio_path, image_path, output_filepath, system_prompt,
+                                   on_stage=on_stage, audio_format=audio_format, tts_engine=tts_engine, profile=profile)
+        quality_latency.record(result["quality"], time.monotonic() - start)
+
+        return response_body(result, inline)
+
+def response_body(result, inline=False):
+    """The JSON body for a pipeline result, with the audio as a path under uploads/ or a data URL."""
+    if inline:
+        audio_output_path = audio_data_url(result["audio"], result["audio_mime"])
+    else:
+        audio_output_path = upload_url(result["audio_filepath"])
+
+    body = {
+        "status": "success",
+        "transcription": result["transcription"],
+        "diagnosis": result["diagnosis"],
+        "audio_response": audio_output_path,
+        "audio_mime": result["audio_mime"]
+    }
+    if "quality" in result:
+        # The profile actually served, which may be cheaper than the one requested
+        body["quality"] = result["quality"]
+    if "timings" in result:
+        # Per-stage start and duration, and the time saved by running stages side by side
+        body["timings"] = result["timings"]
+    return body
+
+# Batch mode: many pairs in one request, diagnosed concurrently with each stage capped
+# (see batch_diagnosis), and one NDJSON line streamed back per pair as soon as it is done
+@app.route('/api/batch', methods=['POST'])
+def create_batch():
+    try:
+        admission.check()
+    except AdmissionRejected as e:
+        return busy_response(str(e), e.status_code, e.retry_after)
+
+    items, error_response = save_uploaded_batch()
+    if error_response:
+        return error_response
+
+    options = output_options()
+
+    def run_item(item):
+        output_filepath = None if options["inline"] else storage.new_path("response")
+        # Each pair counts against the same per-worker and cross-worker limits as a single request
         try:
-            # Process the files
-            logging.info(f"Processing audio file: {audio_path}")
-            logging.info(f"Processing image file: {image_path}")
-
-            # Transcribe audio
-            speech_to_text_output = transcribe_with_groq(
-                GROQ_API_KEY=GROQ_API_KEY,
-                audio_filepath=audio_path,
-                stt_model="whisper-large-v3"
-            )
-            logging.info(f"Transcription result: {speech_to_text_output}")
-
-            # Analyze image
-            doctor_response = analyze_image_with_query(
-                query=system_prompt + speech_to_text_output,
-                encoded_image=encode_image(image_path),
-                model="meta-llama/llama-4-scout-17b-16e-instruct"
-            )
-            logging.info(f"Doctor's response: {doctor_response}")
-
-            # Generate audio response
-            output_filepath = os.path.join(app.config['UPLOAD_FOLDER'], str(uuid.uuid4()) + ".wav")
-            voice_of_doctor = text_to_speech_with_gtts(input_text=doctor_response, output_filepath=output_filepath)
-            logging.info(f"Generated voice response at: {voice_of_doctor}")
-
-            # Get relative paths for frontend
-            audio_output_path = os.path.relpath(voice_of_doctor, start=os.path.dirname(__file__))
-
-            return jsonify({
-                "status": "success",
-                "transcription": speech_to_text_output,
-                "diagnosis": doctor_response,
-                "audio_response": audio_output_path
-            })
-
-        except Exception as e:
-            logging.error(f"Error in processing: {e}")
-            return jsonify({
-                "status": "error",
-                "message": f"Error processing files: {str(e)}"
-            }), 500
+            with admission.slot(max_wait=BATCH_ADMISSION_WAIT_SECONDS):
+                result = run_diagnosis(item["audio"], item["image"], output_filepath, system_prompt,
+                                       audio_format=options["audio_format"], gate=stage_limits.gate,
+                                       tts_engine=options["tts_engine"], profile=options["profile"])
+        except AdmissionRejected as e:
+            return {"status": "error", "message": str(e), "retry_after": e.retry_after}
+        return response_body(result, options["inline"])
+
+    # Tracked until the last line is sent (or the client goes away)
+    held = ExitStack()
+    held.enter_context(track_request("api_batch"))
+    logging.info(f"Processing batch of {len(items)} pairs")
+
+    def stream():
+        # No more pairs in flight than there are slots, so a batch doesn't also fill the wait queue
+        for line in run_batch(items, run_item, workers=min(BATCH_WORKERS, admission.max_concurrent)):
+            yield json.dumps(line) + "\n"
+
+    response = Response(stream_with_context(stream()), mimetype='application/x-ndjson', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+    response.call_on_close(held.close)
+    return response
+
+@app.route('/api/upload', methods=['POST'])
+def upload_file():
+    try:
+        # Turn the request away before saving anything if the queue is already full
+        admission.check()
+    except AdmissionRejected as e:
+        return busy_response(str(e), e.status_code, e.retry_after)
+
+    paths, error_response = save_uploaded_files()
+    if error_response:
+        return error_response
+
+    try:
+        return jsonify(diagnose(*paths, **output_options()))
+    except AdmissionRejected as e:
+        return busy_response(str(e), e.status_code, e.retry_after)
+    except Exception as e:
+        logging.error(f"Error in processing: {e}")
+        return jsonify({
+            "status": "error",
+            "message": f"Error processing files: {str(e)}"
+        }), 500
+
+# Job-based mode: the POST returns a job ID right away and the stages run on a bounded worker pool
+job_manager = JobManager()
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    try:
+        admission.check()
+    except AdmissionRejected as e:
+        return busy_response(str(e), e.status_code, e.retry_after)
+
+    paths, error_response = save_uploaded_files()
+    if error_response:
+        return error_response
+
+    # stream=1 streams the diagnosis sentence by sentence as "segment" events
+    streaming = request.form.get('stream') == '1'
+
+    try:
+        job = job_manager.submit(diagnose, *paths, streaming=streaming, **output_options())
+    except JobQueueFull as e:
+        logging.warning(f"Rejecting diagnosis job: {e}")
+        return busy_response("Server is busy, please try again shortly", 503, admission.retry_after())
 
     return jsonify({
-        "status": "error",
-        "message": "Invalid file type"
-    }), 400
+        "status": "accepted",
+        "job_id": job.id,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events"
+    }), 202
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    response = jsonify(job.to_dict())
+    if response.json["status"] == "busy":
+        response.headers["Retry-After"] = str(response.json["retry_after"])
+    return response
+
+@app.route('/api/jobs/<job_id>/events')
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+
+    def stream():
+        cursor = 0
+        while True:
+            events = job.wait_for_events(cursor, timeout=15)
+            if not events:
+                # Keep idle connections open through proxies
+                yield ": keep-alive\n\n"
+                continue
+            for event, data in events:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                if event in TERMINAL_EVENTS:
+                    return
+            cursor += len(events)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+# Consultation sessions: the image is uploaded and preprocessed once, then each spoken
+# follow-up question is answered with the earlier questions and answers as context
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    try:
+        admission.check()
+    except AdmissionRejected as e:
+        return busy_response(str(e), e.status_code, e.retry_after)
+
+    paths, error_response = save_uploaded_files(("image",))
+    if error_response:
+        return error_response
+
+    # Decoding and resizing the image is CPU work like a diagnosis; it takes a slot the same way
+    try:
+        with admission.slot(), track_request("api_session_create"):
+            encoded_image, mime_type = prepare_image(paths[0])
+    except AdmissionRejected as e:
+        return busy_response(str(e), e.status_code, e.retry_after)
+    except Exception as e:
+        logging.error(f"Error preparing session image: {e}")
+        return jsonify({
+            "status": "error",
+            "message": f"Error processing image: {str(e)}"
+        }), 400
+
+    session = sessions.create(encoded_image, mime_type)
+    logging.info(f"Started consultation session {session.id}")
+    return jsonify({
+        "status": "success",
+        "session_id": session.id,
+        "expires_in": sessions.ttl,
+        "ask_url": f"/api/sessions/{session.id}/ask"
+    }), 201
+
+@app.route('/api/sessions/<session_id>/ask', methods=['POST'])
+def ask_session(session_id):
+    try:
+        admission.check()
+    except AdmissionRejected as e:
+        return busy_response(str(e), e.status_code, e.retry_after)
+
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"status": "error", "message": "Unknown or expired session"}), 404
+
+    paths, error_response = save_uploaded_files(("audio",))
+    if error_response:
+        return error_response
+
+    options = output_options()
+    try:
+        with admission.slot(), track_request("api_session"):
+            logging.info(f"Processing audio file: {input_name(paths[0])} for session {session_id}")
+            output_filepath = None if options["inline"] else storage.new_path("response")
+            result = run_consultation_turn(session, sessions, paths[0], output_filepath, system_prompt,
+                                           audio_format=options["audio_format"], tts_engine=options["tts_engine"],
+                                           profile=options["profile"])
+        return jsonify(dict(response_body(result, options["inline"]), session_id=session_id, turn=result["turn"]))
+    except AdmissionRejected as e:
+        return busy_response(str(e), e.status_code, e.retry_after)
+    except Exception as e:
+        logging.error(f"Error in session {session_id}: {e}")
+        return jsonify({
+            "status": "error",
+            "message": f"Error processing files: {str(e)}"
+        }), 500
+
+@app.route('/api/sessions/<session_id>', methods=['GET', 'DELETE'])
+def session_detail(session_id):
+    if request.method == 'DELETE':
+        if not sessions.delete(session_id):
+            return jsonify({"status": "error", "message": "Unknown or expired session"}), 404
+        return jsonify({"status": "success", "message": "Session ended"})
+
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({"status": "error", "message": "Unknown or expired session"}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/api/stats')
+def stats():
+    return jsonify({
+        "cache": cache_stats(),
+        "clients": client_stats(),
+        "vision_router": vision_router.stats(),
+        "stt": stt_stats(),
+        "tts": tts_stats(),
+        "storage": storage.usage(),
+        "admission": admission.stats(),
+        "quality": quality_stats(),
+        "logging": logging_stats.to_dict(),
+        "sessions": sessions.stats(),
+        "batch_stages": stage_limits.stats(),
+        "warmup": warmup_report
+    })
+
+@app.route('/api/ready')
+def ready():
+    # Readiness probe: 503 once the wait queue is filling up, so load balancers send traffic elsewhere
+    is_ready = admission.ready()
+    response = jsonify(dict(admission.stats(), status="ready" if is_ready else "busy"))
+    if not is_ready:
+        response.status_code = 503
+        response.headers["Retry-After"] = str(admission.retry_after())
+    return response
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape endpoint; each worker process reports its own series
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
 
+# Ranges, content-hash ETags, immutable caching and Accept-based audio encoding; see media_serving
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    return send_media(filename, app.config['UPLOAD_FOLDER'])
 
 if __name__ == '__main__':
+    # Development server only; use serve.py in production
     app.run(debug=True, port=7860)
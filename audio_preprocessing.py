@@ -0,0 +1,112 @@
+#Audio preprocessing before the recording is sent for transcription
+import os
+import logging
+from io import BytesIO
+
+from storage_manager import read_input, input_name
+
+STT_SAMPLE_RATE=int(os.environ.get("STT_SAMPLE_RATE", "16000"))
+STT_MAX_UPLOAD_BYTES=int(os.environ.get("STT_MAX_UPLOAD_BYTES", str(24 * 1024 * 1024)))
+# Silence is anything this many dB below the recording's average loudness
+SILENCE_OFFSET_DB=float(os.environ.get("SILENCE_OFFSET_DB", "16"))
+MIN_SILENCE_MS=int(os.environ.get("MIN_SILENCE_MS", "500"))
+KEEP_SILENCE_MS=int(os.environ.get("KEEP_SILENCE_MS", "200"))
+
+def trim_silence(audio, silence_thresh, keep_ms=KEEP_SILENCE_MS):
+    """Cut leading and trailing silence, keeping keep_ms of padding on each side."""
+    from pydub import silence
+
+    spans = silence.detect_nonsilent(audio, min_silence_len=MIN_SILENCE_MS, silence_thresh=silence_thresh, seek_step=10)
+    if not spans:
+        return audio
+    start = max(spans[0][0] - keep_ms, 0)
+    end = min(spans[-1][1] + keep_ms, len(audio))
+    return audio[start:end]
+
+def split_at_silence(audio, max_chunk_ms, silence_thresh):
+    """Split audio into pieces no longer than max_chunk_ms, cutting in the middle of pauses where possible."""
+    from pydub import silence
+
+    pauses = silence.detect_silence(audio, min_silence_len=MIN_SILENCE_MS // 2, silence_thresh=silence_thresh, seek_step=10)
+    cut_points = [(start + end) // 2 for start, end in pauses]
+
+    chunks = []
+    position = 0
+    while len(audio) - position > max_chunk_ms:
+        limit = position + max_chunk_ms
+        candidates = [cut for cut in cut_points if position < cut <= limit]
+        # No pause in range: cut hard at the limit rather than exceed the upload size
+        cut = candidates[-1] if candidates else limit
+        chunks.append(audio[position:cut])
+        position = cut
+    chunks.append(audio[position:])
+    return chunks
+
+def encode_flac(audio):
+    buffer = BytesIO()
+    audio.export(buffer, format="flac")
+    return buffer.getvalue()
+
+def prepare_audio_for_stt(audio_filepath, max_upload_bytes=STT_MAX_UPLOAD_BYTES):
+    """
+    Decode, downmix, resample, trim and re-encode a recording for speech-to-text.
+
+    The recording is decoded whatever its container (browser MediaRecorder uploads are
+    named .wav but are usually webm/ogg), converted to 16 kHz mono 16-bit, stripped of
+    leading/trailing silence and encoded as FLAC. Recordings that would still exceed
+    max_upload_bytes are split at pauses so each piece can be transcribed separately.
+
+    Args:
+    audio_filepath: Path to the uploaded recording, or an in-memory (filename, bytes) pair.
+    max_upload_bytes (int): Largest chunk to send in a single transcription request.
+
+    Returns:
+    tuple: (chunks, report) where chunks is a list of (filename, bytes) in playback order
+    and report holds the duration and byte counts before and after.
+    """
+    original = read_input(audio_filepath)
+    original_bytes = len(original)
+    try:
+        from pydub import AudioSegment
+
+        # Trust the bytes, not the extension: only real RIFF/WAVE data takes pydub's native WAV reader
+        is_wav = original[:4] == b"RIFF" and original[8:12] == b"WAVE"
+        audio = AudioSegment.from_file(BytesIO(original), format="wav" if is_wav else None)
+        original_ms = len(audio)
+
+        audio = audio.set_channels(1).set_frame_rate(STT_SAMPLE_RATE).set_sample_width(2)
+        silence_thresh = audio.dBFS - SILENCE_OFFSET_DB
+        audio = trim_silence(audio, silence_thresh)
+
+        encoded = encode_flac(audio)
+        if len(encoded) <= max_upload_bytes:
+            pieces = [encoded]
+        else:
+            # FLAC size is close to linear in duration; aim a little under the limit
+            max_chunk_ms = int(len(audio) * max_upload_bytes / len(encoded) * 0.9)
+            pieces = [encode_flac(piece) for piece in split_at_silence(audio, max_chunk_ms, silence_thresh)]
+
+        base_name = os.path.splitext(os.path.basename(input_name(audio_filepath)))[0]
+        chunks = [(f"{base_name}-{index}.flac", piece) for index, piece in enumerate(pieces)]
+        report = {
+            "duration_ms_before": original_ms,
+            "duration_ms_after": len(audio),
+            "bytes_before": original_bytes,
+            "bytes_after": sum(len(piece) for piece in pieces),
+            "chunks": len(chunks)
+        }
+        logging.info(
+            f"Prepared audio for STT: {report['duration_ms_before']} -> {report['duration_ms_after']} ms, "
+            f"{report['bytes_before']} -> {report['bytes_after']} bytes in {report['chunks']} chunk(s)"
+        )
+        return chunks, report
+    except Exception as e:
+        logging.warning(f"Audio preprocessing failed, sending original recording: {e}")
+        report = {
+            "duration_ms_before": None,
+            "duration_ms_after": None,
+            "bytes_before": original_bytes,
+            "bytes_after": original_bytes,
+            "chunks": 1
+        }
+        return [(os.path.basename(input_name(audio_filepath)), bytes(original))], report
@@ -0,0 +1,128 @@
+"""
+Diagnose a batch of audio+image pairs from a manifest and print one JSON line per pair as it finishes.
+
+The manifest is a CSV file with id,audio,image columns, or a JSON lines file with the same keys;
+relative paths are resolved against the manifest's directory. By default the pairs are diagnosed
+in this process with the same per-stage limits as /api/batch; --url sends them to a running server.
+
+Usage:
+    python batch_cli.py screening.csv --output-dir responses/
+    python batch_cli.py screening.csv --url http://localhost:7860 > results.ndjson
+"""
+import os
+import sys
+import re
+import csv
+import json
+import argparse
+from contextlib import ExitStack
+
+import environment
+
+from batch_diagnosis import run_batch, stage_limits, BATCH_MAX_ITEMS, BATCH_WORKERS
+from tts_engines import TTS_ENGINE
+
+# Pair IDs name the response files of local runs, so they may not reach outside --output-dir
+# (or differ only in what would be taken for an extension)
+ITEM_ID = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+
+def read_manifest(path):
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    items = []
+    for index, row in enumerate(rows):
+        missing = [key for key in ("audio", "image") if not row.get(key)]
+        if missing:
+            raise ValueError(f"Manifest row {index + 1} has no {' or '.join(missing)} path")
+        item_id = str(row.get("id") or index)
+        if not ITEM_ID.match(item_id):
+            raise ValueError(f"Manifest row {index + 1} has an invalid id {item_id!r}; use letters, digits, '_' and '-'")
+        items.append({
+            "id": item_id,
+            "audio": os.path.join(base_dir, row["audio"]),
+            "image": os.path.join(base_dir, row["image"])
+        })
+    return items
+
+
+def run_local(items, output_dir, audio_format, workers, tts_engine):
+    from diagnosis_pipeline import run_diagnosis, system_prompt
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    def run_item(item):
+        result = run_diagnosis(item["audio"], item["image"], os.path.join(output_dir, item["id"]), system_prompt,
+                               audio_format=audio_format, gate=stage_limits.gate, tts_engine=tts_engine)
+        return {
+            "status": "success",
+            "transcription": result["transcription"],
+            "diagnosis": result["diagnosis"],
+            "audio_response": result["audio_filepath"],
+            "audio_mime": result["audio_mime"]
+        }
+
+    yield from run_batch(items, run_item, workers=workers)
+
+
+def run_remote(items, url, audio_format, timeout, tts_engine):
+    import httpx
+
+    with ExitStack() as files:
+        parts = []
+        for item in items:
+            parts.append(("audio", (os.path.basename(item["audio"]), files.enter_context(open(item["audio"], "rb")))))
+            parts.append(("image", (os.path.basename(item["image"]), files.enter_context(open(item["image"], "rb")))))
+        data = {"id": [item["id"] for item in items], "audio_format": audio_format, "tts_engine": tts_engine}
+        with httpx.stream("POST", url.rstrip("/") + "/api/batch", data=data, files=parts, timeout=timeout) as response:
+            if response.status_code != 200:
+                response.read()
+                raise RuntimeError(f"Server answered {response.status_code}: {response.text}")
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="CSV or JSON lines file with id, audio and image for each pair")
+    parser.add_argument("--url", help="send the batch to this server instead of diagnosing locally")
+    parser.add_argument("--output-dir", default="batch_responses", help="where local runs write the audio responses")
+    parser.add_argument("--audio-format", default="mp3", choices=["mp3", "opus", "wav"])
+    parser.add_argument("--tts-engine", default=TTS_ENGINE, help="voice engine (gtts, elevenlabs, espeak or auto)")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="pairs in progress at once (local runs)")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the server (remote runs)")
+    args = parser.parse_args()
+
+    try:
+        items = read_manifest(args.manifest)
+    except ValueError as e:
+        parser.error(str(e))
+    if not items:
+        parser.error("the manifest has no pairs")
+    if args.url and len(items) > BATCH_MAX_ITEMS:
+        parser.error(f"the server accepts at most {BATCH_MAX_ITEMS} pairs per batch; split the manifest")
+
+    if args.url:
+        lines = run_remote(items, args.url, args.audio_format, args.timeout, args.tts_engine)
+    else:
+        lines = run_local(items, args.output_dir, args.audio_format, args.workers, args.tts_engine)
+
+    failed = 0
+    try:
+        for line in lines:
+            print(json.dumps(line), flush=True)
+            if line.get("status") == "error":
+                failed += 1
+    except RuntimeError as e:
+        sys.exit(str(e))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#Batch diagnosis: many audio+image pairs at once, with per-stage caps to stay under API rate limits
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from metrics import STAGE_WAITING
+from logging_setup import carry_request_id
+
+BATCH_MAX_ITEMS=int(os.environ.get("BATCH_MAX_ITEMS", "50"))
+# Pairs of one batch in progress at once; each holds a thread while it waits for a stage.
+# Each pair also takes an admission slot, so a batch never runs more than MAX_CONCURRENT_DIAGNOSES at once
+BATCH_WORKERS=int(os.environ.get("BATCH_WORKERS", "8"))
+# How long one pair waits for an admission slot; longer than a single request, since the batch is already accepted
+BATCH_ADMISSION_WAIT_SECONDS=float(os.environ.get("BATCH_ADMISSION_WAIT_SECONDS", "300"))
+# Calls in flight per stage, shared by all batches in this process
+BATCH_STT_CONCURRENCY=int(os.environ.get("BATCH_STT_CONCURRENCY", "4"))
+BATCH_VISION_CONCURRENCY=int(os.environ.get("BATCH_VISION_CONCURRENCY", "2"))
+BATCH_TTS_CONCURRENCY=int(os.environ.get("BATCH_TTS_CONCURRENCY", "4"))
+
+
+class StageLimiter:
+    """One semaphore per pipeline stage; pass gate to run_diagnosis to cap each stage separately."""
+
+    def __init__(self, limits):
+        self.limits = dict(limits)
+        self._semaphores = {stage: threading.BoundedSemaphore(limit) for stage, limit in self.limits.items()}
+        self._lock = threading.Lock()
+        self._waiting = {stage: 0 for stage in self.limits}
+        self._active = {stage: 0 for stage in self.limits}
+
+    def _adjust(self, counts, stage, delta):
+        with self._lock:
+            counts[stage] += delta
+
+    @contextmanager
+    def gate(self, stage):
+        semaphore = self._semaphores.get(stage)
+        if semaphore is None:
+            yield
+            return
+        self._adjust(self._waiting, stage, 1)
+        with STAGE_WAITING.track(stage=stage):
+            semaphore.acquire()
+        self._adjust(self._waiting, stage, -1)
+        self._adjust(self._active, stage, 1)
+        try:
+            yield
+        finally:
+            self._adjust(self._active, stage, -1)
+            semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            return {stage: {"limit": limit, "active": self._active[stage], "waiting": self._waiting[stage]}
+                    for stage, limit in self.limits.items()}
+
+
+stage_limits = StageLimiter({
+    "stt": BATCH_STT_CONCURRENCY,
+    "vision": BATCH_VISION_CONCURRENCY,
+    "tts": BATCH_TTS_CONCURRENCY
+})
+
+
+def run_batch(items, run_item, workers=BATCH_WORKERS):
+    """
+    Run run_item(item) for every item on a small thread pool and yield results as they finish.
+
+    Args:
+    items (list): One entry per pair; each must have an "id".
+    run_item (callable): Diagnoses one item and returns a dict for its result line. Exceptions
+        become an error line for that item only.
+
+    Yields:
+    dict: One line per item, in completion order, with id, index and elapsed_seconds added,
+        then a final summary line with the totals and throughput.
+    """
+    start = time.perf_counter()
+    succeeded = 0
+    failed = 0
+
+    def timed(index, item):
+        item_start = time.perf_counter()
+        try:
+            line = run_item(item)
+        except Exception as e:
+            logging.error(f"Batch item {item['id']} failed: {e}")
+            line = {"status": "error", "message": f"Error processing files: {str(e)}"}
+        return dict(line, id=item["id"], index=index, elapsed_seconds=round(time.perf_counter() - item_start, 3))
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, len(items))), thread_name_prefix="batch")
+    try:
+        futures = [executor.submit(carry_request_id(timed), index, item) for index, item in enumerate(items)]
+        for future in as_completed(futures):
+            line = future.result()
+            if line["status"] == "success":
+                succeeded += 1
+            else:
+                failed += 1
+            yield line
+    finally:
+        # The client may stop reading early; don't start the pairs that haven't begun
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    logging.info(f"Batch of {len(items)} finished in {elapsed:.2f}s ({succeeded} succeeded, {failed} failed)")
+    yield {
+        "status": "done",
+        "items": len(items),
+        "succeeded": succeeded,
+        "failed": failed,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_minute": round(len(items) * 60 / elapsed, 2) if elapsed > 0 else None
+    }
@@ -0,0 +1,75 @@
+"""
+Import-time budget for the web entry points.
+
+Imports each module in a fresh interpreter (with start-up warm-up off) several times and fails
+when the median import time exceeds the budget, or when a dependency that should only load on
+first use was imported. Exits non-zero on failure, so it can gate CI.
+
+Usage:
+    python benchmarks/check_import_time.py
+    python benchmarks/check_import_time.py --budget 0.5 --runs 7 app
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_TIME_BUDGET_SECONDS=float(os.environ.get("IMPORT_TIME_BUDGET_SECONDS", "0.6"))
+
+# Loaded on first use (or by the warm-up) only; importing one of these at start-up is a regression
+LAZY_MODULES = ["elevenlabs", "speech_recognition", "pyaudio", "pydub", "gtts", "PIL", "groq", "gradio"]
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": sorted(m for m in {lazy!r} if m in sys.modules)}}))
+"""
+
+
+def measure(module, work_dir):
+    env = dict(os.environ,
+               STARTUP_PREWARM="off",
+               UPLOAD_FOLDER=os.path.join(work_dir, "uploads"),
+               CACHE_DIR=os.path.join(work_dir, "cache"),
+               PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    result = subprocess.run([sys.executable, "-c", PROBE.format(module=module, lazy=LAZY_MODULES)],
+                            cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=["app"])
+    parser.add_argument("--budget", type=float, default=IMPORT_TIME_BUDGET_SECONDS, help="median seconds allowed per module")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory(prefix="arogya-import-") as work_dir:
+        for module in args.modules:
+            samples = [measure(module, work_dir) for _ in range(args.runs)]
+            median = statistics.median(sample["seconds"] for sample in samples)
+            loaded = sorted({name for sample in samples for name in sample["loaded"]})
+            over_budget = median > args.budget
+            print(f"{module}: median {median:.3f}s over {args.runs} runs (budget {args.budget:.3f}s)"
+                  + (f", eagerly loaded: {', '.join(loaded)}" if loaded else ""))
+            if over_budget:
+                print(f"  FAIL: over budget; run `python -X importtime -c 'import {module}'` to find the cost")
+            if loaded:
+                print("  FAIL: these modules should only be imported on first use")
+            failed = failed or over_budget or bool(loaded)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
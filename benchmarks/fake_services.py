@@ -0,0 +1,212 @@
+#Local stand-ins for the GROQ, gTTS and ElevenLabs HTTP APIs used by the benchmarks
+import os
+import json
+import time
+import base64
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE_SENTENCES = [
+    "Hello, thank you for sharing this image with me.",
+    "I can see several small red bumps across the cheek and forehead.",
+    "This pattern is typical of mild to moderate acne vulgaris.",
+    "I would suggest a gentle cleanser twice a day and a benzoyl peroxide gel in the evening.",
+    "Avoid picking at the spots, as that can lead to scarring.",
+    "If there is no improvement in six to eight weeks, please see a dermatologist in person.",
+    "Please don't worry, this is a very common and treatable condition.",
+]
+
+
+class FakeServiceConfig:
+    """
+    Behaviour of the fake services.
+
+    latency (float): Base response delay in seconds for every endpoint.
+    stage_latency (dict): Per-endpoint overrides for "stt", "vision" and "tts".
+    jitter (float): Uniform random extra delay in seconds, added to every response.
+    error_rate (float): Probability in [0, 1] of answering with an HTTP 500.
+    response_chars (int): Length of the vision model's answer.
+    transcript_chars (int): Length of the transcription.
+    audio_bytes (int): Size of the MP3 returned per TTS request; 0 uses the bundled sample as-is.
+    """
+
+    def __init__(self, latency=0.0, stage_latency=None, jitter=0.0, error_rate=0.0,
+                 response_chars=1200, transcript_chars=80, audio_bytes=0, seed=None):
+        self.latency = latency
+        self.stage_latency = stage_latency or {}
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.response_chars = response_chars
+        self.transcript_chars = transcript_chars
+        self.audio_bytes = audio_bytes
+        self.random = random.Random(seed)
+
+        with open(os.path.join(REPO_ROOT, "gtts_testing.mp3"), "rb") as f:
+            sample = f.read()
+        if audio_bytes:
+            sample = (sample * (audio_bytes // len(sample) + 1))[:audio_bytes]
+        self.audio = sample
+
+    def text(self, length):
+        sentences = []
+        while sum(len(sentence) + 1 for sentence in sentences) < length:
+            sentences.append(SAMPLE_SENTENCES[len(sentences) % len(SAMPLE_SENTENCES)])
+        return " ".join(sentences)[:max(length, 1)]
+
+    def delay(self, stage):
+        return self.stage_latency.get(stage, self.latency) + self.random.uniform(0, self.jitter)
+
+    def should_fail(self):
+        return self.random.random() < self.error_rate
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type="application/json"):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count(self, stage):
+        with self.server.lock:
+            self.server.requests[stage] = self.server.requests.get(stage, 0) + 1
+
+    def _simulate(self, stage):
+        """Sleep for the configured latency; returns False after sending an injected error."""
+        self._count(stage)
+        time.sleep(self.config.delay(stage))
+        if self.config.should_fail():
+            self._send(500, json.dumps({"error": {"message": f"injected {stage} failure", "type": "server_error"}}))
+            return False
+        return True
+
+    def do_GET(self):
+        # ElevenLabs resolves voice names through the voices list
+        if self.path.startswith("/v1/voices"):
+            self._send(200, json.dumps({"voices": [{"voice_id": "fake-aria", "name": "Aria"}]}))
+            return
+        self._send(404, json.dumps({"error": "not found"}))
+
+    def do_POST(self):
+        body = self._read_body()
+        path = self.path.split("?", 1)[0]
+
+        if path.endswith("/chat/completions"):
+            if self._simulate("vision"):
+                self._chat_completion(json.loads(body))
+        elif path.endswith("/audio/transcriptions"):
+            if self._simulate("stt"):
+                self._send(200, json.dumps({"text": self.config.text(self.config.transcript_chars)}))
+        elif path.endswith("/batchexecute"):
+            if self._simulate("tts"):
+                self._gtts()
+        elif path.startswith("/v1/text-to-speech/"):
+            if self._simulate("tts"):
+                self._send(200, self.config.audio, content_type="audio/mpeg")
+        else:
+            self._send(404, json.dumps({"error": "not found"}))
+
+    def _chat_completion(self, request):
+        text = self.config.text(self.config.response_chars)
+        model = request.get("model", "fake-model")
+        if not request.get("stream"):
+            self._send(200, json.dumps({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                "usage": {"prompt_tokens": 1, "completion_tokens": len(text) // 4, "total_tokens": len(text) // 4 + 1}
+            }))
+            return
+
+        # Server-sent events, one word per chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        words = text.split(" ")
+        for index, word in enumerate(words):
+            delta = word if index == 0 else " " + word
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _gtts(self):
+        # gTTS scans the batchexecute response for the base64 audio after the RPC id
+        encoded = base64.b64encode(self.config.audio).decode("ascii")
+        payload = ")]}'\n\n" + json.dumps([["wrb.fr", "jQ1olc", json.dumps([encoded]), None, None, None, "generic"]], separators=(",", ":")) + "\n"
+        self._send(200, payload, content_type="application/json+protobuf")
+
+
+class FakeServices:
+    """Run the fake APIs on a local port in a background thread."""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), FakeServiceHandler)
+        self.server.daemon_threads = True
+        self.server.config = config or FakeServiceConfig()
+        self.server.lock = threading.Lock()
+        self.server.requests = {}
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def request_counts(self):
+        with self.server.lock:
+            return dict(self.server.requests)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-services", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def point_clients_here(self):
+        """
+        Route the GROQ, ElevenLabs and gTTS clients to this server.
+
+        Must run before the app modules are imported, since they read their settings at import.
+        """
+        os.environ["GROQ_API_KEY"] = "fake-groq-key"
+        os.environ["GROQ_BASE_URL"] = self.base_url
+        os.environ["ELEVENLABS_API_KEY"] = "fake-elevenlabs-key"
+        os.environ["ELEVENLABS_BASE_URL"] = self.base_url
+
+        # gTTS has no endpoint setting; it builds translate.google.<tld> URLs internally
+        import gtts.tts
+        base_url = self.base_url
+        gtts.tts._translate_url = lambda tld="com", path="": f"{base_url}/{path}"
@@ -0,0 +1,268 @@
+"""
+Stage-level benchmarks for the diagnosis pipeline, run against local fake APIs.
+
+Usage:
+    python benchmarks/run_benchmarks.py --iterations 20 --latency 0.05 --error-rate 0.02
+    python benchmarks/run_benchmarks.py --baseline benchmarks/results/<earlier run>.json
+
+Each stage is timed over --iterations runs (p50/p95/p99), then run once more under
+tracemalloc for its peak Python memory. With api_upload selected, the cost of the app's INFO
+logging per request is measured too, against a log sink slowed down by --log-sink-delay.
+Results are written as JSON so runs can be compared.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import platform
+import tracemalloc
+from io import BytesIO
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_services import FakeServices, FakeServiceConfig
+
+IMAGE_FIXTURES = [os.path.join(REPO_ROOT, "acne.jpg"), os.path.join(REPO_ROOT, "skin_rash.jpg")]
+AUDIO_FIXTURE = os.path.join(REPO_ROOT, "patient_voice_test.mp3")
+ALL_STAGES = ["encode_image", "prepare_image", "convert_mp3_to_wav", "transcribe_with_groq",
+              "analyze_image_with_query", "text_to_speech_with_gtts", "api_upload"]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(durations, errors, peak_memory):
+    return {
+        "iterations": len(durations),
+        "errors": errors,
+        "p50_ms": round(percentile(durations, 0.50) * 1000, 3) if durations else None,
+        "p95_ms": round(percentile(durations, 0.95) * 1000, 3) if durations else None,
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 3) if durations else None,
+        "mean_ms": round(sum(durations) / len(durations) * 1000, 3) if durations else None,
+        "max_ms": round(max(durations) * 1000, 3) if durations else None,
+        "peak_memory_bytes": peak_memory
+    }
+
+
+def run_stage(fn, iterations, warmup=1):
+    """Time fn() `iterations` times, then once more under tracemalloc for the memory peak."""
+    for _ in range(warmup):
+        try:
+            fn()
+        except Exception:
+            pass
+
+    durations = []
+    errors = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            errors += 1
+            print(f"    error: {e}", file=sys.stderr)
+            continue
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+    except Exception:
+        pass
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return summarize(durations, errors, peak_memory)
+
+
+def build_stages(work_dir):
+    """Import the app modules (after the fakes are configured) and return the stage callables."""
+    import app
+    from brain_of_the_doctor import encode_image, prepare_image, analyze_image_with_query
+    from voice_of_the_patient import transcribe_with_groq
+    from voice_of_the_doctor import convert_mp3_to_wav, text_to_speech_with_gtts
+
+    counter = {"n": 0}
+
+    def next_path(extension):
+        counter["n"] += 1
+        return os.path.join(work_dir, f"bench-{counter['n']}{extension}")
+
+    encoded = encode_image(IMAGE_FIXTURES[0])
+    client = app.app.test_client()
+
+    def api_upload():
+        with open(AUDIO_FIXTURE, "rb") as audio_file, open(IMAGE_FIXTURES[0], "rb") as image_file:
+            response = client.post("/api/upload", data={
+                "audio": (BytesIO(audio_file.read()), "recording.mp3"),
+                "image": (BytesIO(image_file.read()), "acne.jpg")
+            })
+        if response.status_code != 200:
+            raise RuntimeError(f"/api/upload returned {response.status_code}")
+
+    return {
+        "encode_image": lambda: [encode_image(path) for path in IMAGE_FIXTURES],
+        "prepare_image": lambda: [prepare_image(path) for path in IMAGE_FIXTURES],
+        "convert_mp3_to_wav": lambda: convert_mp3_to_wav(AUDIO_FIXTURE, next_path(".wav")),
+        "transcribe_with_groq": lambda: transcribe_with_groq(
+            stt_model="whisper-large-v3",
+            audio_filepath=AUDIO_FIXTURE,
+            GROQ_API_KEY=os.environ["GROQ_API_KEY"]
+        ),
+        "analyze_image_with_query": lambda: analyze_image_with_query(
+            query="Is there something wrong with my face?",
+            model="meta-llama/llama-4-scout-17b-16e-instruct",
+            encoded_image=encoded
+        ),
+        "text_to_speech_with_gtts": lambda: text_to_speech_with_gtts(
+            input_text="Hello, thank you for sharing this image with me. This looks like mild acne.",
+            output_filepath=next_path(".wav")
+        ),
+        "api_upload": api_upload
+    }
+
+
+def measure_logging_cost(fn, iterations, sink_delay):
+    """
+    Time fn (an /api/upload request) with INFO logging off and on, the records going to a sink
+    that takes sink_delay seconds each, and count the records and their cost to the request thread.
+    """
+    import logging_setup
+
+    class SlowSink(logging.Handler):
+        def emit(self, record):
+            self.format(record)
+            time.sleep(sink_delay)
+
+    sink = SlowSink()
+    sink.setFormatter(logging_setup.JSONFormatter())
+    root = logging.getLogger()
+    previous_level = root.level
+    previous_sinks = logging_setup.listener.handlers
+    logging_setup.listener.handlers = (sink,)
+    try:
+        root.setLevel(logging.WARNING)
+        logging_off = run_stage(fn, iterations)
+        root.setLevel(logging.INFO)
+        logging_setup.stats.reset()
+        logging_on = run_stage(fn, iterations)
+        counted = logging_setup.stats.to_dict()
+    finally:
+        root.setLevel(previous_level)
+        logging_setup.listener.handlers = previous_sinks
+
+    # run_stage also makes one warm-up call and one under tracemalloc
+    requests = iterations + 2
+    return {
+        "sink_delay_ms": sink_delay * 1000,
+        "p50_ms_logging_off": logging_off["p50_ms"],
+        "p50_ms_logging_on": logging_on["p50_ms"],
+        "overhead_p50_ms": round(logging_on["p50_ms"] - logging_off["p50_ms"], 3)
+        if logging_on["p50_ms"] is not None and logging_off["p50_ms"] is not None else None,
+        "records_per_request": round(counted["records"] / requests, 2),
+        "sampled_out_per_request": round(counted["sampled_out"] / requests, 2),
+        "dropped": counted["dropped"],
+        "caller_ms_per_request": round(counted["caller_seconds"] * 1000 / requests, 3)
+    }
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nChange vs {baseline_path}:")
+    for stage, current in results["stages"].items():
+        previous = baseline.get("stages", {}).get(stage)
+        if not previous or not previous.get("p50_ms") or not current.get("p50_ms"):
+            continue
+        change = (current["p50_ms"] - previous["p50_ms"]) / previous["p50_ms"] * 100
+        print(f"  {stage:28s} p50 {previous['p50_ms']:>10.2f} -> {current['p50_ms']:>10.2f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--stages", nargs="+", choices=ALL_STAGES, default=ALL_STAGES)
+    parser.add_argument("--latency", type=float, default=0.0, help="base fake API latency in seconds")
+    parser.add_argument("--stt-latency", type=float, help="override latency for transcription")
+    parser.add_argument("--vision-latency", type=float, help="override latency for chat completions")
+    parser.add_argument("--tts-latency", type=float, help="override latency for TTS requests")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake API calls answering HTTP 500")
+    parser.add_argument("--response-chars", type=int, default=1200, help="length of the fake diagnosis")
+    parser.add_argument("--audio-bytes", type=int, default=0, help="size of each fake TTS response")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="keep the app's INFO logging")
+    parser.add_argument("--log-sink-delay", type=float, default=0.002,
+                        help="seconds the log sink takes per record when measuring logging cost")
+    args = parser.parse_args()
+
+    stage_latency = {stage: value for stage, value in (
+        ("stt", args.stt_latency), ("vision", args.vision_latency), ("tts", args.tts_latency)) if value is not None}
+    config = FakeServiceConfig(latency=args.latency, stage_latency=stage_latency, jitter=args.jitter,
+                               error_rate=args.error_rate, response_chars=args.response_chars,
+                               audio_bytes=args.audio_bytes, seed=args.seed)
+    services = FakeServices(config).start()
+    services.point_clients_here()
+
+    work_dir = tempfile.mkdtemp(prefix="arogya-bench-")
+    # Disable the diagnosis caches so every iteration exercises the full stage
+    os.environ["CACHE_DIR"] = os.path.join(work_dir, "cache")
+    os.environ["CACHE_MEMORY_MAX_BYTES"] = "0"
+    os.environ["CACHE_DISK_MAX_BYTES"] = "0"
+    os.environ["UPLOAD_FOLDER"] = os.path.join(work_dir, "uploads")
+    # Finish warming up before anything is timed
+    os.environ["STARTUP_PREWARM"] = "blocking"
+
+    try:
+        stages = build_stages(work_dir)
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        results = {
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": vars(args),
+            "stages": {}
+        }
+        for name in args.stages:
+            print(f"Benchmarking {name}...")
+            results["stages"][name] = run_stage(stages[name], args.iterations)
+            summary = results["stages"][name]
+            print(f"  p50 {summary['p50_ms']} ms  p95 {summary['p95_ms']} ms  p99 {summary['p99_ms']} ms  "
+                  f"peak {summary['peak_memory_bytes']} B  errors {summary['errors']}")
+        if "api_upload" in args.stages:
+            print("Measuring logging cost per request...")
+            results["logging"] = measure_logging_cost(stages["api_upload"], args.iterations, args.log_sink_delay)
+            cost = results["logging"]
+            print(f"  {cost['records_per_request']} records/request, {cost['caller_ms_per_request']} ms on the request "
+                  f"thread, p50 {cost['p50_ms_logging_off']} -> {cost['p50_ms_logging_on']} ms")
+        results["fake_api_requests"] = services.request_counts
+    finally:
+        services.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = args.output or os.path.join(BENCHMARK_DIR, "results", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nWrote {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
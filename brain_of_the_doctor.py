@@ -1,14 +1,10 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
+# Loads .env and configures logging
+import environment
 
 #Step1: Setup API keys
 import os
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
 GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
 GOOGLE_VISION_API_KEY=os.environ.get("GOOGLE_VISION_API_KEY")
 
@@ -22,84 +18,225 @@ def encode_image(image_path):
     image_file=open(image_path, "rb")
     return base64.b64encode(image_file.read()).decode('utf-8')
 
+#Step2b: Shrink the image before encoding it
+from image_preprocessing import preprocess_image, IMAGE_MAX_SIDE
+
+from storage_manager import read_input
+from metrics import span, PAYLOAD_BYTES, FALLBACKS
+from logging_setup import phi
+
+def prepare_image(image_source, max_side=IMAGE_MAX_SIDE):
+    """
+    Preprocess and base64-encode an image for the vision model.
+
+    Args:
+    image_source: A file path, or an in-memory (filename, bytes) pair.
+    max_side (int): Longest side in pixels to downscale to (see quality_profiles).
+
+    Returns:
+    tuple: (encoded_image, mime_type) for analyze_image_with_query.
+    """
+    with span("encode"):
+        original = read_input(image_source)
+        image_bytes, mime_type = preprocess_image(original, max_side=max_side)
+        encoded_image = base64.b64encode(image_bytes).decode('utf-8')
+    PAYLOAD_BYTES.observe(len(original), kind="image_original")
+    PAYLOAD_BYTES.observe(len(encoded_image), kind="image_encoded")
+    return encoded_image, mime_type
+
 #Step3: Setup Multimodal LLM
-from groq import Groq
+import time
+from api_clients import get_groq_client, VISION_TIMEOUT
+from model_router import vision_router, AllModelsFailed
 
 query="Is there something wrong with my face?"
 model="meta-llama/llama-4-scout-17b-16e-instruct"  # This is a currently supported vision model
 
-def analyze_image_with_query(query, model, encoded_image):
+# Fallback to a non-vision model if every vision model is unavailable
+TEXT_FALLBACK_MODEL = "llama-3.1-8b-instant"
+
+def fallback_models(model, models=None):
+    # Vision models to try, in order of preference; the router reorders them by health.
+    # A quality profile passes its own list as models
+    return list(dict.fromkeys([model] + list(models or [
+        "meta-llama/llama-4-scout-17b-16e-instruct",  # Then try Llama 4 Scout
+        "llama-3.2-90b-vision-preview"  # Then try Llama 3.2 90B
+    ])))
+
+def is_degraded_model(model):
+    # None (no model answered) or the text-only fallback, which never saw the image: no diagnosis, never cache it
+    return model is None or model == TEXT_FALLBACK_MODEL
+
+def build_messages(query, model, encoded_image, mime_type="image/jpeg", history=None):
+    """
+    Chat messages for one question about the image.
+
+    history is an optional list of earlier (question, answer) pairs, oldest first; the image is
+    attached to the first user message of the conversation, so it is only sent once per call.
+    """
+    turns = [(question, answer) for question, answer in history or []]
+    questions = [question for question, _ in turns] + [query]
+    # Prepare the message content based on whether the model supports vision
+    if "vision" in model or "scout" in model:
+        # Vision-capable model
+        first_message = {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": questions[0]
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:{mime_type};base64,{encoded_image}",
+                    },
+                },
+            ],
+        }
+    else:
+        # Non-vision model (fallback)
+        note = "\n\nNote: I would analyze your image, but I'm currently using a non-vision model as a fallback. Please try again later when vision models are available."
+        first_message = {
+            "role": "user",
+            "content": questions[0] + (note if not turns else "")
+        }
+        if turns:
+            questions[-1] += note
+
+    messages = [first_message]
+    for index, (_, answer) in enumerate(turns):
+        messages.append({"role": "assistant", "content": answer})
+        messages.append({"role": "user", "content": questions[index + 1]})
+    return messages
+
+def analyze_image_with_query(query, model, encoded_image, mime_type="image/jpeg", history=None,
+                             max_tokens=800, temperature=0.7, models=None, with_model=False):
+    """
+    Ask the vision models about the image, falling back to the text-only model and then to an apology.
+
+    with_model True returns (response, model) instead of the response alone, where model is the
+    one that answered, or None when none did (see is_degraded_model).
+    """
+    def answer(response, used_model):
+        return (response, used_model) if with_model else response
+
     if not GROQ_API_KEY or GROQ_API_KEY == "your_groq_api_key_here":
         error_message = "ERROR: GROQ_API_KEY is not set or is using the default placeholder value."
         logging.error(error_message)
-        return error_message + "\n\nPlease add your actual GROQ API key to the .env file. You can get an API key from https://console.groq.com/"
-
-    # List of models to try in order of preference
-    models_to_try = [
-        model,  # Try the requested model first
-        "meta-llama/llama-4-scout-17b-16e-instruct",  # Then try Llama 4 Scout
-        "llama-3.2-90b-vision-preview",  # Then try Llama 3.2 90B
-        "claude-3-5-sonnet-20240620",  # Try Claude 3.5 Sonnet
-        "gemini-1.5-pro-latest",  # Try Gemini 1.5 Pro
-        "llama-3.1-8b-instant"  # Fallback to a non-vision model if needed
-    ]
+        return answer(error_message + "\n\nPlease add your actual GROQ API key to the .env file. You can get an API key from https://console.groq.com/", None)
+
+    # One pooled client for the whole fallback chain, so retries reuse the open connection
+    client = get_groq_client(GROQ_API_KEY)
+
+    def attempt(current_model):
+        logging.info(f"Attempting to use model: {current_model}")
+        chat_completion = client.chat.completions.create(
+            messages=build_messages(query, current_model, encoded_image, mime_type, history),
+            model=current_model,
+            temperature=temperature,  # 0.7 by default, for some creativity
+            max_tokens=max_tokens,    # 800 by default, for a detailed response
+            timeout=VISION_TIMEOUT
+        )
+        response = chat_completion.choices[0].message.content
+        logging.info(f"Successfully used model {current_model}")
+        logging.info("Received response from GROQ API", extra=phi(diagnosis=response))
+        return response, current_model
+
+    # The router skips models with an open circuit breaker and tries the healthiest first;
+    # the text-only model is only used once every vision model has failed
+    with span("vision") as vision_span:
+        try:
+            return answer(*vision_router.call(fallback_models(model, models), attempt))
+        except AllModelsFailed as e:
+            last_error = e.last_error
+        FALLBACKS.inc(kind="text_model")
+        try:
+            return answer(*vision_router.call([TEXT_FALLBACK_MODEL], attempt))
+        except AllModelsFailed as e:
+            last_error = e.last_error
+        vision_span.fail()
 
-    last_error = None
+    # If we get here, all models failed
+    FALLBACKS.inc(kind="vision_unavailable")
+    error_message = f"All models failed. Last error: {last_error}"
+    logging.error(error_message)
+    return answer(f"I apologize, but I'm currently unable to analyze your image. Our vision analysis service is temporarily unavailable. Please try again later or consult with a healthcare professional directly.\n\nTechnical details: {str(last_error)}", None)
+
+def stream_image_analysis(query, model, encoded_image, mime_type="image/jpeg", max_tokens=800, temperature=0.7, models=None,
+                          on_model=None):
+    """
+    Streaming variant of analyze_image_with_query that yields the response as text deltas.
+
+    Falls back through the same model list, in the router's health order, but only until
+    a model has produced output; once text has been yielded a mid-stream failure is logged
+    and the stream ends. Streams are never hedged. on_model(model), if given, is called with
+    the model whose text is being yielded, or None for an error message; it is called again
+    with None when the stream breaks off midway, since the text is then incomplete.
+    """
+    def answering(used_model):
+        if on_model is not None:
+            on_model(used_model)
 
-    # Try each model in sequence until one works
-    for current_model in models_to_try:
+    if not GROQ_API_KEY or GROQ_API_KEY == "your_groq_api_key_here":
+        error_message = "ERROR: GROQ_API_KEY is not set or is using the default placeholder value."
+        logging.error(error_message)
+        answering(None)
+        yield error_message + "\n\nPlease add your actual GROQ API key to the .env file. You can get an API key from https://console.groq.com/"
+        return
+
+    last_error = RuntimeError("every model's circuit breaker is open")
+    client = get_groq_client(GROQ_API_KEY)
+
+    attempted = False
+    for current_model in vision_router.order(fallback_models(model, models)) + [TEXT_FALLBACK_MODEL]:
+        if not vision_router.acquire(current_model):
+            continue
+        if current_model == TEXT_FALLBACK_MODEL:
+            FALLBACKS.inc(kind="text_model")
+        elif attempted:
+            vision_router.fallback(current_model, last_error)
+        attempted = True
+        started = False
+        start_time = time.monotonic()
         try:
-            client = Groq(api_key=GROQ_API_KEY)
-
-            # Prepare the message content based on whether the model supports vision
-            if "vision" in current_model or "scout" in current_model or "claude" in current_model or "gemini" in current_model:
-                # Vision-capable model
-                messages = [
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": query
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{encoded_image}",
-                                },
-                            },
-                        ],
-                    }
-                ]
-            else:
-                # Non-vision model (fallback)
-                messages = [
-                    {
-                        "role": "user",
-                        "content": f"{query}\n\nNote: I would analyze your image, but I'm currently using a non-vision model as a fallback. Please try again later when vision models are available."
-                    }
-                ]
-
-            logging.info(f"Attempting to use model: {current_model}")
-            chat_completion = client.chat.completions.create(
-                messages=messages,
+            logging.info(f"Attempting to stream from model: {current_model}")
+            stream = client.chat.completions.create(
+                messages=build_messages(query, current_model, encoded_image, mime_type),
                 model=current_model,
-                temperature=0.7,  # Add some creativity
-                max_tokens=800    # Ensure we get a detailed response
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                timeout=VISION_TIMEOUT
             )
-
-            response = chat_completion.choices[0].message.content
-            logging.info(f"Successfully used model {current_model}")
-            logging.info(f"Received response from GROQ API: {response[:100]}...")
-            return response
-
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not started:
+                        answering(current_model)
+                    started = True
+                    yield delta
+            vision_router.record(current_model, time.monotonic() - start_time, success=True)
+            logging.info(f"Successfully streamed from model {current_model}")
+            return
+
+        except GeneratorExit:
+            # The consumer stopped reading; the model itself was answering fine
+            vision_router.record(current_model, time.monotonic() - start_time, success=True)
+            raise
         except Exception as e:
+            vision_router.record(current_model, time.monotonic() - start_time, success=False)
+            if started:
+                logging.error(f"Stream from model {current_model} failed midway: {e}")
+                answering(None)
+                return
             last_error = e
-            error_message = f"Error with model {current_model}: {e}"
-            logging.warning(error_message)
-            # Continue to the next model
+            logging.warning(f"Error with model {current_model}: {e}")
 
-    # If we get here, all models failed
+    FALLBACKS.inc(kind="vision_unavailable")
     error_message = f"All models failed. Last error: {last_error}"
     logging.error(error_message)
-    return f"I apologize, but I'm currently unable to analyze your image. Our vision analysis service is temporarily unavailable. Please try again later or consult with a healthcare professional directly.\n\nTechnical details: {str(last_error)}"
\ No newline at end of file
+    answering(None)
+    yield f"I apologize, but I'm currently unable to analyze your image. Our vision analysis service is temporarily unavailable. Please try again later or consult with a healthcare professional directly.\n\nTechnical details: {str(last_error)}"
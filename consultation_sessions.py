@@ -0,0 +1,277 @@
+#Multi-turn consultations: the image is preprocessed once and follow-up questions reuse it
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from storage_manager import private_dir, open_private
+
+SESSION_MAX_COUNT=int(os.environ.get("SESSION_MAX_COUNT", "256"))
+SESSION_MEMORY_MAX_BYTES=int(os.environ.get("SESSION_MEMORY_MAX_BYTES", str(128 * 1024 * 1024)))
+SESSION_TTL_SECONDS=int(os.environ.get("SESSION_TTL_SECONDS", "1800"))
+# Earlier questions and answers sent back to the model with each follow-up, newest first
+SESSION_HISTORY_TOKEN_BUDGET=int(os.environ.get("SESSION_HISTORY_TOKEN_BUDGET", "1500"))
+# With several server processes, sessions are mirrored here so any worker can continue one
+SESSION_DIR=os.environ.get("SESSION_DIR")
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English; close enough for a budget
+    return max(1, len(text) // 4)
+
+
+class ConsultationSession:
+    def __init__(self, session_id, encoded_image, mime_type, turns=None, created_at=None):
+        self.id = session_id
+        self.encoded_image = encoded_image
+        self.mime_type = mime_type
+        self.turns = turns or []  # [question, answer] pairs, oldest first
+        self.created_at = created_at or time.time()
+        self.last_used = time.time()
+        # Modification time of the mirrored file this copy matches, when sessions are mirrored
+        self.saved_mtime = None
+        # Guards reading the history and recording a turn; not held while a question is answered
+        self.lock = threading.Lock()
+
+    @property
+    def size(self):
+        return len(self.encoded_image) + sum(len(question) + len(answer) for question, answer in self.turns)
+
+    def history(self, token_budget=SESSION_HISTORY_TOKEN_BUDGET):
+        """The most recent turns that fit in token_budget, oldest first."""
+        kept = []
+        used = 0
+        for question, answer in reversed(self.turns):
+            cost = estimate_tokens(question) + estimate_tokens(answer)
+            if used + cost > token_budget:
+                break
+            kept.append((question, answer))
+            used += cost
+        return list(reversed(kept))
+
+    def conversation(self, system_prompt, question, token_budget=SESSION_HISTORY_TOKEN_BUDGET):
+        """
+        (history, query) for analyze_image_with_query. The system prompt goes in front of the
+        first message that is still sent, which is also the one carrying the image.
+        """
+        history = self.history(token_budget)
+        if not history:
+            return [], system_prompt + question
+        first_question, first_answer = history[0]
+        return [(system_prompt + first_question, first_answer)] + history[1:], question
+
+    def add_turn(self, question, answer):
+        self.turns.append([question, answer])
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "turns": [{"question": question, "answer": answer} for question, answer in self.turns],
+            "created_at": self.created_at,
+            "expires_at": self.last_used + SESSION_TTL_SECONDS
+        }
+
+
+class SessionStore:
+    """
+    In-memory LRU of consultation sessions, bounded by count and by bytes, with an idle TTL.
+
+    With a directory, every change is also written to <directory>/<id>.json and a session
+    missing (or out of date) in memory is loaded from there, so several worker processes can
+    serve the same consultation.
+    """
+
+    def __init__(self, max_count=SESSION_MAX_COUNT, max_bytes=SESSION_MEMORY_MAX_BYTES, ttl=SESSION_TTL_SECONDS,
+                 directory=SESSION_DIR):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._stats = {"created": 0, "hits": 0, "misses": 0, "expired": 0, "evicted": 0, "loaded": 0}
+        if directory:
+            private_dir(directory)
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.json")
+
+    def _remove_files(self, session_id):
+        """Remove the mirrored session and its lock file; True if the session file was there."""
+        try:
+            os.remove(os.path.join(self.directory, f"{session_id}.lock"))
+        except FileNotFoundError:
+            pass
+        try:
+            os.remove(self._path(session_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+    @contextmanager
+    def _file_lock(self, session_id):
+        """Hold the session's lock file, so workers recording turns of one session take turns."""
+        if not self.directory:
+            yield
+            return
+        import fcntl
+
+        fd = os.open(os.path.join(self.directory, f"{session_id}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # Closing the descriptor releases the lock
+            os.close(fd)
+
+    def _saved_turns(self, session):
+        """The mirrored turns if another worker has saved the session since this copy was, else None."""
+        if not self.directory:
+            return None
+        try:
+            mtime = os.stat(self._path(session.id)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        if mtime == session.saved_mtime:
+            return None
+        loaded = self._load(session.id, mtime)
+        return loaded.turns if loaded is not None else None
+
+    @staticmethod
+    def _valid_id(session_id):
+        # Session IDs are uuid4 hex; anything else never reaches the file system
+        return len(session_id) == 32 and all(c in "0123456789abcdef" for c in session_id)
+
+    def _remove(self, session_id):
+        # Caller holds self._lock
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._bytes -= session.size
+        return session
+
+    def _insert(self, session):
+        # Caller holds self._lock
+        self._remove(session.id)
+        self._sessions[session.id] = session
+        self._bytes += session.size
+        while self._sessions and (len(self._sessions) > self.max_count or self._bytes > self.max_bytes):
+            oldest_id = next(iter(self._sessions))
+            if oldest_id == session.id:
+                break
+            self._remove(oldest_id)
+            self._stats["evicted"] += 1
+
+    def _save(self, session):
+        if not self.directory:
+            return
+        path = self._path(session.id)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open_private(temp_path) as f:
+            json.dump({
+                "encoded_image": session.encoded_image,
+                "mime_type": session.mime_type,
+                "turns": session.turns,
+                "created_at": session.created_at
+            }, f)
+        os.replace(temp_path, path)
+        session.saved_mtime = os.stat(path).st_mtime_ns
+
+    def _load(self, session_id, mtime):
+        try:
+            with open(self._path(session_id)) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        session = ConsultationSession(session_id, data["encoded_image"], data["mime_type"], data["turns"],
+                                      data["created_at"])
+        session.saved_mtime = mtime
+        return session
+
+    def _sync(self, session_id, session):
+        """Reconcile the in-memory copy with the mirrored file; its mtime is when the last turn was saved."""
+        if not self._valid_id(session_id):
+            return None
+        try:
+            stat = os.stat(self._path(session_id))
+        except FileNotFoundError:
+            # Deleted, or expired, by another worker
+            return None
+        if time.time() - stat.st_mtime > self.ttl:
+            self._remove_files(session_id)
+            return None
+        if session is not None and session.saved_mtime == stat.st_mtime_ns:
+            return session
+        # Another worker has answered a newer turn for this session
+        loaded = self._load(session_id, stat.st_mtime_ns)
+        if loaded is not None:
+            with self._lock:
+                self._stats["loaded"] += 1
+        return loaded
+
+    def create(self, encoded_image, mime_type):
+        session = ConsultationSession(uuid.uuid4().hex, encoded_image, mime_type)
+        with self._lock:
+            self._insert(session)
+            self._stats["created"] += 1
+        self._save(session)
+        return session
+
+    def get(self, session_id):
+        """The live session, or None if it never existed, expired or was evicted."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and time.time() - session.last_used > self.ttl:
+                self._remove(session_id)
+                self._stats["expired"] += 1
+                session = None
+        if self.directory:
+            session = self._sync(session_id, session)
+        with self._lock:
+            if session is None:
+                self._remove(session_id)
+                self._stats["misses"] += 1
+                return None
+            session.last_used = time.time()
+            self._insert(session)
+            self._stats["hits"] += 1
+        return session
+
+    def record_turn(self, session, question, answer):
+        # Two workers may each answer a question of the same session; the file lock makes the
+        # second one append to the first one's turns instead of overwriting them
+        with self._file_lock(session.id):
+            saved_turns = self._saved_turns(session)
+            with self._lock:
+                tracked = session.id in self._sessions
+                if tracked:
+                    self._bytes -= session.size
+                if saved_turns is not None:
+                    session.turns = saved_turns
+                session.add_turn(question, answer)
+                session.last_used = time.time()
+                if tracked:
+                    self._bytes += session.size
+            self._save(session)
+
+    def delete(self, session_id):
+        with self._lock:
+            session = self._remove(session_id)
+        removed = session is not None
+        if self.directory and self._valid_id(session_id):
+            removed = self._remove_files(session_id) or removed
+        if removed:
+            logging.info(f"Deleted consultation session {session_id}")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, sessions=len(self._sessions), bytes=self._bytes,
+                        max_count=self.max_count, max_bytes=self.max_bytes, ttl_seconds=self.ttl)
+
+
+sessions = SessionStore()
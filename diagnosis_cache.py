@@ -0,0 +1,262 @@
+#Content-addressed cache for vision diagnoses and synthesized audio
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from storage_manager import private_dir, open_private
+
+CACHE_DIR=os.environ.get("CACHE_DIR", "cache")
+CACHE_MEMORY_MAX_BYTES=int(os.environ.get("CACHE_MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_DISK_MAX_BYTES=int(os.environ.get("CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024)))
+# Disk entries older than this (since written) are dropped on read, so a bad entry can't outlive it; 0 keeps them
+CACHE_DISK_TTL_SECONDS=float(os.environ.get("CACHE_DISK_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def make_key(*parts):
+    """Hash the given str/bytes parts into a hex cache key."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Length-prefix each part so ("ab", "c") and ("a", "bc") don't collide
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def normalize_transcript(text):
+    """Normalize a transcript so trivially different re-submissions share a key."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class DiagnosisCache:
+    """
+    Two-tier (memory LRU + disk) cache of bytes values keyed by content hash.
+
+    Both tiers are capped in bytes and evict least recently used entries first; disk
+    entries also expire disk_ttl seconds after they were written.
+    get_or_compute() collapses concurrent misses on the same key into one call.
+    """
+
+    def __init__(self, name, directory, memory_max_bytes=CACHE_MEMORY_MAX_BYTES, disk_max_bytes=CACHE_DISK_MAX_BYTES,
+                 disk_ttl=CACHE_DISK_TTL_SECONDS):
+        self.name = name
+        self.directory = directory
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_ttl = disk_ttl
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight = {}
+        self._counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "joined": 0, "evictions": 0, "expired": 0}
+
+        # Diagnoses and synthesized speech are patient data: each cache's own directory is this user's only
+        private_dir(directory, tighten=True)
+        self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def get(self, key):
+        with self._lock:
+            value = self._memory_get(key)
+            if value is not None:
+                self._counters["memory_hits"] += 1
+                return value
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is not None:
+                self._counters["disk_hits"] += 1
+                self._memory_put(key, value)
+            else:
+                self._counters["misses"] += 1
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def get_or_compute(self, key, compute, should_cache=None):
+        """
+        Return the cached value for key, or compute() it and cache the result.
+
+        Callers that arrive while another caller is computing the same key wait for
+        that result instead of computing it again. should_cache(value) can veto caching
+        a result (e.g. an error message); joined callers still receive it.
+        """
+        with self._lock:
+            value = self._memory_get(key)
+            if value is not None:
+                self._counters["memory_hits"] += 1
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+            else:
+                self._counters["joined"] += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            value = self._disk_get(key)
+            if value is not None:
+                with self._lock:
+                    self._counters["disk_hits"] += 1
+                    self._memory_put(key, value)
+            else:
+                with self._lock:
+                    self._counters["misses"] += 1
+                value = compute()
+                if should_cache is None or should_cache(value):
+                    self.put(key, value)
+            flight.value = value
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.event.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats.update({
+                "hit_ratio": round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "inflight": len(self._inflight)
+            })
+        return stats
+
+    # Memory tier; callers hold self._lock
+
+    def _memory_get(self, key):
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+        return value
+
+    def _memory_put(self, key, value):
+        if len(value) > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_bytes += len(value)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # Disk tier
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _disk_get(self, key):
+        path = self._disk_path(key)
+        try:
+            written = os.stat(path).st_mtime
+            if self.disk_ttl > 0 and time.time() - written > self.disk_ttl:
+                self._disk_remove(path)
+                return None
+            with open(path, "rb") as f:
+                value = f.read()
+            # Bump the atime so eviction is least-recently-used; the mtime stays the write time the TTL runs from
+            os.utime(path, (time.time(), written))
+            return value
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning(f"Could not read {self.name} cache entry {key}: {e}")
+            return None
+
+    def _disk_remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._disk_bytes -= size
+            self._counters["expired"] += 1
+
+    def _disk_put(self, key, value):
+        if len(value) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open_private(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write {self.name} cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            self._disk_bytes += len(value) - previous_size
+            over_quota = self._disk_bytes > self.disk_max_bytes
+        if over_quota:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_atime, stat.st_size, entry.path))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in entries:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+
+        with self._lock:
+            self._disk_bytes = total
+            self._counters["evictions"] += evicted
+        logging.info(f"Evicted {evicted} entries from the {self.name} cache, {total} bytes on disk")
+
+
+# Vision responses, keyed on image bytes, normalized transcript, system prompt and model
+vision_cache = DiagnosisCache("vision", os.path.join(CACHE_DIR, "vision"))
+
+# Synthesized doctor responses, keyed on response text and TTS settings
+tts_cache = DiagnosisCache("tts", os.path.join(CACHE_DIR, "tts"))
+
+# Individual sentences, keyed on normalized text, engine, voice and output format
+phrase_cache = DiagnosisCache("phrases", os.path.join(CACHE_DIR, "phrases"))
+
+
+def cache_stats():
+    return {cache.name: cache.stats() for cache in (vision_cache, tts_cache, phrase_cache)}
@@ -0,0 +1,192 @@
+#Background job runner for diagnosis requests
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from logging_setup import carry_request_id
+from storage_manager import private_dir, open_private
+
+DIAGNOSIS_WORKERS=int(os.environ.get("DIAGNOSIS_WORKERS", "4"))
+MAX_PENDING_JOBS=int(os.environ.get("MAX_PENDING_JOBS", "32"))
+JOB_RETENTION_SECONDS=int(os.environ.get("JOB_RETENTION_SECONDS", "600"))
+# With several server processes, job events are mirrored here so any worker can answer for a job
+JOB_EVENTS_DIR=os.environ.get("JOB_EVENTS_DIR")
+JOB_EVENTS_POLL_SECONDS=float(os.environ.get("JOB_EVENTS_POLL_SECONDS", "0.25"))
+
+# Events that end a job's event stream; "busy" means the job was turned away for load, not that it failed
+TERMINAL_EVENTS = ("done", "error", "busy")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, events_path=None):
+        self.id = job_id
+        self.events_path = events_path
+        self.status = "queued"  # queued -> running -> done | error | busy
+        self.stage = "queued"
+        self.result = None
+        self.error = None
+        # Seconds to wait before submitting the job again, when it is "busy"
+        self.retry_after = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.events = []
+        self._cond = threading.Condition()
+
+    def emit(self, event, data=None):
+        with self._cond:
+            if event not in TERMINAL_EVENTS:
+                self.stage = event
+            self.events.append((event, data or {}))
+            if self.events_path:
+                with open_private(self.events_path, "a") as f:
+                    f.write(json.dumps([event, data or {}]) + "\n")
+            self._cond.notify_all()
+
+    def wait_for_events(self, cursor, timeout):
+        """Return the events after `cursor`, waiting up to `timeout` seconds for new ones."""
+        with self._cond:
+            if cursor >= len(self.events):
+                self._cond.wait(timeout)
+            return self.events[cursor:]
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "result": self.result,
+            "error": self.error,
+            "retry_after": self.retry_after
+        }
+
+
+class RemoteJob:
+    """Read-only view of a job running in another worker process, rebuilt from its event file."""
+
+    def __init__(self, job_id, events_path):
+        self.id = job_id
+        self.events_path = events_path
+
+    def _read_events(self):
+        try:
+            with open(self.events_path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        # A line still being written has no newline yet; pick it up on the next read
+        return [tuple(json.loads(line)) for line in lines if line.endswith("\n")]
+
+    def wait_for_events(self, cursor, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self._read_events()
+            if len(events) > cursor or time.monotonic() >= deadline:
+                return events[cursor:]
+            time.sleep(JOB_EVENTS_POLL_SECONDS)
+
+    def to_dict(self):
+        job = Job(self.id)
+        job.status = "queued"
+        for event, data in self._read_events():
+            job.emit(event, data)
+            if event == "started":
+                job.status = "running"
+            elif event == "done":
+                job.status, job.result = "done", data
+            elif event == "error":
+                job.status, job.error = "error", data.get("message")
+            elif event == "busy":
+                job.status, job.error, job.retry_after = "busy", data.get("message"), data.get("retry_after")
+        return job.to_dict()
+
+
+class JobManager:
+    def __init__(self, max_workers=DIAGNOSIS_WORKERS, max_pending=MAX_PENDING_JOBS, retention=JOB_RETENTION_SECONDS,
+                 events_dir=JOB_EVENTS_DIR):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="diagnosis")
+        self._max_pending = max_pending
+        self._retention = retention
+        self._events_dir = events_dir
+        if events_dir:
+            private_dir(events_dir)
+        self._jobs = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, on_stage=..., **kwargs) on the worker pool and return its Job right away.
+
+        Raises JobQueueFull when max_pending jobs are already queued or running.
+        """
+        with self._lock:
+            self._prune()
+            if self._pending >= self._max_pending:
+                raise JobQueueFull(f"{self._pending} diagnosis jobs already pending")
+            job_id = uuid.uuid4().hex
+            job = Job(job_id, self._events_path(job_id))
+            self._jobs[job.id] = job
+            self._pending += 1
+
+        job.emit("queued")
+        self._executor.submit(carry_request_id(self._run), job, fn, args, kwargs)
+        return job
+
+    def _events_path(self, job_id):
+        return os.path.join(self._events_dir, f"{job_id}.jsonl") if self._events_dir else None
+
+    def get(self, job_id):
+        """The job with this ID, whether it runs in this process or (with an events dir) another one."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self._events_dir and all(c in "0123456789abcdef" for c in job_id):
+            events_path = self._events_path(job_id)
+            if os.path.exists(events_path):
+                return RemoteJob(job_id, events_path)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = "running"
+        job.emit("started")
+        try:
+            job.result = fn(*args, on_stage=job.emit, **kwargs)
+            job.status = "done"
+            job.emit("done", job.result)
+        except Exception as e:
+            job.error = str(e)
+            # Admission control turns a job away with a Retry-After hint (see admission.AdmissionRejected);
+            # that is not a failure, and the client should submit the job again later
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                logging.warning(f"Diagnosis job {job.id} turned away: {e}")
+                job.retry_after = retry_after
+                job.status = "busy"
+                job.emit("busy", {"message": job.error, "retry_after": retry_after})
+            else:
+                logging.error(f"Diagnosis job {job.id} failed: {e}")
+                job.status = "error"
+                job.emit("error", {"message": job.error})
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+
+    def _prune(self):
+        # Caller holds self._lock
+        cutoff = time.time() - self._retention
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if job.events_path:
+                try:
+                    os.remove(job.events_path)
+                except FileNotFoundError:
+                    pass
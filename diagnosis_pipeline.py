@@ -0,0 +1,380 @@
+#Diagnosis pipeline shared by the web entry points
+import os
+import logging
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from brain_of_the_doctor import prepare_image, analyze_image_with_query, stream_image_analysis, is_degraded_model
+from voice_of_the_patient import transcribe_audio
+from voice_of_the_doctor import (text_to_speech_bytes, synthesize_text, first_engine, error_audio_bytes,
+                                 convert_audio, iter_sentences, AUDIO_FORMATS, AUDIO_EXTENSIONS)
+from tts_engines import TTS_ENGINE
+from quality_profiles import resolve_profile
+from diagnosis_cache import vision_cache, tts_cache, make_key, normalize_transcript
+from storage_manager import storage, input_digest, open_private
+from metrics import span, StageTimer, PAYLOAD_BYTES
+from logging_setup import phi, carry_request_id
+from media_serving import digests
+
+# Normalize and trim recordings before upload (see audio_preprocessing)
+STT_PREPROCESS_AUDIO=os.environ.get("STT_PREPROCESS_AUDIO", "1") == "1"
+
+# Stage names reported to on_stage callbacks, in the order they complete
+STAGES = ("transcribed", "diagnosed", "audio_ready")
+
+# Image preparation runs on this pool while the request's own thread transcribes the question
+PIPELINE_PREP_WORKERS=int(os.environ.get("PIPELINE_PREP_WORKERS", "8"))
+image_prep_executor = ThreadPoolExecutor(max_workers=PIPELINE_PREP_WORKERS, thread_name_prefix="image-prep")
+
+# System prompt for the doctor; here rather than in app.py so batch_cli can diagnose without starting the server
+system_prompt = """You are Dr. Arogya, a professional dermatologist with expertise in skin conditions and medical diagnosis.
+            Analyze the uploaded image carefully and provide a detailed medical assessment.
+            If you identify any skin condition or medical issue, provide a clear diagnosis and suggest appropriate remedies or treatments.
+            Your response should be structured as follows:
+            1. Begin with a greeting and acknowledge what you see in the image
+            2. Provide your professional assessment of any medical conditions visible
+            3. Suggest possible treatments or next steps
+            4. End with reassurance and professional closing
+
+            Speak directly to the patient as if in a doctor's office. Be thorough but compassionate.
+            Do not use markdown formatting or mention that you are an AI. Respond as a real doctor would.
+            If the image is unclear or you cannot make a definitive diagnosis, be honest about limitations and suggest seeking in-person medical advice."""
+
+def is_error_response(text):
+    # The STT and vision helpers return error messages instead of raising; never cache those
+    return text.startswith("ERROR:") or text.startswith("I apologize, but I'm currently unable")
+
+def vision_cache_key(image_filepath, transcription, system_prompt, profile):
+    # Uploads are keyed by the digest taken while they streamed in, so the bytes aren't hashed again;
+    # each quality profile gets answers of its own
+    return make_key(input_digest(image_filepath), normalize_transcript(transcription), profile.prompt(system_prompt),
+                    profile.name, profile.vision_model)
+
+
+def start_image_prep(image_filepath, timer, profile):
+    """Decode, shrink and encode the image on image_prep_executor; returns a future of (encoded_image, mime_type)."""
+    def prep():
+        with timer.stage("image_prep"):
+            return prepare_image(image_filepath, max_side=profile.image_max_side)
+    return image_prep_executor.submit(carry_request_id(prep))
+
+def cached_diagnosis(image_filepath, transcription, system_prompt, prepared_image=None, timer=None, profile=None):
+    """
+    Analyze the image, reusing (or joining an in-flight call for) an identical earlier request.
+
+    prepared_image is an optional future from start_image_prep; without one the image is
+    prepared here. timer, if given, records the vision call as the "vision" stage. profile is
+    the QualityProfile to answer with (QUALITY_PROFILE by default).
+    """
+    profile = profile or resolve_profile(None)
+    answered_by = []
+
+    def compute():
+        if prepared_image is not None:
+            encoded_image, mime_type = prepared_image.result()
+        else:
+            encoded_image, mime_type = prepare_image(image_filepath, max_side=profile.image_max_side)
+        with timer.stage("vision") if timer is not None else nullcontext():
+            doctor_response, model = analyze_image_with_query(
+                query=profile.prompt(system_prompt) + transcription,
+                encoded_image=encoded_image,
+                model=profile.vision_model,
+                mime_type=mime_type,
+                max_tokens=profile.max_tokens,
+                temperature=profile.temperature,
+                models=profile.vision_models,
+                with_model=True
+            )
+        answered_by.append(model)
+        return doctor_response.encode("utf-8")
+
+    if is_error_response(transcription):
+        return compute().decode("utf-8")
+
+    key = vision_cache_key(image_filepath, transcription, system_prompt, profile)
+    # A fallback answer (text-only model or apology) would otherwise be served for this image and question for good
+    def should_cache(value):
+        return not is_degraded_model(answered_by[-1]) and not is_error_response(value.decode("utf-8"))
+    result = vision_cache.get_or_compute(key, compute, should_cache=should_cache).decode("utf-8")
+    if prepared_image is not None:
+        # Answered from the cache; skip the preparation if it hasn't started yet
+        prepared_image.cancel()
+    return result
+
+def cached_speech(doctor_response, audio_format="mp3", tts_engine=TTS_ENGINE):
+    """Synthesize doctor_response into memory, reusing audio already generated for the same text."""
+    key = make_key(doctor_response, tts_engine, "en", audio_format)
+    try:
+        return tts_cache.get_or_compute(key, lambda: text_to_speech_bytes(doctor_response, audio_format, tts_engine))
+    except Exception as e:
+        logging.error(f"Error generating audio with {tts_engine}: {e}")
+    # A voice failure never fails the request; the transcription and diagnosis still go back
+    try:
+        return error_audio_bytes(audio_format)
+    except Exception as e:
+        logging.error(f"Error audio unavailable: {e}")
+        return b""
+
+def save_audio(audio, output_filepath, audio_format):
+    """Write the response audio once, with the extension of its real format; None skips the write."""
+    PAYLOAD_BYTES.observe(len(audio), kind=f"response_{audio_format}")
+    if output_filepath is None:
+        return None
+    audio_filepath = os.path.splitext(output_filepath)[0] + AUDIO_EXTENSIONS[audio_format]
+    with span("audio_save"):
+        with open_private(audio_filepath, "wb") as f:
+            f.write(audio)
+    storage.note_write(len(audio))
+    # Hashed now, while the bytes are at hand, for the ETag /uploads serves it with
+    digests.remember(audio_filepath, audio)
+    return audio_filepath
+
+def no_gate(stage):
+    return nullcontext()
+
+def run_diagnosis(audio_filepath, image_filepath, output_filepath, system_prompt, on_stage=None, audio_format="mp3", gate=no_gate,
+                  tts_engine=TTS_ENGINE, profile=None):
+    """
+    Run speech-to-text, image analysis and text-to-speech for one audio+image pair.
+
+    Args:
+    audio_filepath: Path to the patient's recorded question, or an in-memory (filename, bytes) pair.
+    image_filepath: Path to the uploaded image, or an in-memory (filename, bytes) pair.
+    output_filepath (str): Path the doctor's audio response should be written to; the extension is
+        replaced to match audio_format. None keeps the audio in memory only.
+    system_prompt (str): Prompt prepended to the transcribed question.
+    on_stage (callable): Optional callback, called as on_stage(stage, data) after each stage in STAGES.
+    audio_format (str): One of AUDIO_FORMATS ("mp3", "opus" or "wav").
+    gate (callable): gate(stage) returns a context manager held around the "stt", "vision" and
+        "tts" stages, e.g. batch_diagnosis.stage_limits.gate to cap each stage's concurrency.
+    tts_engine (str): A registered TTS engine (see tts_engines) or "auto" for the fastest one.
+    profile (QualityProfile): Vision model, token budget, image size and prompt to use (see
+        quality_profiles); QUALITY_PROFILE by default. Its voice and audio format are the caller's to apply.
+
+    Returns:
+    dict: transcription, diagnosis, audio (bytes), audio_mime, audio_filepath (None when not saved),
+        timings (see metrics.StageTimer) and quality (the profile's name).
+    """
+    def report(stage, **data):
+        if on_stage is not None:
+            on_stage(stage, data)
+
+    profile = profile or resolve_profile(None)
+    timer = StageTimer()
+    # The image branch needs nothing from the audio branch, so it runs alongside STT
+    prepared_image = start_image_prep(image_filepath, timer, profile)
+
+    # Transcribe audio
+    with gate("stt"), timer.stage("stt"):
+        speech_to_text_output = transcribe_audio(
+            audio_filepath=audio_filepath,
+            preprocess=STT_PREPROCESS_AUDIO
+        )
+    logging.info("Transcription result", extra=phi(transcription=speech_to_text_output))
+    report("transcribed", transcription=speech_to_text_output)
+
+    # Analyze image, once both branches are done
+    with gate("vision"):
+        doctor_response = cached_diagnosis(image_filepath, speech_to_text_output, system_prompt,
+                                           prepared_image=prepared_image, timer=timer, profile=profile)
+    logging.info("Doctor's response", extra=phi(diagnosis=doctor_response))
+    report("diagnosed", diagnosis=doctor_response)
+
+    # Generate audio response
+    with gate("tts"), timer.stage("tts"):
+        audio = cached_speech(doctor_response, audio_format, tts_engine)
+    voice_of_doctor = save_audio(audio, output_filepath, audio_format)
+    logging.info(f"Generated {len(audio)} byte {audio_format} voice response at: {voice_of_doctor}")
+    report("audio_ready", audio_filepath=voice_of_doctor)
+
+    timings = timer.report()
+    logging.info(f"Stage timings: {timings}")
+    return {
+        "transcription": speech_to_text_output,
+        "diagnosis": doctor_response,
+        "audio": audio,
+        "audio_mime": AUDIO_FORMATS[audio_format],
+        "audio_filepath": voice_of_doctor,
+        "timings": timings,
+        "quality": profile.name
+    }
+
+def run_streaming_diagnosis(audio_filepath, image_filepath, output_filepath, system_prompt, on_stage=None, on_segment=None, audio_format="mp3",
+                            tts_engine=TTS_ENGINE, profile=None):
+    """
+    Streaming variant of run_diagnosis.
+
+    The vision response is consumed as a token stream and every complete sentence is
+    synthesized straight away, so the first audio is ready long before the full answer.
+
+    Args:
+    on_segment (callable): Called as on_segment(index, sentence, mp3_bytes) in sentence order,
+        from a background TTS thread, as soon as each sentence has been synthesized.
+    output_filepath (str): Path for the full response: the concatenated MP3 segments, converted
+        to audio_format if that is not "mp3". None keeps it in memory only.
+
+    Returns:
+    dict: transcription, diagnosis, audio_filepath, timings and quality, like run_diagnosis.
+    """
+    def report(stage, **data):
+        if on_stage is not None:
+            on_stage(stage, data)
+
+    profile = profile or resolve_profile(None)
+    timer = StageTimer()
+    # As in run_diagnosis, the image is prepared while the question is transcribed
+    prepared_image = start_image_prep(image_filepath, timer, profile)
+
+    with timer.stage("stt"):
+        speech_to_text_output = transcribe_audio(
+            audio_filepath=audio_filepath,
+            preprocess=STT_PREPROCESS_AUDIO
+        )
+    logging.info("Transcription result", extra=phi(transcription=speech_to_text_output))
+    report("transcribed", transcription=speech_to_text_output)
+
+    # Every sentence must come out in one MP3 format so the segments can be joined; a failing
+    # engine is only replaced by one producing the same format
+    try:
+        output_format = first_engine(tts_engine).output_format
+    except RuntimeError as e:
+        logging.error(f"Streaming without audio: {e}")
+        output_format = None
+
+    def synthesize(index, sentence):
+        try:
+            audio = synthesize_text(sentence, engine=tts_engine, output_format=output_format)
+        except Exception as e:
+            # A lost sentence should not take the rest of the response down with it
+            logging.error(f"Error generating audio for sentence {index}: {e}")
+            return b""
+        if on_segment is not None:
+            on_segment(index, sentence, audio)
+        return audio
+
+    sentences = []
+    # A single TTS worker keeps segments in order while the token stream keeps draining
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="tts-stream") as tts_executor:
+        pending = []
+        key = vision_cache_key(image_filepath, speech_to_text_output, system_prompt, profile)
+        cached = vision_cache.get(key)
+        answered_by = []
+        if cached is not None:
+            prepared_image.cancel()
+            tokens = [cached.decode("utf-8")]
+        else:
+            encoded_image, mime_type = prepared_image.result()
+            tokens = stream_image_analysis(
+                query=profile.prompt(system_prompt) + speech_to_text_output,
+                encoded_image=encoded_image,
+                model=profile.vision_model,
+                mime_type=mime_type,
+                max_tokens=profile.max_tokens,
+                temperature=profile.temperature,
+                models=profile.vision_models,
+                on_model=answered_by.append
+            )
+        # Covers the whole token stream, including handing sentences to the TTS worker
+        with span("vision_stream"), timer.stage("vision"):
+            for sentence in iter_sentences(tokens):
+                pending.append(tts_executor.submit(carry_request_id(synthesize), len(sentences), sentence))
+                sentences.append(sentence)
+
+        doctor_response = " ".join(sentences)
+        if (cached is None and answered_by and not is_degraded_model(answered_by[-1])
+                and not is_error_response(speech_to_text_output) and not is_error_response(doctor_response)):
+            vision_cache.put(key, doctor_response.encode("utf-8"))
+        logging.info("Doctor's response", extra=phi(diagnosis=doctor_response))
+        report("diagnosed", diagnosis=doctor_response)
+
+        # Sentences still being synthesized after the token stream ended
+        with timer.stage("tts_drain"):
+            segments = [future.result() for future in pending]
+
+    # The engines' output is plain MPEG frames, so the segments can be joined byte for byte
+    audio = convert_audio(b"".join(segments), audio_format)
+    voice_of_doctor = save_audio(audio, output_filepath, audio_format)
+    logging.info(f"Generated {len(audio)} byte {audio_format} voice response at: {voice_of_doctor}")
+    report("audio_ready", audio_filepath=voice_of_doctor)
+
+    timings = timer.report()
+    logging.info(f"Stage timings: {timings}")
+    return {
+        "transcription": speech_to_text_output,
+        "diagnosis": doctor_response,
+        "audio": audio,
+        "audio_mime": AUDIO_FORMATS[audio_format],
+        "audio_filepath": voice_of_doctor,
+        "timings": timings,
+        "quality": profile.name
+    }
+
+def run_consultation_turn(session, sessions, audio_filepath, output_filepath, system_prompt, on_stage=None, audio_format="mp3",
+                          tts_engine=TTS_ENGINE, profile=None):
+    """
+    Answer one spoken question in a consultation session, like run_diagnosis but without an image upload.
+
+    The session's already-encoded image and its recent questions and answers (trimmed to the
+    history token budget) are sent with the new question, and the turn is added to the session.
+
+    Args:
+    session (ConsultationSession): The session from consultation_sessions.sessions.
+    sessions (SessionStore): The store that owns the session, which records the new turn.
+    profile (QualityProfile): Vision model, token budget and prompt for this turn; the session's
+        image was prepared once, when it started.
+
+    Returns:
+    dict: transcription, diagnosis, audio, audio_mime, audio_filepath, turn (its 1-based number) and quality.
+    """
+    profile = profile or resolve_profile(None)
+    def report(stage, **data):
+        if on_stage is not None:
+            on_stage(stage, data)
+
+    speech_to_text_output = transcribe_audio(
+        audio_filepath=audio_filepath,
+        preprocess=STT_PREPROCESS_AUDIO
+    )
+    logging.info("Transcription result", extra=phi(transcription=speech_to_text_output))
+    report("transcribed", transcription=speech_to_text_output)
+
+    # The history is read and the turn recorded under the session's lock, but the lock isn't held over
+    # the model call: with fallbacks that can be several timeouts, which another question on the
+    # session would otherwise wait out
+    with session.lock:
+        history, query = session.conversation(profile.prompt(system_prompt), speech_to_text_output)
+        earlier_turns = len(session.turns)
+    doctor_response = analyze_image_with_query(
+        query=query,
+        encoded_image=session.encoded_image,
+        model=profile.vision_model,
+        mime_type=session.mime_type,
+        history=history,
+        max_tokens=profile.max_tokens,
+        temperature=profile.temperature,
+        models=profile.vision_models
+    )
+    with session.lock:
+        if len(session.turns) != earlier_turns:
+            logging.info(f"Session {session.id} had {len(session.turns) - earlier_turns} turn(s) answered meanwhile; "
+                         f"this answer didn't see them and is recorded after them")
+        if not is_error_response(speech_to_text_output) and not is_error_response(doctor_response):
+            sessions.record_turn(session, speech_to_text_output, doctor_response)
+        turn = len(session.turns)
+    logging.info(f"Doctor's response (session {session.id}, {len(history)} earlier turns sent)", extra=phi(diagnosis=doctor_response))
+    report("diagnosed", diagnosis=doctor_response)
+
+    audio = cached_speech(doctor_response, audio_format, tts_engine)
+    voice_of_doctor = save_audio(audio, output_filepath, audio_format)
+    logging.info(f"Generated {len(audio)} byte {audio_format} voice response at: {voice_of_doctor}")
+    report("audio_ready", audio_filepath=voice_of_doctor)
+
+    return {
+        "transcription": speech_to_text_output,
+        "diagnosis": doctor_response,
+        "audio": audio,
+        "audio_mime": AUDIO_FORMATS[audio_format],
+        "audio_filepath": voice_of_doctor,
+        "turn": turn,
+        "quality": profile.name
+    }
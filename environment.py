@@ -0,0 +1,11 @@
+#Process-wide setup shared by every entry point: .env loading and logging
+# Import this before any module that reads its settings from os.environ at import time.
+# Python runs it only once per process, however many modules import it.
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# After load_dotenv, so LOG_* settings can come from .env; see logging_setup for the pipeline
+from logging_setup import configure_logging
+
+configure_logging()
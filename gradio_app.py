@@ -1,18 +1,40 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
+# Loads .env and configures logging
+import environment
 
 #VoiceBot UI with Gradio
 import os
 import gradio as gr
 import logging
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-from brain_of_the_doctor import encode_image, analyze_image_with_query
-from voice_of_the_patient import record_audio, transcribe_with_groq
-from voice_of_the_doctor import text_to_speech_with_gtts
+from brain_of_the_doctor import prepare_image, analyze_image_with_query
+from voice_of_the_patient import record_audio, transcribe_audio
+from warmup import start_prewarm
+from diagnosis_pipeline import cached_speech, save_audio
+from storage_manager import storage
+from metrics import track_request, start_metrics_server
+from quality_profiles import choose_profile, profiles, latency as quality_latency, QUALITY_PROFILE
+from tts_engines import resolve_engine_name
+from logging_setup import phi
+import threading
+import time
+
+# Diagnoses processed at once, and requests allowed to wait in Gradio's queue behind them
+GRADIO_CONCURRENCY=int(os.environ.get("GRADIO_CONCURRENCY", "8"))
+GRADIO_MAX_QUEUE=int(os.environ.get("GRADIO_MAX_QUEUE", "64"))
+# How long Gradio keeps its own copies of the files it served
+GRADIO_CACHE_MAX_AGE_SECONDS=int(os.environ.get("GRADIO_CACHE_MAX_AGE_SECONDS", "3600"))
+
+# Response audio goes to per-request files in the storage manager's directory; the janitor
+# expires whatever the per-session cleanup below misses
+storage.start_janitor()
+
+# Load the configured API clients and render the fixed error audio ahead of the first request
+start_prewarm()
+
+# Gradio has no route of its own for Prometheus, so metrics get a small server on their own port
+METRICS_PORT=os.environ.get("METRICS_PORT")
+if METRICS_PORT:
+    start_metrics_server(METRICS_PORT)
 
 system_prompt="""You are Dr. Vikas, a professional dermatologist with expertise in skin conditions and medical diagnosis.
             Analyze the uploaded image carefully and provide a detailed medical assessment.
@@ -28,7 +50,51 @@ system_prompt="""You are Dr. Vikas, a professional dermatologist with expertise
             If the image is unclear or you cannot make a definitive diagnosis, be honest about limitations and suggest seeking in-person medical advice."""
 
 
-def process_inputs(audio_filepath, image_filepath):
+# Latest response file per browser session. Gradio copies a returned file into its own cache,
+# so ours can go as soon as the session asks for the next diagnosis or goes away.
+session_outputs = {}
+session_outputs_lock = threading.Lock()
+
+def remove_output(path):
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def remember_output(session_id, path):
+    with session_outputs_lock:
+        previous = session_outputs.get(session_id)
+        session_outputs[session_id] = path
+    remove_output(previous)
+
+def release_session(request: gr.Request):
+    with session_outputs_lock:
+        path = session_outputs.pop(request.session_hash, None)
+    remove_output(path)
+
+
+# Diagnoses running now, out of GRADIO_CONCURRENCY; the load that quality profiles are downgraded on
+running_diagnoses = 0
+running_diagnoses_lock = threading.Lock()
+
+def process_inputs(audio_filepath, image_filepath, quality, request: gr.Request):
+    global running_diagnoses
+    with running_diagnoses_lock:
+        running_diagnoses += 1
+        load = running_diagnoses / GRADIO_CONCURRENCY
+    try:
+        profile, _ = choose_profile(quality, load)
+        start = time.monotonic()
+        with track_request("gradio"):
+            outputs = run_inputs(audio_filepath, image_filepath, request.session_hash, profile)
+        quality_latency.record(profile.name, time.monotonic() - start)
+        return outputs
+    finally:
+        with running_diagnoses_lock:
+            running_diagnoses -= 1
+
+def run_inputs(audio_filepath, image_filepath, session_id, profile):
     try:
         logging.info(f"Processing audio file: {audio_filepath}")
         logging.info(f"Processing image file: {image_filepath}")
@@ -39,30 +105,36 @@ def process_inputs(audio_filepath, image_filepath):
             return "No audio recorded", "Please record audio first", None
 
         # Transcribe audio
-        speech_to_text_output = transcribe_with_groq(
-            GROQ_API_KEY=os.environ.get("GROQ_API_KEY"),
+        speech_to_text_output = transcribe_audio(
             audio_filepath=audio_filepath,
-            stt_model="whisper-large-v3"
+            preprocess=True
         )
-        logging.info(f"Transcription result: {speech_to_text_output}")
+        logging.info("Transcription result", extra=phi(transcription=speech_to_text_output))
 
         # Handle the image input
         if image_filepath:
             logging.info("Analyzing image with query")
+            encoded_image, mime_type = prepare_image(image_filepath, max_side=profile.image_max_side)
             doctor_response = analyze_image_with_query(
-                query=system_prompt+speech_to_text_output,
-                encoded_image=encode_image(image_filepath),
-                model="meta-llama/llama-4-scout-17b-16e-instruct"
+                query=profile.prompt(system_prompt)+speech_to_text_output,
+                encoded_image=encoded_image,
+                model=profile.vision_model,
+                mime_type=mime_type,
+                max_tokens=profile.max_tokens,
+                temperature=profile.temperature,
+                models=profile.vision_models
             )
         else:
             logging.warning("No image provided for analysis")
             doctor_response = "No image provided for me to analyze"
 
-        logging.info(f"Doctor's response: {doctor_response}")
+        logging.info("Doctor's response", extra=phi(diagnosis=doctor_response))
 
-        # Generate audio response
-        output_filepath = "final.wav"
-        voice_of_doctor = text_to_speech_with_gtts(input_text=doctor_response, output_filepath=output_filepath)
+        # Generate audio response into a file of its own, so concurrent sessions never share one
+        # The player takes MP3 whatever the profile's format
+        audio = cached_speech(doctor_response, "mp3", resolve_engine_name(profile.tts_engine))
+        voice_of_doctor = save_audio(audio, storage.new_path("response", ".mp3"), "mp3")
+        remember_output(session_id, voice_of_doctor)
         logging.info(f"Generated voice response at: {voice_of_doctor}")
 
         if voice_of_doctor is None:
@@ -118,7 +190,8 @@ arogya_theme = gr.themes.Soft(
 )
 
 # Create the enhanced interface with Arogya color theme
-with gr.Blocks(theme=arogya_theme, css=".gradio-container {max-width: 900px; margin: auto}") as iface:
+with gr.Blocks(theme=arogya_theme, css=".gradio-container {max-width: 900px; margin: auto}",
+               delete_cache=(GRADIO_CACHE_MAX_AGE_SECONDS, GRADIO_CACHE_MAX_AGE_SECONDS)) as iface:
 
     # Header with title
     with gr.Row():
@@ -164,6 +237,14 @@ with gr.Blocks(theme=arogya_theme, css=".gradio-container {max-width: 900px; mar
                         height=300
                     )
 
+                    quality_input = gr.Radio(
+                        choices=list(profiles),
+                        value=QUALITY_PROFILE,
+                        label="Answer detail",
+                        info="fast: a short answer in seconds; thorough: a fuller consult that takes longer",
+                        elem_id="quality-input"
+                    )
+
                     with gr.Row():
                         clear_btn = gr.Button("Clear", variant="secondary")
                         submit_btn = gr.Button("Get Diagnosis", variant="primary", elem_id="submit-btn")
@@ -210,7 +291,7 @@ with gr.Blocks(theme=arogya_theme, css=".gradio-container {max-width: 900px; mar
     # Set up event handlers
     submit_btn.click(
         fn=process_inputs,
-        inputs=[audio_input, image_input],
+        inputs=[audio_input, image_input, quality_input],
         outputs=[text_output, doctor_output, audio_output],
         api_name="diagnose"
     )
@@ -223,6 +304,12 @@ with gr.Blocks(theme=arogya_theme, css=".gradio-container {max-width: 900px; mar
         api_name="clear"
     )
 
-iface.launch(debug=True)
+    # Drop the session's response file when the browser tab closes
+    iface.unload(release_session)
+
+# Several diagnoses run side by side (their time is mostly spent waiting on the APIs); beyond
+# max_size, new requests are told the queue is full instead of waiting indefinitely
+iface.queue(default_concurrency_limit=GRADIO_CONCURRENCY, max_size=GRADIO_MAX_QUEUE)
+iface.launch(debug=True, max_threads=max(40, GRADIO_CONCURRENCY * 2))
 
 #http://127.0.0.1:7860
\ No newline at end of file
@@ -0,0 +1,136 @@
+#Image preprocessing before the image is sent to the vision model
+import os
+import logging
+from io import BytesIO
+
+IMAGE_MAX_SIDE=int(os.environ.get("IMAGE_MAX_SIDE", "1568"))
+IMAGE_JPEG_QUALITY=int(os.environ.get("IMAGE_JPEG_QUALITY", "85"))
+
+# Leading bytes of the formats app.py accepts
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+def sniff_image_mime(image_bytes, default="image/jpeg"):
+    """Detect the real image type from its leading bytes rather than trusting the file extension."""
+    head = bytes(image_bytes[:16])
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return mime_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return default
+
+# Image.info keys that carry metadata (EXIF, XMP, comments) rather than pixels
+METADATA_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "comment", "comments")
+
+def has_image_metadata(image):
+    """Whether an opened image carries EXIF, XMP, comments or PNG text chunks."""
+    if len(image.getexif()) or any(key in image.info for key in METADATA_KEYS):
+        return True
+    return bool(getattr(image, "text", None))
+
+# JPEG segments that carry metadata: APP1 (EXIF, XMP), APP13 (IPTC) and comments. APP0, APP2 (ICC)
+# and APP14 (Adobe) stay, since decoders need them for the colours
+JPEG_METADATA_MARKERS = {0xE1, 0xED, 0xFE}
+# PNG chunks that carry metadata
+PNG_METADATA_CHUNKS = {b"eXIf", b"tEXt", b"iTXt", b"zTXt", b"tIME"}
+
+def strip_metadata(image_bytes, mime_type):
+    """
+    Drop the metadata segments of a JPEG or PNG without decoding it, for when the image can't be
+    re-encoded. Raises ValueError for other formats or a structure it can't follow, rather than
+    let metadata through.
+    """
+    data = bytes(image_bytes)
+    if mime_type == "image/jpeg":
+        output = [data[:2]]
+        position = 2
+        while position + 4 <= len(data):
+            if data[position] != 0xFF:
+                raise ValueError("Malformed JPEG segment")
+            marker = data[position + 1]
+            if marker == 0xDA:
+                # Start of scan: the compressed image follows, with no more metadata segments before it
+                output.append(data[position:])
+                return b"".join(output)
+            length = int.from_bytes(data[position + 2:position + 4], "big")
+            segment = data[position:position + 2 + length]
+            if marker not in JPEG_METADATA_MARKERS:
+                output.append(segment)
+            position += 2 + length
+        raise ValueError("JPEG ends before its image data")
+    if mime_type == "image/png":
+        output = [data[:8]]
+        position = 8
+        while position + 8 <= len(data):
+            length = int.from_bytes(data[position:position + 4], "big")
+            chunk_type = data[position + 4:position + 8]
+            chunk = data[position:position + 12 + length]
+            if chunk_type not in PNG_METADATA_CHUNKS:
+                output.append(chunk)
+            position += 12 + length
+            if chunk_type == b"IEND":
+                return b"".join(output)
+        raise ValueError("PNG ends before its IEND chunk")
+    raise ValueError(f"Cannot remove metadata from {mime_type} without decoding it")
+
+def preprocess_image(image_bytes, max_side=IMAGE_MAX_SIDE, quality=IMAGE_JPEG_QUALITY):
+    """
+    Shrink an uploaded image before it is base64-encoded for the vision API.
+
+    Applies the EXIF orientation, downscales so the longest side is at most max_side,
+    drops metadata and recompresses (JPEG at `quality`, or PNG when the image has
+    transparency). If the result would not be smaller the original bytes are kept, but only
+    when they carry no metadata (EXIF with GPS and device details, XMP, comments) that would
+    otherwise go to the model API.
+
+    Args:
+    image_bytes (bytes): The uploaded image.
+    max_side (int): Longest side in pixels after downscaling.
+    quality (int): JPEG quality used when recompressing.
+
+    Returns:
+    tuple: (processed_bytes, mime_type)
+
+    Raises ValueError when the image can't be decoded and its metadata can't be removed otherwise
+    (see strip_metadata).
+    """
+    original_mime = sniff_image_mime(image_bytes)
+    try:
+        from PIL import Image, ImageOps
+
+        with Image.open(BytesIO(image_bytes)) as image:
+            # Animated GIFs and multi-page images: the first frame is what the doctor sees
+            image.seek(0)
+            rotated = image.getexif().get(0x0112, 1) != 1
+            has_metadata = has_image_metadata(image)
+            oriented = ImageOps.exif_transpose(image)
+
+            resized = max(oriented.size) > max_side
+            if resized:
+                oriented.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+            has_alpha = oriented.mode in ("RGBA", "LA") or (oriented.mode == "P" and "transparency" in oriented.info)
+            output = BytesIO()
+            if has_alpha:
+                oriented.save(output, format="PNG", optimize=True)
+                mime_type = "image/png"
+            else:
+                oriented.convert("RGB").save(output, format="JPEG", quality=quality, optimize=True)
+                mime_type = "image/jpeg"
+            processed = output.getvalue()
+
+        if len(processed) >= len(image_bytes) and not (resized or rotated or has_metadata):
+            logging.info(f"Image preprocessing kept original {original_mime}: {len(image_bytes)} bytes")
+            return image_bytes, original_mime
+
+        logging.info(f"Preprocessed image {original_mime} -> {mime_type}: {len(image_bytes)} -> {len(processed)} bytes")
+        return processed, mime_type
+    except Exception as e:
+        # Never the original as uploaded: its EXIF may hold GPS coordinates and device details
+        logging.warning(f"Image preprocessing failed, sending the original image without its metadata: {e}")
+        return strip_metadata(image_bytes, original_mime), original_mime
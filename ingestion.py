@@ -0,0 +1,184 @@
+#Upload ingestion: multipart file parts are hashed, size-checked and sniffed as their chunks arrive
+import os
+import mmap
+import hashlib
+import logging
+import tempfile
+import threading
+from io import BytesIO
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from image_preprocessing import sniff_image_mime
+from metrics import PAYLOAD_BYTES
+
+MAX_AUDIO_UPLOAD_BYTES=int(os.environ.get("MAX_AUDIO_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+MAX_IMAGE_UPLOAD_BYTES=int(os.environ.get("MAX_IMAGE_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Whole request body, checked by Werkzeug before anything is parsed; batches may need more
+MAX_REQUEST_BYTES=int(os.environ.get("MAX_REQUEST_BYTES", str(64 * 1024 * 1024)))
+# Upload bytes one request may hold in memory; the rest is spilled to temp files and memory-mapped
+INGEST_MEMORY_BYTES=int(os.environ.get("INGEST_MEMORY_BYTES", str(16 * 1024 * 1024)))
+INGEST_SPILL_DIR=os.environ.get("INGEST_SPILL_DIR")
+
+AUDIO_UPLOAD_EXTENSIONS = {"wav", "mp3"}
+IMAGE_UPLOAD_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
+# Bytes needed to recognize every format below
+SNIFF_BYTES = 16
+
+
+def sniff_audio_mime(head):
+    """The audio container type from its leading bytes, or None. Browsers often send webm/ogg named .wav."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "audio/mpeg"
+    if head[:4] == b"OggS":
+        return "audio/ogg"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "audio/webm"
+    if head[:4] == b"fLaC":
+        return "audio/flac"
+    if head[4:8] == b"ftyp":
+        return "audio/mp4"
+    return None
+
+
+def sniff_mime(head):
+    return sniff_image_mime(head, default=None) or sniff_audio_mime(head)
+
+
+class IngestBudget:
+    """Upload bytes held in memory by one request, and the most it held at once."""
+
+    def __init__(self, limit=INGEST_MEMORY_BYTES):
+        self.limit = limit
+        self.in_memory = 0
+        self.peak = 0
+        self.spilled = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """Claim size more bytes of memory; False when that would go over the limit."""
+        with self._lock:
+            if self.in_memory + size > self.limit:
+                return False
+            self.in_memory += size
+            self.peak = max(self.peak, self.in_memory)
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.in_memory -= size
+
+    def note_spilled(self, size):
+        with self._lock:
+            self.spilled += size
+
+
+class IngestSpool:
+    """
+    Writable stream Werkzeug's multipart parser fills with one file part, chunk by chunk.
+
+    Each chunk is counted against the part's size limit (so an oversized upload is rejected
+    before the rest of it is read), added to a SHA-256 digest, and kept in memory while the
+    request's IngestBudget allows, after which the part moves to a temp file.
+    """
+
+    def __init__(self, filename, budget):
+        extension = filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else ""
+        if extension in IMAGE_UPLOAD_EXTENSIONS:
+            self.limit = MAX_IMAGE_UPLOAD_BYTES
+        elif extension in AUDIO_UPLOAD_EXTENSIONS:
+            self.limit = MAX_AUDIO_UPLOAD_BYTES
+        else:
+            self.limit = max(MAX_IMAGE_UPLOAD_BYTES, MAX_AUDIO_UPLOAD_BYTES)
+        self.filename = filename
+        self.budget = budget
+        self.size = 0
+        self.mime_type = None
+        # "image" or "audio" once the leading bytes are recognized
+        self.media = None
+        self._head = b""
+        self._digest = hashlib.sha256()
+        self._file = BytesIO()
+        self.on_disk = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            raise RequestEntityTooLarge(f"{self.filename} is larger than the {self.limit // (1024 * 1024)} MB upload limit")
+        if len(self._head) < SNIFF_BYTES:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+            self.mime_type = sniff_mime(self._head)
+            self.media = self.mime_type.split("/")[0] if self.mime_type else None
+        self._digest.update(data)
+        if not self.on_disk and not self.budget.reserve(len(data)):
+            self._spill()
+        if self.on_disk:
+            self.budget.note_spilled(len(data))
+        return self._file.write(data)
+
+    def _spill(self):
+        spilled = tempfile.TemporaryFile(prefix="arogya-upload-", dir=INGEST_SPILL_DIR)
+        spilled.write(self._file.getbuffer())
+        self.budget.release(self._file.tell())
+        self.budget.note_spilled(self._file.tell())
+        self._file = spilled
+        self.on_disk = True
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def data(self):
+        """
+        The whole upload without another copy: the spool's own bytes object while it is in
+        memory, or a read-only memory map of the temp file once spilled.
+        """
+        if not self.on_disk:
+            # BytesIO hands over its internal buffer when nothing else references it
+            return self._file.getvalue()
+        self._file.flush()
+        if self.size == 0:
+            return b""
+        return mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # The rest of the file interface goes to the underlying buffer or temp file
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+
+class IngestRequest(Request):
+    """Flask request whose file uploads go through IngestSpool; see app.request_class."""
+
+    max_content_length = MAX_REQUEST_BYTES
+
+    @property
+    def ingest_budget(self):
+        budget = self.environ.get("arogya.ingest_budget")
+        if budget is None:
+            budget = self.environ["arogya.ingest_budget"] = IngestBudget()
+        return budget
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return IngestSpool(filename, self.ingest_budget)
+
+
+def upload_spool(file):
+    """The IngestSpool behind a request.files entry, or None for other streams."""
+    stream = file.stream
+    return stream if isinstance(stream, IngestSpool) else None
+
+
+def record_ingest(request):
+    """Record the request's peak upload memory; call once the request is done."""
+    budget = request.environ.get("arogya.ingest_budget")
+    if budget is None:
+        return
+    PAYLOAD_BYTES.observe(budget.peak, kind="ingest_peak_memory")
+    if budget.spilled:
+        logging.info(f"Upload buffers peaked at {budget.peak} bytes in memory; {budget.spilled} bytes spilled to disk")
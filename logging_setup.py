@@ -0,0 +1,222 @@
+#Logging pipeline: request threads only enqueue records; a background listener formats and writes them
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL=os.environ.get("LOG_LEVEL", "INFO").upper()
+# "json" for one JSON object per line, or "text" for the classic human-readable lines
+LOG_OUTPUT=os.environ.get("LOG_OUTPUT", "json")
+LOG_FORMAT='%(asctime)s - %(levelname)s - %(message)s'
+# Records waiting for the listener; beyond this they are dropped rather than block a request
+LOG_QUEUE_SIZE=int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# How transcripts and diagnoses appear in logs: "redact" (length only), "truncate" or "full"
+LOG_PHI=os.environ.get("LOG_PHI", "redact")
+LOG_PHI_TRUNCATE_CHARS=int(os.environ.get("LOG_PHI_TRUNCATE_CHARS", "40"))
+# Each log call site may write LOG_SAMPLE_BURST INFO/DEBUG records per window; past that, 1 in LOG_SAMPLE_EVERY
+LOG_SAMPLE_BURST=int(os.environ.get("LOG_SAMPLE_BURST", "20"))
+LOG_SAMPLE_WINDOW_SECONDS=float(os.environ.get("LOG_SAMPLE_WINDOW_SECONDS", "10"))
+LOG_SAMPLE_EVERY=int(os.environ.get("LOG_SAMPLE_EVERY", "10"))
+
+# Set per request (see app.py); carry_request_id passes it on to pool threads
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def carry_request_id(fn):
+    """Wrap fn so it logs under the caller's request ID when it runs on another thread."""
+    current = request_id.get()
+
+    def run(*args, **kwargs):
+        token = request_id.set(current)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            request_id.reset(token)
+    return run
+
+
+def phi(**fields):
+    """
+    extra= for a record carrying patient data, e.g.
+    logging.info("Transcription result", extra=phi(transcription=text)).
+    The fields are rendered per LOG_PHI when the record is written, never in the message itself.
+    """
+    return {"phi": fields}
+
+
+def render_phi(value, mode=None):
+    text = str(value)
+    mode = mode or LOG_PHI
+    if mode == "full":
+        return text
+    if mode == "truncate":
+        return text[:LOG_PHI_TRUNCATE_CHARS] + ("..." if len(text) > LOG_PHI_TRUNCATE_CHARS else "")
+    return f"<redacted {len(text)} chars>"
+
+
+class LogStats:
+    """Records handled on the calling threads, what it cost them, and what was sampled out or dropped."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.records = 0
+            self.sampled_out = 0
+            self.dropped = 0
+            self.caller_seconds = 0.0
+
+    def add(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "records": self.records,
+                "sampled_out": self.sampled_out,
+                "dropped": self.dropped,
+                "caller_seconds": round(self.caller_seconds, 6),
+                "queued": log_queue.qsize() if log_queue is not None else 0
+            }
+
+
+stats = LogStats()
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamps each record with the request ID while still on the thread that logged it."""
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Thins out INFO and DEBUG records per call site (file and line): the first LOG_SAMPLE_BURST
+    of each window pass, then one in every LOG_SAMPLE_EVERY. Warnings and errors always pass.
+    """
+
+    def __init__(self, burst=LOG_SAMPLE_BURST, window=LOG_SAMPLE_WINDOW_SECONDS, every=LOG_SAMPLE_EVERY):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.every = max(1, every)
+        self._lock = threading.Lock()
+        self._sites = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.burst <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            started, count = self._sites.get(site, (now, 0))
+            if now - started > self.window:
+                started, count = now, 0
+            count += 1
+            self._sites[site] = (started, count)
+        if count <= self.burst:
+            return True
+        if (count - self.burst) % self.every == 0:
+            record.sample_every = self.every
+            return True
+        stats.add("sampled_out")
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Puts records on the bounded queue without ever waiting; a full queue drops the record."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats.add("dropped")
+
+    def handle(self, record):
+        start = time.perf_counter()
+        try:
+            return super().handle(record)
+        finally:
+            stats.add("records")
+            stats.add("caller_seconds", time.perf_counter() - start)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "thread": record.threadName
+        }
+        for name, value in getattr(record, "phi", {}).items():
+            entry[name] = render_phi(value)
+        if getattr(record, "sample_every", None):
+            entry["sample_every"] = record.sample_every
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(LOG_FORMAT)
+
+    def format(self, record):
+        line = super().format(record)
+        if getattr(record, "request_id", None):
+            line += f" [{record.request_id}]"
+        for name, value in getattr(record, "phi", {}).items():
+            line += f" {name}={render_phi(value)!r}"
+        return line
+
+
+log_queue = None
+queue_handler = None
+listener = None
+
+
+def _start_listener():
+    global log_queue, listener
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler.queue = log_queue
+    sink = logging.StreamHandler(sys.stderr)
+    sink.setFormatter(JSONFormatter() if LOG_OUTPUT == "json" else TextFormatter())
+    listener = QueueListener(log_queue, sink, respect_handler_level=True)
+    listener.start()
+
+
+def _stop_listener():
+    if listener is not None and listener._thread is not None:
+        # Writes out whatever is still queued
+        listener.stop()
+
+
+def configure_logging():
+    """Route the root logger through the queue; safe to call more than once (only the first call acts)."""
+    global queue_handler
+    if queue_handler is not None:
+        return
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    queue_handler = DroppingQueueHandler(None)
+    queue_handler.addFilter(SamplingFilter())
+    queue_handler.addFilter(RequestContextFilter())
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    _start_listener()
+    atexit.register(_stop_listener)
+    # Forked workers (gunicorn) don't inherit the listener thread; each starts its own
+    os.register_at_fork(after_in_child=_start_listener)
@@ -0,0 +1,191 @@
+#Serving stored artifacts: content-hash ETags, long-lived caching, byte ranges and proxy offload
+import os
+import time
+import hashlib
+import logging
+import mimetypes
+import threading
+from collections import OrderedDict
+
+from flask import request, send_file, abort
+from werkzeug.security import safe_join
+
+from voice_of_the_doctor import convert_audio, AUDIO_FORMATS, AUDIO_EXTENSIONS
+from storage_manager import storage, open_private
+from metrics import span
+
+# Artifact names are never reused, so browsers may keep them this long without revalidating
+MEDIA_MAX_AGE_SECONDS=int(os.environ.get("MEDIA_MAX_AGE_SECONDS", str(7 * 24 * 3600)))
+# "x-accel" (nginx) or "x-sendfile" (Apache, lighttpd) hands the file to the fronting proxy; empty serves it from Python
+MEDIA_OFFLOAD=os.environ.get("MEDIA_OFFLOAD", "")
+# Internal nginx location that maps to the upload folder, for X-Accel-Redirect
+MEDIA_ACCEL_PREFIX=os.environ.get("MEDIA_ACCEL_PREFIX", "/protected-uploads/")
+# Re-encode stored audio when the client accepts a smaller format (e.g. MP3 for a WAV response)
+MEDIA_TRANSCODE=os.environ.get("MEDIA_TRANSCODE", "1") == "1"
+MEDIA_DIGEST_CACHE_SIZE=int(os.environ.get("MEDIA_DIGEST_CACHE_SIZE", "4096"))
+
+FORMAT_BY_EXTENSION = {extension: audio_format for audio_format, extension in AUDIO_EXTENSIONS.items()}
+# Compressed formats first; WAV only for clients that accept nothing else
+ENCODING_PREFERENCE = ("mp3", "opus", "wav")
+
+
+class DigestCache:
+    """
+    SHA-256 of served files, keyed by path and checked against size and mtime, so each file is
+    hashed at most once per process. Writers that already hold the bytes call remember().
+    """
+
+    def __init__(self, max_entries=MEDIA_DIGEST_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _put(self, path, stat, digest):
+        with self._lock:
+            self._entries[path] = (stat.st_size, stat.st_mtime_ns, digest)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def remember(self, path, data=None, digest=None):
+        """Record the digest of a file just written, from its bytes or a digest already computed."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        self._put(path, stat, digest or hashlib.sha256(data).hexdigest())
+
+    def get(self, path):
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                self._entries.move_to_end(path)
+                return entry[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        self._put(path, stat, digest.hexdigest())
+        return digest.hexdigest()
+
+
+digests = DigestCache()
+_transcode_lock = threading.Lock()
+
+
+def is_immutable(filename):
+    # Artifacts are named kind-<uuid4> and never rewritten under the same name
+    return storage.kind_of(filename) is not None
+
+
+def choose_audio_format(stored_format):
+    """
+    The format to send a stored audio file in: ?format= if given, otherwise the stored format
+    when the client's Accept header allows it and it is compressed, otherwise the first of
+    ENCODING_PREFERENCE the client accepts.
+    """
+    requested = request.args.get("format")
+    if requested in AUDIO_FORMATS:
+        return requested
+    accepted = request.accept_mimetypes
+    if not accepted:
+        return stored_format
+    order = ([stored_format] if stored_format != "wav" else []) + list(ENCODING_PREFERENCE)
+    for audio_format in order:
+        if accepted.quality(AUDIO_FORMATS[audio_format]) > 0:
+            return audio_format
+    return stored_format
+
+
+def audio_variant(path, stored_format, audio_format):
+    """
+    Path of the artifact re-encoded as audio_format, written next to it on first request
+    (same kind and name, so the janitor expires it with the original). Falls back to the
+    original when the conversion fails.
+    """
+    variant = os.path.splitext(path)[0] + AUDIO_EXTENSIONS[audio_format]
+    if os.path.exists(variant):
+        return variant, audio_format
+    with _transcode_lock:
+        if os.path.exists(variant):
+            return variant, audio_format
+        try:
+            with open(path, "rb") as f:
+                source = f.read()
+            with span("media_transcode"):
+                converted = convert_audio(source, audio_format, source_format=stored_format)
+        except Exception as e:
+            logging.warning(f"Could not re-encode {os.path.basename(path)} as {audio_format}: {e}")
+            return path, stored_format
+        partial = f"{variant}.{os.getpid()}.part"
+        with open_private(partial, "wb") as f:
+            f.write(converted)
+        os.replace(partial, variant)
+        storage.note_write(len(converted))
+        digests.remember(variant, converted)
+        logging.info(f"Re-encoded {os.path.basename(path)} as {audio_format}: {len(source)} -> {len(converted)} bytes")
+    return variant, audio_format
+
+
+def send_media(filename, root=None):
+    """
+    Respond with a stored upload or generated artifact.
+
+    Range and If-None-Match / If-Range requests are answered against a strong ETag of the file's
+    SHA-256. UUID-named artifacts never change, so they are cached as private and immutable;
+    anything else is revalidated. Audio is sent in a format the client accepts (see
+    choose_audio_format). With MEDIA_OFFLOAD the proxy sends the bytes and handles ranges.
+    """
+    root = root or storage.root
+    path = safe_join(root, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    stored_format = FORMAT_BY_EXTENSION.get(os.path.splitext(filename)[1].lower())
+    negotiated = stored_format is not None
+    if negotiated:
+        audio_format = choose_audio_format(stored_format)
+        if audio_format != stored_format and MEDIA_TRANSCODE:
+            path, audio_format = audio_variant(path, stored_format, audio_format)
+        mimetype = AUDIO_FORMATS[audio_format]
+    else:
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    etag = digests.get(path)[:32]
+    immutable = is_immutable(filename)
+
+    if MEDIA_OFFLOAD in ("x-accel", "x-sendfile"):
+        response = offload_response(path, root, mimetype)
+        response.set_etag(etag)
+        response = response.make_conditional(request)
+    else:
+        response = send_file(path, mimetype=mimetype, conditional=True, etag=etag,
+                             max_age=MEDIA_MAX_AGE_SECONDS if immutable else None)
+
+    if immutable:
+        # Patient data: browsers may keep it, shared caches may not
+        response.cache_control.public = False
+        response.cache_control.private = True
+        response.cache_control.max_age = MEDIA_MAX_AGE_SECONDS
+        response.cache_control.immutable = True
+        response.expires = int(time.time() + MEDIA_MAX_AGE_SECONDS)
+    else:
+        response.cache_control.no_cache = True
+    if negotiated:
+        response.vary.add("Accept")
+    return response
+
+
+def offload_response(path, root, mimetype):
+    """An empty response naming the file for the proxy to send (it also answers range requests)."""
+    from flask import current_app
+
+    response = current_app.response_class(mimetype=mimetype)
+    if MEDIA_OFFLOAD == "x-accel":
+        relative = os.path.relpath(path, root).replace(os.sep, "/")
+        response.headers["X-Accel-Redirect"] = MEDIA_ACCEL_PREFIX.rstrip("/") + "/" + relative
+    else:
+        response.headers["X-Sendfile"] = os.path.abspath(path)
+    response.headers["Accept-Ranges"] = "bytes"
+    return response
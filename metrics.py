@@ -0,0 +1,289 @@
+#In-process metrics in the Prometheus text exposition format
+import os
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+METRICS_ENABLED=os.environ.get("METRICS_ENABLED", "1") == "1"
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** power for power in range(9))  # 1 KiB .. 64 MiB
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {sorted(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}_total{_format_labels(list(zip(self.labelnames, key)))} {_format_number(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the enclosed block as in progress for its duration."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_number(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        # Only the bucket the value falls in is incremented; render() accumulates them
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = sorted((key, ([*series[0]], series[1], series[2])) for key, series in self._values.items())
+        for key, (counts, total, count) in values:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_DURATION = registry.register(Histogram(
+    "arogya_stage_duration_seconds", "Time spent in each pipeline stage.", ("stage", "outcome")))
+MODEL_ATTEMPT_DURATION = registry.register(Histogram(
+    "arogya_model_attempt_duration_seconds", "Time spent in each model call, including failed attempts.",
+    ("router", "model", "outcome")))
+ROUTER_DECISIONS = registry.register(Counter(
+    "arogya_router_decisions", "Fallbacks, hedges and exhausted candidate lists per router.", ("router", "decision")))
+FALLBACKS = registry.register(Counter(
+    "arogya_fallbacks", "Degraded paths taken, such as the text-only model or the error audio.", ("kind",)))
+IN_FLIGHT = registry.register(Gauge(
+    "arogya_requests_in_flight", "Diagnosis requests currently being processed.", ("entrypoint",)))
+REQUESTS = registry.register(Counter(
+    "arogya_requests", "Finished diagnosis requests.", ("entrypoint", "outcome")))
+PAYLOAD_BYTES = registry.register(Histogram(
+    "arogya_payload_bytes", "Size of uploads, model payloads and generated audio.", ("kind",), buckets=BYTES_BUCKETS))
+STAGE_WAITING = registry.register(Gauge(
+    "arogya_stage_waiting", "Batch items waiting for a free slot in a pipeline stage.", ("stage",)))
+OVERLAP_SAVED = registry.register(Histogram(
+    "arogya_overlap_saved_seconds", "Wall-clock time saved per request by running independent stages concurrently."))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Span:
+    def __init__(self, stage):
+        self.stage = stage
+        self.outcome = "success"
+
+    def fail(self):
+        """Mark the span as failed without raising, for helpers that return error values."""
+        self.outcome = "error"
+
+
+@contextmanager
+def span(stage):
+    """
+    Time the enclosed block into arogya_stage_duration_seconds{stage=...}.
+
+    An exception marks the span as an error; call .fail() on the yielded span to do the
+    same for code that reports failures through its return value.
+    """
+    current = Span(stage)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        current.outcome = "error"
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage, outcome=current.outcome)
+
+
+class StageTimer:
+    """
+    Start and duration of each stage of one request, relative to the request's start.
+
+    Stages may overlap (e.g. image preparation on another thread while STT runs); report()
+    compares the sum of the stage durations with the wall-clock time to show what that saves.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        begin = time.perf_counter() - self.start
+        try:
+            yield
+        finally:
+            end = time.perf_counter() - self.start
+            with self._lock:
+                self.stages[name] = (begin, end)
+
+    def report(self):
+        wall = time.perf_counter() - self.start
+        with self._lock:
+            stages = dict(self.stages)
+        serial = sum(end - begin for begin, end in stages.values())
+        saved = max(0.0, serial - wall)
+        OVERLAP_SAVED.observe(saved)
+        return {
+            "stages": {name: {"start": round(begin, 3), "seconds": round(end - begin, 3)} for name, (begin, end) in stages.items()},
+            "wall_seconds": round(wall, 3),
+            "serial_seconds": round(serial, 3),
+            "overlap_saved_seconds": round(saved, 3)
+        }
+
+
+@contextmanager
+def track_request(entrypoint):
+    """Count a diagnosis request as in flight, then record how it finished."""
+    current = None
+    try:
+        with IN_FLIGHT.track(entrypoint=entrypoint), span(entrypoint) as current:
+            yield current
+    finally:
+        REQUESTS.inc(entrypoint=entrypoint, outcome=current.outcome if current else "error")
+
+
+def render_metrics():
+    return registry.render()
+
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """Serve /metrics from a daemon thread, for entry points without their own web server."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
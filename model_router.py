@@ -0,0 +1,273 @@
+#Latency-aware routing across the vision model fallback chain
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait, TimeoutError as FutureTimeoutError
+
+from metrics import MODEL_ATTEMPT_DURATION, ROUTER_DECISIONS
+
+ROUTER_WINDOW=int(os.environ.get("ROUTER_WINDOW", "50"))
+BREAKER_FAILURE_THRESHOLD=int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_COOLDOWN_SECONDS=float(os.environ.get("BREAKER_COOLDOWN_SECONDS", "30"))
+VISION_HEDGING=os.environ.get("VISION_HEDGING", "0") == "1"
+HEDGE_MIN_SAMPLES=int(os.environ.get("HEDGE_MIN_SAMPLES", "10"))
+HEDGE_WORKERS=int(os.environ.get("HEDGE_WORKERS", "8"))
+# Among equally healthy models, one whose median latency is more than this many times the fastest's
+# goes after the others; within the tolerance the caller's preference order stands
+ROUTER_LATENCY_TOLERANCE=float(os.environ.get("ROUTER_LATENCY_TOLERANCE", "2.0"))
+
+
+class AllModelsFailed(Exception):
+    def __init__(self, last_error):
+        super().__init__(f"All models failed. Last error: {last_error}")
+        self.last_error = last_error
+
+
+class ModelHealth:
+    """Rolling latency/error window and circuit breaker state for one model."""
+
+    def __init__(self, window):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True for success
+        self.consecutive_failures = 0
+        self.state = "closed"  # closed -> open -> half_open -> closed | open
+        self.opened_at = None
+        self.probe_in_flight = False
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+    def to_dict(self):
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return {
+            "state": self.state,
+            "samples": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "p50_seconds": round(p50, 3) if p50 is not None else None,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "consecutive_failures": self.consecutive_failures
+        }
+
+
+class ModelRouter:
+    """
+    Routes calls across an ordered list of candidate models.
+
+    Candidates whose circuit breaker is open are skipped until their cooldown expires,
+    after which a single probe request is let through. The rest are tried in order of
+    health. Between equally healthy models the caller's preference order stands, except
+    that models clearly slower than the fastest (see ROUTER_LATENCY_TOLERANCE) go last,
+    slowest last.
+    With hedging on, a second request goes to the next candidate once the first has
+    run past its own p95 latency, and whichever answers first wins.
+    """
+
+    def __init__(self, name, window=ROUTER_WINDOW, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 cooldown=BREAKER_COOLDOWN_SECONDS, hedging=VISION_HEDGING):
+        self.name = name
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedging = hedging
+        self._lock = threading.Lock()
+        self._health = {}
+        self._decisions = {"calls": 0, "fallbacks": 0, "skipped_open": 0, "hedges": 0, "hedge_wins": 0, "exhausted": 0}
+        self._recent = deque(maxlen=20)
+        self._executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix=f"{name}-hedge")
+
+    def _get_health(self, model):
+        # Caller holds self._lock
+        health = self._health.get(model)
+        if health is None:
+            health = self._health[model] = ModelHealth(self.window)
+        return health
+
+    def _callable(self, health):
+        # Caller holds self._lock
+        if health.state == "open":
+            return time.monotonic() - health.opened_at >= self.cooldown
+        if health.state == "half_open":
+            return not health.probe_in_flight
+        return True
+
+    def order(self, candidates):
+        """Return the candidates that may be called now, healthiest first, then fastest."""
+        available = []
+        with self._lock:
+            for index, model in enumerate(dict.fromkeys(candidates)):
+                health = self._get_health(model)
+                if not self._callable(health):
+                    self._decisions["skipped_open"] += 1
+                    continue
+                # Bucket the error rate so small differences don't reshuffle the preference order
+                available.append((round(health.error_rate(), 1), index, model, health.percentile(0.5)))
+        # Models with no successful call yet are taken to be as fast as the fastest, so they still get tried
+        known = [p50 for _, _, _, p50 in available if p50 is not None]
+        fastest = min(known) if known else None
+
+        def rank(entry):
+            errors, index, _, p50 = entry
+            slow = p50 is not None and p50 > fastest * ROUTER_LATENCY_TOLERANCE
+            return errors, p50 if slow else 0.0, index
+        return [model for _, _, model, _ in sorted(available, key=rank)]
+
+    def acquire(self, model):
+        """Claim the right to call model now; after a cooldown only one probe is let through."""
+        with self._lock:
+            health = self._get_health(model)
+            if not self._callable(health):
+                return False
+            if health.state == "open":
+                health.state = "half_open"
+            if health.state == "half_open":
+                health.probe_in_flight = True
+            return True
+
+    def record(self, model, latency, success):
+        MODEL_ATTEMPT_DURATION.observe(latency, router=self.name, model=model, outcome="success" if success else "error")
+        with self._lock:
+            health = self._get_health(model)
+            health.outcomes.append(success)
+            health.probe_in_flight = False
+            if success:
+                health.latencies.append(latency)
+                health.consecutive_failures = 0
+                health.state = "closed"
+                return
+            health.consecutive_failures += 1
+            if health.state == "half_open" or health.consecutive_failures >= self.failure_threshold:
+                if health.state != "open":
+                    logging.warning(f"Opening circuit breaker for model {model} for {self.cooldown}s")
+                health.state = "open"
+                health.opened_at = time.monotonic()
+
+    def percentile(self, model, fraction=0.5):
+        """Latency of model's recent successful calls at fraction (0.5 is the median); None before any."""
+        with self._lock:
+            return self._get_health(model).percentile(fraction)
+
+    def hedge_delay(self, model):
+        with self._lock:
+            health = self._get_health(model)
+            if len(health.latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            return health.percentile(0.95)
+
+    def _timed(self, model, attempt):
+        start = time.monotonic()
+        try:
+            result = attempt(model)
+        except Exception:
+            self.record(model, time.monotonic() - start, success=False)
+            raise
+        self.record(model, time.monotonic() - start, success=True)
+        return result
+
+    def _decide(self, decision, **details):
+        ROUTER_DECISIONS.inc(router=self.name, decision=decision)
+        with self._lock:
+            self._decisions[decision] += 1
+            self._recent.append(dict(details, decision=decision, at=time.time()))
+
+    def fallback(self, model, error):
+        """Record that model is being tried because an earlier candidate failed with error."""
+        self._decide("fallbacks", model=model, error=str(error))
+
+    def call(self, candidates, attempt):
+        """
+        Call attempt(model) on the best available candidate, falling back on errors.
+
+        Returns the first successful result; raises AllModelsFailed when every candidate
+        failed or was skipped.
+        """
+        with self._lock:
+            self._decisions["calls"] += 1
+        ordered = self.order(candidates)
+        last_error = RuntimeError("every model's circuit breaker is open")
+
+        position = 0
+        while position < len(ordered):
+            model = ordered[position]
+            backup = ordered[position + 1] if self.hedging and position + 1 < len(ordered) else None
+            delay = self.hedge_delay(model) if backup else None
+            if not self.acquire(model):
+                # Another request is already probing this model
+                with self._lock:
+                    self._decisions["skipped_open"] += 1
+                position += 1
+                continue
+            if position > 0:
+                self.fallback(model, last_error)
+
+            if delay is None:
+                try:
+                    return self._timed(model, attempt)
+                except Exception as e:
+                    last_error = e
+                    logging.warning(f"Error with model {model}: {e}")
+                    position += 1
+                    continue
+
+            primary = self._executor.submit(self._timed, model, attempt)
+            try:
+                return primary.result(timeout=delay)
+            except FutureTimeoutError:
+                pass
+            except Exception as e:
+                last_error = e
+                logging.warning(f"Error with model {model}: {e}")
+                position += 1
+                continue
+
+            if not self.acquire(backup):
+                # The backup became unavailable meanwhile; keep waiting on the primary
+                try:
+                    return primary.result()
+                except Exception as e:
+                    last_error = e
+                    logging.warning(f"Error with model {model}: {e}")
+                    position += 1
+                    continue
+
+            self._decide("hedges", model=model, backup=backup, after_seconds=round(delay, 3))
+            secondary = self._executor.submit(self._timed, backup, attempt)
+            pending = {primary, secondary}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        last_error = e
+                        logging.warning(f"Error with hedged request: {e}")
+                        continue
+                    if future is secondary:
+                        self._decide("hedge_wins", model=backup, over=model)
+                    return result
+            position += 2
+
+        self._decide("exhausted", error=str(last_error))
+        raise AllModelsFailed(last_error)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hedging": self.hedging,
+                "models": {model: health.to_dict() for model, health in self._health.items()},
+                "decisions": dict(self._decisions),
+                "recent_decisions": list(self._recent)
+            }
+
+
+vision_router = ModelRouter("vision")
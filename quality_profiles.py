@@ -0,0 +1,173 @@
+#Quality profiles: named trade-offs between answer depth and latency, downgraded automatically under load
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+from image_preprocessing import IMAGE_MAX_SIDE
+from metrics import registry, Counter
+
+# Profile for requests that don't name one
+QUALITY_PROFILE=os.environ.get("QUALITY_PROFILE", "standard")
+# Serve a cheaper profile than requested when the server is loaded or a profile runs slow; 0 disables
+QUALITY_AUTO_DOWNGRADE=os.environ.get("QUALITY_AUTO_DOWNGRADE", "1") == "1"
+# Load (diagnoses running and waiting per slot) at which requests drop one profile
+QUALITY_DOWNGRADE_LOAD=float(os.environ.get("QUALITY_DOWNGRADE_LOAD", "1.0"))
+# End-to-end times older than this are forgotten, so a slow profile gets tried again
+QUALITY_LATENCY_WINDOW_SECONDS=float(os.environ.get("QUALITY_LATENCY_WINDOW_SECONDS", "300"))
+QUALITY_LATENCY_MIN_SAMPLES=int(os.environ.get("QUALITY_LATENCY_MIN_SAMPLES", "5"))
+QUALITY_FAST_TARGET_SECONDS=float(os.environ.get("QUALITY_FAST_TARGET_SECONDS", "6"))
+QUALITY_STANDARD_TARGET_SECONDS=float(os.environ.get("QUALITY_STANDARD_TARGET_SECONDS", "15"))
+QUALITY_THOROUGH_TARGET_SECONDS=float(os.environ.get("QUALITY_THOROUGH_TARGET_SECONDS", "30"))
+
+QUALITY_SERVED = registry.register(Counter(
+    "arogya_quality_served", "Requests by the quality profile served and why it was chosen.", ("profile", "reason")))
+
+SCOUT_MODEL = "meta-llama/llama-4-scout-17b-16e-instruct"
+LLAMA_90B_VISION_MODEL = "llama-3.2-90b-vision-preview"
+
+BRIEF_SYSTEM_PROMPT = """You are Dr. Arogya, a dermatologist. Look at the image and answer the patient's question in three or four short sentences:
+            what you see, how serious it looks, and one next step. Speak directly to the patient, without markdown.
+            If the image is unclear, say so and suggest an in-person visit."""
+
+THOROUGH_PROMPT_SUFFIX = """
+            Also describe the differential diagnoses you considered and why, any warning signs that would need urgent care,
+            and how long the patient should wait before following up if the treatment doesn't help.
+            """
+
+
+class QualityProfile:
+    """
+    Settings for one request's vision call, image, prompt and voice.
+
+    system_prompt None keeps the caller's prompt; tts_engine and audio_format None keep the
+    request's (or server's) choice. target_seconds is the end-to-end time the profile should
+    stay under; when its recent 90th percentile goes over, requests are served one profile down.
+    """
+
+    def __init__(self, name, vision_models, max_tokens, temperature, image_max_side, target_seconds,
+                 system_prompt=None, prompt_suffix="", tts_engine=None, audio_format=None):
+        self.name = name
+        self.vision_models = list(vision_models)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.image_max_side = image_max_side
+        self.target_seconds = target_seconds
+        self.system_prompt = system_prompt
+        self.prompt_suffix = prompt_suffix
+        self.tts_engine = tts_engine
+        self.audio_format = audio_format
+
+    @property
+    def vision_model(self):
+        return self.vision_models[0]
+
+    def prompt(self, system_prompt):
+        """The system prompt this profile sends, given the entry point's own."""
+        return (self.system_prompt or system_prompt) + self.prompt_suffix
+
+    def to_dict(self):
+        return {
+            "vision_models": self.vision_models,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "image_max_side": self.image_max_side,
+            "target_seconds": self.target_seconds,
+            "brief_prompt": self.system_prompt is not None,
+            "tts_engine": self.tts_engine,
+            "audio_format": self.audio_format
+        }
+
+
+# Cheapest first; downgrades move towards the start of this dict
+profiles = {}
+
+def register_profile(profile):
+    """Add a profile under profile.name, after the existing (cheaper) ones; returns it."""
+    profiles[profile.name] = profile
+    return profile
+
+register_profile(QualityProfile(
+    "fast", [SCOUT_MODEL], max_tokens=300, temperature=0.3, image_max_side=512,
+    target_seconds=QUALITY_FAST_TARGET_SECONDS, system_prompt=BRIEF_SYSTEM_PROMPT,
+    # MP3 is what the engines produce, so there is nothing to convert
+    tts_engine="auto", audio_format="mp3"))
+register_profile(QualityProfile(
+    "standard", [SCOUT_MODEL, LLAMA_90B_VISION_MODEL], max_tokens=800, temperature=0.7, image_max_side=IMAGE_MAX_SIDE,
+    target_seconds=QUALITY_STANDARD_TARGET_SECONDS))
+register_profile(QualityProfile(
+    "thorough", [LLAMA_90B_VISION_MODEL, SCOUT_MODEL], max_tokens=1500, temperature=0.5, image_max_side=max(IMAGE_MAX_SIDE, 2048),
+    target_seconds=QUALITY_THOROUGH_TARGET_SECONDS, prompt_suffix=THOROUGH_PROMPT_SUFFIX, tts_engine="elevenlabs"))
+
+
+class ProfileLatency:
+    """Recent end-to-end times per profile, kept for QUALITY_LATENCY_WINDOW_SECONDS."""
+
+    def __init__(self, window_seconds=QUALITY_LATENCY_WINDOW_SECONDS, max_samples=200):
+        self.window_seconds = window_seconds
+        self._samples = {}
+        self._max_samples = max_samples
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self._max_samples)).append((time.monotonic(), seconds))
+
+    def p90(self, name, min_samples=QUALITY_LATENCY_MIN_SAMPLES):
+        """90th percentile of the profile's recent times, or None with fewer than min_samples."""
+        cutoff = time.monotonic() - self.window_seconds
+        with self._lock:
+            samples = self._samples.get(name, ())
+            while samples and samples[0][0] < cutoff:
+                samples.popleft()
+            values = sorted(seconds for _, seconds in samples)
+        if len(values) < max(1, min_samples):
+            return None
+        return values[min(len(values) - 1, int(len(values) * 0.9))]
+
+
+latency = ProfileLatency()
+
+
+def resolve_profile(requested):
+    """The profile for a request's quality value; unknown or missing names get QUALITY_PROFILE."""
+    return profiles.get(requested) or profiles.get(QUALITY_PROFILE) or profiles["standard"]
+
+
+def choose_profile(requested, load=0.0):
+    """
+    The profile to serve a request with, and why: "requested", "load" or "latency".
+
+    With QUALITY_AUTO_DOWNGRADE on, the request drops one profile when load (diagnoses running
+    and waiting per slot) has reached QUALITY_DOWNGRADE_LOAD, and again for every profile whose
+    recent 90th percentile is over its target.
+    """
+    profile = resolve_profile(requested)
+    reason = "requested"
+    if QUALITY_AUTO_DOWNGRADE:
+        names = list(profiles)
+        index = names.index(profile.name)
+        if index > 0 and load >= QUALITY_DOWNGRADE_LOAD:
+            index -= 1
+            reason = "load"
+        while index > 0:
+            p90 = latency.p90(names[index])
+            if p90 is None or p90 <= profiles[names[index]].target_seconds:
+                break
+            index -= 1
+            reason = "latency"
+        if names[index] != profile.name:
+            logging.info(f"Serving quality profile {names[index]} instead of {profile.name} ({reason}, load {load:.2f})")
+            profile = profiles[names[index]]
+    QUALITY_SERVED.inc(profile=profile.name, reason=reason)
+    return profile, reason
+
+
+def quality_stats():
+    return {
+        "default": QUALITY_PROFILE,
+        "auto_downgrade": QUALITY_AUTO_DOWNGRADE,
+        "downgrade_load": QUALITY_DOWNGRADE_LOAD,
+        "profiles": {name: dict(profile.to_dict(), p90_seconds=latency.p90(name)) for name, profile in profiles.items()}
+    }
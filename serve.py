@@ -0,0 +1,72 @@
+#Production entry point: the Flask app under gunicorn, with several worker processes
+# Usage: python serve.py   (settings below come from the environment)
+import environment
+
+import os
+import multiprocessing
+import logging
+
+from gunicorn.app.base import BaseApplication
+
+import admission
+from storage_manager import STATE_DIR
+
+WEB_BIND=os.environ.get("WEB_BIND", "0.0.0.0:7860")
+WEB_WORKERS=int(os.environ.get("WEB_WORKERS", str(min(multiprocessing.cpu_count(), 4))))
+# Threads per worker: diagnosis slots, their wait queue, and headroom for event streams and status polls
+WEB_THREADS=int(os.environ.get("WEB_THREADS", str(admission.MAX_CONCURRENT_DIAGNOSES + admission.ADMISSION_QUEUE_SIZE + 16)))
+WEB_TIMEOUT=int(os.environ.get("WEB_TIMEOUT", "120"))
+WEB_GRACEFUL_TIMEOUT=int(os.environ.get("WEB_GRACEFUL_TIMEOUT", "60"))
+WEB_KEEPALIVE=int(os.environ.get("WEB_KEEPALIVE", "5"))
+# Connections the kernel holds before a worker accepts them; kept short so overload surfaces as rejections
+WEB_BACKLOG=int(os.environ.get("WEB_BACKLOG", "128"))
+
+
+class DiagnosisServer(BaseApplication):
+    def __init__(self, options):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # Imported in each worker after the fork, so per-process threads (janitor, job pool) start there
+        from app import app
+        return app
+
+
+def main():
+    total = admission.MAX_CONCURRENT_DIAGNOSES_TOTAL
+    if total > 0:
+        # Before forking, so every worker shares the same slots and load counters
+        admission.enable_shared_limit(total)
+    if WEB_WORKERS > 1:
+        # Job status and event requests can reach any worker, so job events go through files
+        # (private to this user; see storage_manager.private_dir)
+        os.environ.setdefault("JOB_EVENTS_DIR", os.path.join(STATE_DIR, "jobs"))
+        # Likewise follow-up questions in a consultation session
+        os.environ.setdefault("SESSION_DIR", os.path.join(STATE_DIR, "sessions"))
+
+    logging.info(
+        f"Serving on {WEB_BIND} with {WEB_WORKERS} workers x {WEB_THREADS} threads, "
+        f"{admission.MAX_CONCURRENT_DIAGNOSES} diagnoses per worker"
+        + (f", {total} in total" if total > 0 else "")
+    )
+    DiagnosisServer({
+        "bind": WEB_BIND,
+        "workers": WEB_WORKERS,
+        # Threads, not async: the pipeline blocks on network calls, and event streams hold a thread each
+        "worker_class": "gthread",
+        "threads": WEB_THREADS,
+        "timeout": WEB_TIMEOUT,
+        "graceful_timeout": WEB_GRACEFUL_TIMEOUT,
+        "keepalive": WEB_KEEPALIVE,
+        "backlog": WEB_BACKLOG,
+        "accesslog": "-"
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
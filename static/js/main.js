@@ -224,78 +224,160 @@ document.addEventListener('DOMContentLoaded', function() {
         const formData = new FormData();
         formData.append('audio', audioBlob, 'recording.wav');
         formData.append('image', imageFile);
+        // Ask for the diagnosis to be streamed sentence by sentence
+        formData.append('stream', '1');
+        // Compressed MP3 unless this browser cannot play it
+        formData.append('audio_format', diagnosisAudio.canPlayType('audio/mpeg') ? 'mp3' : 'wav');
+
+        // Progress for each pipeline stage reported by the server
+        const stageProgress = {
+            queued: { progress: 5, message: 'Waiting for an available doctor...' },
+            started: { progress: 10, message: 'Recording transcription in progress...' },
+            transcribed: { progress: 40, message: 'Dr. Arogya is analyzing your image...' },
+            diagnosed: { progress: 75, message: 'Preparing audio response...' },
+            audio_ready: { progress: 95, message: 'Almost done...' }
+        };
 
-        // Animate progress
-        let progress = 0;
-        const progressInterval = setInterval(() => {
-            progress += 5;
-            if (progress > 90) {
-                clearInterval(progressInterval);
+        function showStage(stage) {
+            const info = stageProgress[stage];
+            if (info) {
+                progressFill.style.width = `${info.progress}%`;
+                loadingStatus.textContent = info.message;
             }
-            progressFill.style.width = `${progress}%`;
-        }, 500);
-
-        // Update loading status messages
-        const statusMessages = [
-            'Recording transcription in progress...',
-            'Analyzing image...',
-            'Dr. Arogya is thinking...',
-            'Generating diagnosis...',
-            'Preparing audio response...'
-        ];
-
-        let messageIndex = 0;
-        const messageInterval = setInterval(() => {
-            loadingStatus.textContent = statusMessages[messageIndex];
-            messageIndex = (messageIndex + 1) % statusMessages.length;
-        }, 3000);
-
-        // Send request
-        fetch('/api/upload', {
-            method: 'POST',
-            body: formData
-        })
-        .then(response => response.json())
-        .then(data => {
-            // Clear intervals
-            clearInterval(progressInterval);
-            clearInterval(messageInterval);
+        }
 
-            if (data.status === 'success') {
-                // Complete progress bar
-                progressFill.style.width = '100%';
+        // Streamed audio segments are played back in order as they arrive
+        const segmentQueue = [];
+        let streamedSegments = 0;
+        let finalAudio = null;
+
+        function playNextSegment() {
+            if (segmentQueue.length > 0) {
+                diagnosisAudio.src = segmentQueue.shift();
+                diagnosisAudio.play().catch(() => {});
+            } else if (finalAudio) {
+                // Swap in the full response once the streamed segments have played
+                diagnosisAudio.onended = null;
+                diagnosisAudio.src = finalAudio;
+            }
+        }
 
-                // Update outputs
-                transcriptionOutput.textContent = data.transcription;
-                diagnosisOutput.textContent = data.diagnosis;
-                diagnosisAudio.src = data.audio_response;
+        function showSegment(segment) {
+            if (streamedSegments === 0) {
+                // The patient can start listening, so stop blocking the page
+                loadingOverlay.classList.remove('active');
+                diagnosisOutput.textContent = '';
+                diagnosisAudio.onended = playNextSegment;
+            }
+            streamedSegments++;
 
-                // Hide loading overlay after a short delay
-                setTimeout(() => {
-                    loadingOverlay.classList.remove('active');
-                }, 1000);
+            diagnosisOutput.textContent += (diagnosisOutput.textContent ? ' ' : '') + segment.text;
+            segmentQueue.push(segment.audio_url);
+            if (diagnosisAudio.paused || diagnosisAudio.ended) {
+                playNextSegment();
+            }
+        }
 
-                // Scroll to results
-                document.querySelector('.output-section').scrollIntoView({ behavior: 'smooth' });
+        function showResult(data) {
+            // Complete progress bar
+            progressFill.style.width = '100%';
+
+            // Update outputs
+            transcriptionOutput.textContent = data.transcription;
+            diagnosisOutput.textContent = data.diagnosis;
+            if (streamedSegments > 0) {
+                finalAudio = data.audio_response;
+                if (segmentQueue.length === 0 && (diagnosisAudio.paused || diagnosisAudio.ended)) {
+                    playNextSegment();
+                }
             } else {
-                // Hide loading overlay
+                diagnosisAudio.src = data.audio_response;
+            }
+
+            // Hide loading overlay after a short delay
+            setTimeout(() => {
                 loadingOverlay.classList.remove('active');
+            }, 1000);
 
-                // Show error
-                alert(`Error: ${data.message}`);
-            }
-        })
-        .catch(error => {
-            // Clear intervals
-            clearInterval(progressInterval);
-            clearInterval(messageInterval);
+            // Scroll to results
+            document.querySelector('.output-section').scrollIntoView({ behavior: 'smooth' });
+        }
 
+        function showError(message) {
             // Hide loading overlay
             loadingOverlay.classList.remove('active');
 
             // Show error
-            alert(`Error: ${error.message}`);
-        });
+            alert(`Error: ${message}`);
+        }
+
+        // Follow job progress with Server-Sent Events, or poll when they are unavailable
+        function followJob(job) {
+            if (window.EventSource) {
+                const events = new EventSource(job.events_url);
+                Object.keys(stageProgress).forEach(stage => {
+                    events.addEventListener(stage, () => showStage(stage));
+                });
+                events.addEventListener('transcribed', event => {
+                    transcriptionOutput.textContent = JSON.parse(event.data).transcription;
+                });
+                events.addEventListener('segment', event => showSegment(JSON.parse(event.data)));
+                events.addEventListener('done', event => {
+                    events.close();
+                    showResult(JSON.parse(event.data));
+                });
+                events.addEventListener('busy', event => {
+                    events.close();
+                    const busy = JSON.parse(event.data);
+                    showError(`${busy.message}. Please try again in ${busy.retry_after} seconds.`);
+                });
+                events.addEventListener('error', event => {
+                    events.close();
+                    showError(event.data ? JSON.parse(event.data).message : 'Lost connection to the server');
+                });
+                return;
+            }
+
+            const pollInterval = setInterval(() => {
+                fetch(job.status_url)
+                    .then(response => response.json())
+                    .then(data => {
+                        showStage(data.stage);
+                        if (data.status === 'done') {
+                            clearInterval(pollInterval);
+                            showResult(data.result);
+                        } else if (data.status === 'busy') {
+                            clearInterval(pollInterval);
+                            showError(`${data.error}. Please try again in ${data.retry_after} seconds.`);
+                        } else if (data.status !== 'queued' && data.status !== 'running') {
+                            clearInterval(pollInterval);
+                            showError(data.error || data.message);
+                        }
+                    })
+                    .catch(error => {
+                        clearInterval(pollInterval);
+                        showError(error.message);
+                    });
+            }, 1000);
+        }
+
+        progressFill.style.width = '0%';
+        loadingStatus.textContent = 'Uploading your files...';
+
+        // Send request
+        fetch('/api/jobs', {
+            method: 'POST',
+            body: formData
+        })
+        .then(response => response.json())
+        .then(data => {
+            if (data.status === 'accepted') {
+                followJob(data);
+            } else {
+                showError(data.message);
+            }
+        })
+        .catch(error => showError(error.message));
     });
 
     // Add animations to elements when they come into view
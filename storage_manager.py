@@ -0,0 +1,229 @@
+#Lifecycle management for uploaded inputs and generated audio
+import os
+import re
+import hashlib
+import time
+import uuid
+import logging
+import threading
+
+UPLOAD_FOLDER=os.environ.get("UPLOAD_FOLDER", "uploads")
+STORAGE_QUOTA_BYTES=int(os.environ.get("STORAGE_QUOTA_BYTES", str(1024 * 1024 * 1024)))
+INPUT_TTL_SECONDS=int(os.environ.get("INPUT_TTL_SECONDS", "3600"))
+OUTPUT_TTL_SECONDS=int(os.environ.get("OUTPUT_TTL_SECONDS", "86400"))
+# Files named <uuid4>.<ext> by versions before the kind prefix (uploads, and <uuid4>.wav.mp3 responses)
+LEGACY_TTL_SECONDS=int(os.environ.get("LEGACY_TTL_SECONDS", str(7 * 86400)))
+JANITOR_INTERVAL_SECONDS=int(os.environ.get("JANITOR_INTERVAL_SECONDS", "300"))
+# With 0, uploaded images and recordings are processed from memory and never written to disk
+KEEP_UPLOADED_INPUTS=os.environ.get("KEEP_UPLOADED_INPUTS", "1") == "1"
+# State the server's worker processes share (job events, consultation sessions, slot locks); it holds
+# transcripts, diagnoses and images, so it stays out of the shared temp directory
+STATE_DIR=os.environ.get("STATE_DIR", "state")
+
+# Artifact kinds and how long each is kept. The kind is the filename prefix, so the
+# policy survives restarts and is the same in every worker process.
+ARTIFACT_TTLS = {
+    "image": INPUT_TTL_SECONDS,
+    "recording": INPUT_TTL_SECONDS,
+    "response": OUTPUT_TTL_SECONDS,
+    "segment": OUTPUT_TTL_SECONDS,
+    "legacy": LEGACY_TTL_SECONDS
+}
+
+# kind-<uuid4> plus extensions, as named by new_path (and the variants and partial writes derived from it)
+ARTIFACT_NAME = re.compile(r"^([a-z]+)-[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(\.[a-z0-9]+)*$")
+# <uuid4> plus extensions, as older versions named uploads and responses; kept as the "legacy" kind
+LEGACY_NAME = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}(\.[a-z0-9]+)+$")
+
+
+def private_dir(path, tighten=False):
+    """
+    Create path for this user only (0700), or check an existing one: it must belong to this
+    user and be closed to group and others. Returns path; raises PermissionError otherwise,
+    rather than changing a directory the operator may have pointed at by mistake. tighten
+    instead narrows an existing directory of this user's to 0700, for directories the app
+    itself creates (and older checkouts made with the default umask).
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    stat = os.stat(path)
+    if hasattr(os, "getuid") and stat.st_uid != os.getuid():
+        raise PermissionError(f"{path} belongs to another user; refusing to keep patient data in it")
+    if stat.st_mode & 0o077:
+        if not tighten:
+            raise PermissionError(f"{path} is open to other users (mode {stat.st_mode & 0o777:o}); chmod 700 it or choose another directory")
+        logging.warning(f"Restricting {path} to this user (mode {stat.st_mode & 0o777:o} -> 700)")
+        os.chmod(path, 0o700)
+    return path
+
+
+def open_private(path, mode="w"):
+    """open() for writing a file only this user can read (0600), whatever the umask; mode "w" or "a"."""
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if "a" in mode else os.O_TRUNC)
+    return os.fdopen(os.open(path, flags, 0o600), mode)
+
+
+def read_input(source):
+    """
+    Return the bytes of a pipeline input: a file path or an in-memory (filename, bytes) pair.
+
+    In-memory inputs come back as they are, without a copy; that may be an upload's read-only
+    memory map (see ingestion.py) rather than bytes.
+    """
+    if isinstance(source, tuple):
+        return source[1]
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def input_bytes(source):
+    """read_input as a bytes object, for consumers such as HTTP clients that take nothing else."""
+    data = read_input(source)
+    return data if isinstance(data, bytes) else bytes(data)
+
+
+def input_digest(source):
+    """SHA-256 hex digest of a pipeline input; uploads carry the one computed while they streamed in."""
+    if isinstance(source, tuple) and len(source) > 2:
+        return source[2]
+    return hashlib.sha256(read_input(source)).hexdigest()
+
+
+def input_name(source):
+    return source[0] if isinstance(source, tuple) else source
+
+
+class StorageManager:
+    """
+    Owns the upload directory: names new artifacts, expires them by kind and keeps the
+    directory under a byte quota by deleting the oldest files first. Only its own artifacts
+    (named kind-<uuid>) are ever deleted.
+    """
+
+    def __init__(self, root=UPLOAD_FOLDER, quota_bytes=STORAGE_QUOTA_BYTES, ttls=None, default_ttl=None):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.ttls = dict(ARTIFACT_TTLS if ttls is None else ttls)
+        # Files without a known kind prefix weren't written by this code (e.g. the committed samples);
+        # None leaves them alone, neither expired nor evicted for the quota
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._written_since_cleanup = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._janitor = None
+        self._last_cleanup = {"at": None, "expired": 0, "evicted": 0}
+        # Uploads, recordings and spoken diagnoses are patient data; only the server user can list or read them
+        private_dir(root, tighten=True)
+
+    def new_path(self, kind, extension=""):
+        """Path for a new artifact of the given kind, e.g. new_path("image", ".jpeg")."""
+        if kind not in self.ttls:
+            raise ValueError(f"Unknown artifact kind: {kind}")
+        return os.path.join(self.root, f"{kind}-{uuid.uuid4()}{extension}")
+
+    def note_write(self, nbytes):
+        """Record bytes written; wakes the janitor early if they could push usage over the quota."""
+        with self._lock:
+            self._written_since_cleanup += nbytes
+            wake = self._written_since_cleanup > self.quota_bytes // 10
+        if wake:
+            self._wake.set()
+
+    def kind_of(self, filename):
+        """The artifact kind of a file this manager named, or None for anything else."""
+        match = ARTIFACT_NAME.match(filename)
+        if match is None:
+            return "legacy" if LEGACY_NAME.match(filename) and "legacy" in self.ttls else None
+        return match.group(1) if match.group(1) in self.ttls else None
+
+    def _scan(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.is_file():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.name))
+        return entries
+
+    def usage(self):
+        total = 0
+        files = 0
+        by_kind = {}
+        for _, size, name in self._scan():
+            kind = self.kind_of(name) or "other"
+            by_kind[kind] = by_kind.get(kind, 0) + size
+            total += size
+            files += 1
+        with self._lock:
+            last_cleanup = dict(self._last_cleanup)
+        return {
+            "bytes": total,
+            "files": files,
+            "quota_bytes": self.quota_bytes,
+            "by_kind": by_kind,
+            "last_cleanup": last_cleanup
+        }
+
+    def _remove(self, name):
+        try:
+            os.remove(os.path.join(self.root, name))
+            return True
+        except FileNotFoundError:
+            # Another worker's janitor got there first
+            return False
+
+    def cleanup(self):
+        """Delete expired artifacts, then the oldest ones until usage is within the quota."""
+        now = time.time()
+        entries = sorted(self._scan())
+        kept = []
+        expired = 0
+        for mtime, size, name in entries:
+            ttl = self.ttls.get(self.kind_of(name), self.default_ttl)
+            if ttl is None:
+                continue
+            if now - mtime > ttl:
+                expired += self._remove(name)
+            else:
+                kept.append((mtime, size, name))
+
+        total = sum(size for _, size, _ in kept)
+        evicted = 0
+        for _, size, name in kept:
+            if total <= self.quota_bytes:
+                break
+            evicted += self._remove(name)
+            total -= size
+
+        with self._lock:
+            self._written_since_cleanup = 0
+            self._last_cleanup = {"at": now, "expired": expired, "evicted": evicted}
+        if expired or evicted:
+            logging.info(f"Storage cleanup removed {expired} expired and {evicted} over-quota files, {total} bytes in use")
+        return expired + evicted
+
+    def start_janitor(self, interval=JANITOR_INTERVAL_SECONDS):
+        """Run cleanup() every `interval` seconds (or sooner after heavy writes) on a daemon thread."""
+        if self._janitor is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.cleanup()
+                except Exception as e:
+                    logging.error(f"Storage cleanup failed: {e}")
+                self._wake.wait(interval)
+                self._wake.clear()
+
+        self._janitor = threading.Thread(target=run, name="storage-janitor", daemon=True)
+        self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop.set()
+        self._wake.set()
+
+
+storage = StorageManager()
@@ -0,0 +1,164 @@
+#Registered speech-to-text engines: GROQ's hosted Whisper and a local CPU Whisper
+import os
+import logging
+import threading
+import importlib.util
+from io import BytesIO
+
+from api_clients import get_groq_client, STT_TIMEOUT
+from model_router import ModelRouter
+from metrics import span
+
+# Engine tried first; "auto" orders the available engines by measured latency
+STT_ENGINE=os.environ.get("STT_ENGINE", "groq")
+GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
+GROQ_STT_MODEL=os.environ.get("GROQ_STT_MODEL", "whisper-large-v3")
+
+# Local engine (pip install faster-whisper): an int8-quantized Whisper loaded once per process
+STT_LOCAL_MODEL=os.environ.get("STT_LOCAL_MODEL", "small.en")
+STT_LOCAL_COMPUTE_TYPE=os.environ.get("STT_LOCAL_COMPUTE_TYPE", "int8")
+# 0 lets CTranslate2 decide
+STT_LOCAL_CPU_THREADS=int(os.environ.get("STT_LOCAL_CPU_THREADS", "0"))
+# Transcriptions the loaded model runs side by side for concurrent requests
+STT_LOCAL_WORKERS=int(os.environ.get("STT_LOCAL_WORKERS", "2"))
+# Speech segments of one recording decoded together
+STT_LOCAL_BATCH_SIZE=int(os.environ.get("STT_LOCAL_BATCH_SIZE", "8"))
+# With "auto", recordings up to this long go to the local engine first, so nothing is uploaded
+STT_LOCAL_MAX_SECONDS=float(os.environ.get("STT_LOCAL_MAX_SECONDS", "20"))
+
+
+class STTEngine:
+    """One speech recognizer. transcribe() takes a (filename, bytes) recording and returns its text."""
+    name = None
+    # Runs on this machine, with no upload
+    local = False
+
+    def available(self):
+        return True
+
+    def transcribe(self, audio):
+        raise NotImplementedError
+
+
+class GroqSTTEngine(STTEngine):
+    name = "groq"
+    model = GROQ_STT_MODEL
+
+    def available(self):
+        return bool(GROQ_API_KEY) and GROQ_API_KEY != "your_groq_api_key_here"
+
+    def transcribe(self, audio):
+        logging.info(f"Sending audio transcription request to GROQ API with model: {self.model}")
+        transcription = get_groq_client(GROQ_API_KEY).audio.transcriptions.create(
+            model=self.model,
+            file=audio,
+            language="en",
+            timeout=STT_TIMEOUT
+        )
+        return transcription.text
+
+
+class FasterWhisperEngine(STTEngine):
+    """
+    Whisper on the CPU with faster-whisper.
+
+    The model is loaded on first use (or by the start-up warm-up) and kept for the life of the
+    worker process. Concurrent requests share it through CTranslate2's worker pool, and the
+    speech segments of each recording are decoded in batches.
+    """
+    name = "faster_whisper"
+    local = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._model = None
+        self._pipeline = None
+        self._installed = None
+
+    def available(self):
+        if self._installed is None:
+            self._installed = importlib.util.find_spec("faster_whisper") is not None
+        return self._installed
+
+    def load(self):
+        with self._lock:
+            if self._model is None:
+                import faster_whisper
+
+                logging.info(f"Loading local Whisper model {STT_LOCAL_MODEL} ({STT_LOCAL_COMPUTE_TYPE})")
+                self._model = faster_whisper.WhisperModel(
+                    STT_LOCAL_MODEL,
+                    device="cpu",
+                    compute_type=STT_LOCAL_COMPUTE_TYPE,
+                    cpu_threads=STT_LOCAL_CPU_THREADS,
+                    num_workers=STT_LOCAL_WORKERS
+                )
+                # Batched decoding arrived in faster-whisper 1.1; older versions decode segment by segment
+                batched = getattr(faster_whisper, "BatchedInferencePipeline", None)
+                self._pipeline = batched(model=self._model) if batched else None
+            return self._model, self._pipeline
+
+    def transcribe(self, audio):
+        model, pipeline = self.load()
+        if pipeline is not None:
+            segments, _ = pipeline.transcribe(BytesIO(audio[1]), language="en", batch_size=STT_LOCAL_BATCH_SIZE)
+        else:
+            segments, _ = model.transcribe(BytesIO(audio[1]), language="en", beam_size=1)
+        # Segments are decoded lazily, as the generator is consumed
+        return " ".join(segment.text.strip() for segment in segments).strip()
+
+
+engines = {}
+
+def register_engine(engine):
+    """Add an engine under engine.name; returns it."""
+    engines[engine.name] = engine
+    return engine
+
+register_engine(GroqSTTEngine())
+register_engine(FasterWhisperEngine())
+
+# Circuit breakers and fallback between engines, as for the vision models
+stt_router = ModelRouter("stt", hedging=False)
+
+
+def candidate_engines(requested=STT_ENGINE, duration_seconds=None):
+    """
+    Names of the available engines to try, in order.
+
+    With "auto", short recordings (up to STT_LOCAL_MAX_SECONDS) go to local engines first and
+    the rest are ordered by median latency, unmeasured engines first. Otherwise the requested
+    engine comes first and the others follow as fallbacks, local ones first.
+    """
+    names = [name for name, engine in engines.items() if engine.available()]
+
+    def by_latency(name):
+        median = stt_router.percentile(name)
+        return (median is not None, median or 0)
+
+    if requested == "auto":
+        short = duration_seconds is not None and duration_seconds <= STT_LOCAL_MAX_SECONDS
+        ordered = sorted(names, key=lambda name: (not (short and engines[name].local), by_latency(name)))
+    else:
+        fallbacks = sorted((name for name in names if name != requested),
+                           key=lambda name: (not engines[name].local, by_latency(name)))
+        ordered = ([requested] if requested in names else []) + fallbacks
+    return stt_router.order(ordered)
+
+
+def transcribe_chunk(audio, candidates):
+    """Transcribe one (filename, bytes) recording with the first candidate engine that succeeds."""
+    def attempt(name):
+        with span(f"stt_{name}"):
+            return engines[name].transcribe(audio)
+
+    with span("stt"):
+        return stt_router.call(candidates, attempt)
+
+
+def stt_stats():
+    return {
+        "default": STT_ENGINE,
+        "engines": {name: {"available": engine.available(), "local": engine.local} for name, engine in engines.items()},
+        "router": stt_router.stats()
+    }
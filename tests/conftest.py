@@ -0,0 +1,14 @@
+#Shared test setup: the repo's modules are importable and keep their files out of the working tree
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# Set before any module under test is imported, since they read their settings at import time
+_work_dir = tempfile.mkdtemp(prefix="arogya-tests-")
+os.environ.setdefault("STARTUP_PREWARM", "off")
+os.environ.setdefault("UPLOAD_FOLDER", os.path.join(_work_dir, "uploads"))
+os.environ.setdefault("CACHE_DIR", os.path.join(_work_dir, "cache"))
+os.environ.setdefault("STATE_DIR", os.path.join(_work_dir, "state"))
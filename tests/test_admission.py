@@ -0,0 +1,89 @@
+import time
+import threading
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, SharedLimit
+
+
+def test_slot_wait_times_out_with_503():
+    admission = AdmissionController(max_concurrent=1, queue_size=4, max_wait=0.05)
+    with admission.slot():
+        with pytest.raises(AdmissionRejected) as rejected:
+            with admission.slot():
+                pass
+    assert rejected.value.status_code == 503
+    assert rejected.value.reason == "wait_timeout"
+    assert rejected.value.retry_after >= 1
+
+
+def test_full_queue_is_rejected_with_429():
+    admission = AdmissionController(max_concurrent=1, queue_size=1, max_wait=5)
+
+    def wait_in_line():
+        with admission.slot():
+            pass
+
+    with admission.slot():
+        waiter = threading.Thread(target=wait_in_line)
+        waiter.start()
+        deadline = time.monotonic() + 5
+        while admission.load() < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with pytest.raises(AdmissionRejected) as rejected:
+            admission.check()
+        assert rejected.value.status_code == 429
+        with pytest.raises(AdmissionRejected):
+            with admission.slot():
+                pass
+    waiter.join()
+
+
+def test_max_wait_overrides_controller_limit():
+    admission = AdmissionController(max_concurrent=1, queue_size=4, max_wait=30)
+    with admission.slot():
+        with pytest.raises(AdmissionRejected):
+            with admission.slot(max_wait=0.05):
+                pass
+
+
+def test_slot_is_released_on_error():
+    admission = AdmissionController(max_concurrent=1, queue_size=1, max_wait=0.05)
+    with pytest.raises(ValueError):
+        with admission.slot():
+            raise ValueError("pipeline failed")
+    with admission.slot():
+        assert admission.load() == 1.0
+    assert admission.load() == 0.0
+
+
+def test_shared_limit_caps_slots_across_controllers(tmp_path):
+    shared = SharedLimit(1, directory=str(tmp_path / "slots"))
+    first = AdmissionController(max_concurrent=2, queue_size=4, max_wait=0.05, shared=shared)
+    second = AdmissionController(max_concurrent=2, queue_size=4, max_wait=0.05, shared=shared)
+    with first.slot():
+        with pytest.raises(AdmissionRejected):
+            with second.slot():
+                pass
+    with second.slot():
+        pass
+
+
+def test_shared_slot_freed_for_waiter(tmp_path):
+    shared = SharedLimit(1, directory=str(tmp_path / "slots"))
+    admission = AdmissionController(max_concurrent=2, queue_size=4, max_wait=2, shared=shared)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with admission.slot():
+            holding.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    holding.wait(5)
+    threading.Timer(0.1, release.set).start()
+    with admission.slot():
+        pass
+    holder.join()
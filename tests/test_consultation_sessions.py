@@ -0,0 +1,65 @@
+import os
+
+from consultation_sessions import SessionStore, ConsultationSession
+
+
+def test_history_keeps_most_recent_turns_within_budget():
+    session = ConsultationSession("id", "image", "image/jpeg", turns=[["q" * 40, "a" * 40]] * 5)
+    # Each turn costs 20 tokens
+    assert len(session.history(token_budget=50)) == 2
+    history, query = session.conversation("Prompt. ", "follow-up", token_budget=50)
+    assert history[0][0].startswith("Prompt. ")
+    assert query == "follow-up"
+
+
+def test_sessions_are_evicted_by_count():
+    store = SessionStore(max_count=2, directory=None)
+    first = store.create("a", "image/png")
+    store.create("b", "image/png")
+    store.create("c", "image/png")
+    assert store.get(first.id) is None
+    assert store.stats()["evicted"] == 1
+
+
+def test_mirrored_session_is_served_by_another_worker(tmp_path):
+    directory = str(tmp_path / "sessions")
+    first = SessionStore(directory=directory)
+    second = SessionStore(directory=directory)
+    session = first.create("image", "image/jpeg")
+    first.record_turn(session, "Is it eczema?", "It looks like eczema.")
+
+    loaded = second.get(session.id)
+    assert loaded is not None
+    assert loaded.turns == [["Is it eczema?", "It looks like eczema."]]
+    assert os.stat(os.path.join(directory, f"{session.id}.json")).st_mode & 0o777 == 0o600
+
+
+def test_turns_from_two_workers_are_both_kept(tmp_path):
+    directory = str(tmp_path / "sessions")
+    first = SessionStore(directory=directory)
+    second = SessionStore(directory=directory)
+    session_id = first.create("image", "image/jpeg").id
+    in_first = first.get(session_id)
+    in_second = second.get(session_id)
+
+    first.record_turn(in_first, "q1", "a1")
+    second.record_turn(in_second, "q2", "a2")
+
+    expected = [["q1", "a1"], ["q2", "a2"]]
+    assert first.get(session_id).turns == expected
+    assert second.get(session_id).turns == expected
+
+
+def test_delete_removes_mirrored_files(tmp_path):
+    directory = str(tmp_path / "sessions")
+    store = SessionStore(directory=directory)
+    session = store.create("image", "image/jpeg")
+    store.record_turn(session, "q", "a")
+    assert store.delete(session.id)
+    assert os.listdir(directory) == []
+    assert SessionStore(directory=directory).get(session.id) is None
+
+
+def test_unsafe_ids_never_reach_the_file_system(tmp_path):
+    store = SessionStore(directory=str(tmp_path / "sessions"))
+    assert store.get("../../etc/passwd") is None
@@ -0,0 +1,118 @@
+import os
+import time
+import threading
+
+import pytest
+
+from diagnosis_cache import DiagnosisCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return DiagnosisCache("test", str(tmp_path / "test"))
+
+
+def test_concurrent_misses_compute_once(cache):
+    calls = []
+    release = threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return b"diagnosis"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("key", compute))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    # Let every caller reach the cache before the leader's computation finishes
+    deadline = time.monotonic() + 5
+    while cache.stats()["joined"] < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [b"diagnosis"] * 8
+    assert cache.stats()["joined"] == 7
+    assert cache.get_or_compute("key", lambda: b"recomputed") == b"diagnosis"
+
+
+def test_error_reaches_joined_callers_and_is_not_cached(cache):
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("model down")
+
+    errors = []
+
+    def call():
+        try:
+            cache.get_or_compute("key", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    deadline = time.monotonic() + 5
+    while cache.stats()["joined"] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert errors == ["model down", "model down"]
+    assert cache.get_or_compute("key", lambda: b"ok") == b"ok"
+
+
+def test_should_cache_vetoes_error_responses(cache):
+    value = cache.get_or_compute("key", lambda: b"ERROR: busy", should_cache=lambda v: not v.startswith(b"ERROR:"))
+    assert value == b"ERROR: busy"
+    assert cache.get("key") is None
+
+
+def test_disk_entries_expire_after_ttl(tmp_path):
+    directory = str(tmp_path / "ttl")
+    DiagnosisCache("ttl", directory, disk_ttl=60).put("key", b"old answer")
+    written = time.time() - 120
+    os.utime(os.path.join(directory, "key"), (written, written))
+
+    # A fresh instance has an empty memory tier, like another worker process
+    cache = DiagnosisCache("ttl", directory, disk_ttl=60)
+    assert cache.get("key") is None
+    assert not os.path.exists(os.path.join(directory, "key"))
+    assert cache.stats()["expired"] == 1
+    assert cache.get_or_compute("key", lambda: b"new answer") == b"new answer"
+
+
+def test_disk_hit_within_ttl(tmp_path):
+    directory = str(tmp_path / "ttl")
+    DiagnosisCache("ttl", directory, disk_ttl=60).put("key", b"answer")
+    cache = DiagnosisCache("ttl", directory, disk_ttl=60)
+    assert cache.get_or_compute("key", lambda: b"recomputed") == b"answer"
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = DiagnosisCache("lru", str(tmp_path / "lru"), memory_max_bytes=10)
+    cache.put("a", b"aaaa")
+    cache.put("b", b"bbbb")
+    cache.get("a")
+    cache.put("c", b"cccc")
+    stats = cache.stats()
+    assert list(cache._memory) == ["a", "c"]
+    assert stats["memory_entries"] == 2
+    assert stats["memory_bytes"] == 8
+
+
+def test_cache_files_are_private(cache):
+    cache.put("key", b"value")
+    assert os.stat(cache.directory).st_mode & 0o777 == 0o700
+    assert os.stat(os.path.join(cache.directory, "key")).st_mode & 0o777 == 0o600
@@ -0,0 +1,12 @@
+import os
+import sys
+import subprocess
+
+from conftest import REPO_ROOT
+
+
+def test_app_imports_within_budget():
+    # The script imports app in fresh interpreters and fails over budget or on an eager SDK import
+    result = subprocess.run([sys.executable, os.path.join(REPO_ROOT, "benchmarks", "check_import_time.py")],
+                            cwd=REPO_ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout + result.stderr
@@ -0,0 +1,52 @@
+import mmap
+import hashlib
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import ingestion
+from ingestion import IngestSpool, IngestBudget
+
+PNG_HEAD = b"\x89PNG\r\n\x1a\n" + bytes(8)
+
+
+def test_spool_hashes_and_sniffs_as_chunks_arrive():
+    spool = IngestSpool("photo.png", IngestBudget())
+    spool.write(PNG_HEAD[:4])
+    spool.write(PNG_HEAD[4:] + b"rest")
+    assert spool.media == "image"
+    assert spool.sha256 == hashlib.sha256(PNG_HEAD + b"rest").hexdigest()
+    assert spool.data() == PNG_HEAD + b"rest"
+
+
+def test_oversized_image_is_rejected_mid_stream(monkeypatch):
+    monkeypatch.setattr(ingestion, "MAX_IMAGE_UPLOAD_BYTES", 32)
+    spool = IngestSpool("photo.jpg", IngestBudget())
+    spool.write(bytes(32))
+    with pytest.raises(RequestEntityTooLarge):
+        spool.write(b"x")
+
+
+def test_audio_has_its_own_limit(monkeypatch):
+    monkeypatch.setattr(ingestion, "MAX_IMAGE_UPLOAD_BYTES", 8)
+    monkeypatch.setattr(ingestion, "MAX_AUDIO_UPLOAD_BYTES", 64)
+    spool = IngestSpool("question.wav", IngestBudget())
+    spool.write(bytes(64))
+    with pytest.raises(RequestEntityTooLarge):
+        spool.write(b"x")
+
+
+def test_spills_to_disk_past_the_memory_budget():
+    budget = IngestBudget(limit=16)
+    first = IngestSpool("a.png", budget)
+    first.write(PNG_HEAD)
+    second = IngestSpool("b.png", budget)
+    second.write(PNG_HEAD + b"more")
+
+    assert not first.on_disk
+    assert second.on_disk
+    assert budget.peak == 16
+    assert budget.spilled == len(PNG_HEAD) + 4
+    data = second.data()
+    assert isinstance(data, mmap.mmap)
+    assert bytes(data) == PNG_HEAD + b"more"
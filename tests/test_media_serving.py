@@ -0,0 +1,70 @@
+import os
+import hashlib
+
+import pytest
+from flask import Flask
+
+from media_serving import send_media
+
+ARTIFACT = "image-0a199641-95aa-4a66-4c50-88018705270c.png"
+BODY = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def client(tmp_path):
+    root = str(tmp_path)
+    with open(os.path.join(root, ARTIFACT), "wb") as f:
+        f.write(BODY)
+    with open(os.path.join(root, "sample.png"), "wb") as f:
+        f.write(BODY)
+
+    app = Flask(__name__)
+
+    @app.route("/uploads/<path:filename>")
+    def uploads(filename):
+        return send_media(filename, root)
+
+    return app.test_client()
+
+
+def test_strong_etag_from_content(client):
+    response = client.get(f"/uploads/{ARTIFACT}")
+    assert response.status_code == 200
+    assert response.data == BODY
+    assert response.headers["ETag"] == f'"{hashlib.sha256(BODY).hexdigest()[:32]}"'
+
+
+def test_if_none_match_answers_304(client):
+    etag = client.get(f"/uploads/{ARTIFACT}").headers["ETag"]
+    response = client.get(f"/uploads/{ARTIFACT}", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_range_request(client):
+    response = client.get(f"/uploads/{ARTIFACT}", headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.data == BODY[10:20]
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(BODY)}"
+
+
+def test_if_range_with_stale_etag_sends_whole_file(client):
+    response = client.get(f"/uploads/{ARTIFACT}", headers={"Range": "bytes=10-19", "If-Range": '"stale"'})
+    assert response.status_code == 200
+    assert response.data == BODY
+
+
+def test_artifacts_are_private_and_immutable(client):
+    cache_control = client.get(f"/uploads/{ARTIFACT}").headers["Cache-Control"]
+    assert "private" in cache_control
+    assert "immutable" in cache_control
+    assert "public" not in cache_control
+
+
+def test_other_files_are_revalidated(client):
+    cache_control = client.get("/uploads/sample.png").headers["Cache-Control"]
+    assert "no-cache" in cache_control
+    assert "immutable" not in cache_control
+
+
+def test_paths_outside_the_root_are_not_found(client):
+    assert client.get("/uploads/../secret.txt").status_code == 404
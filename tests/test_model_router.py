@@ -0,0 +1,123 @@
+import time
+import threading
+
+import pytest
+
+import model_router
+from model_router import ModelRouter, AllModelsFailed
+
+
+def failing(model):
+    raise RuntimeError(f"{model} failed")
+
+
+def test_falls_back_to_next_model():
+    router = ModelRouter("test-fallback")
+    calls = []
+
+    def attempt(model):
+        calls.append(model)
+        if model == "a":
+            raise RuntimeError("a failed")
+        return model
+
+    assert router.call(["a", "b"], attempt) == "b"
+    assert calls == ["a", "b"]
+    assert router.stats()["decisions"]["fallbacks"] == 1
+
+
+def test_raises_when_every_model_fails():
+    router = ModelRouter("test-exhausted")
+    with pytest.raises(AllModelsFailed):
+        router.call(["a", "b"], failing)
+    assert router.stats()["decisions"]["exhausted"] == 1
+
+
+def test_breaker_opens_after_threshold_and_skips_model():
+    router = ModelRouter("test-breaker", failure_threshold=3, cooldown=60)
+    for _ in range(3):
+        router.record("a", 0.1, success=False)
+    assert router.stats()["models"]["a"]["state"] == "open"
+
+    calls = []
+    assert router.call(["a", "b"], lambda model: calls.append(model) or model) == "b"
+    assert calls == ["b"]
+
+
+def test_breaker_lets_one_probe_through_after_cooldown():
+    router = ModelRouter("test-probe", failure_threshold=1, cooldown=0.05)
+    router.record("a", 0.1, success=False)
+    assert router.order(["a"]) == []
+    time.sleep(0.06)
+
+    assert router.acquire("a")
+    # While the probe is out, nobody else may call the model
+    assert not router.acquire("a")
+    assert router.order(["a"]) == []
+    router.record("a", 0.1, success=True)
+    assert router.stats()["models"]["a"]["state"] == "closed"
+    assert router.order(["a"]) == ["a"]
+
+
+def test_failed_probe_reopens_breaker():
+    router = ModelRouter("test-reopen", failure_threshold=1, cooldown=0.05)
+    router.record("a", 0.1, success=False)
+    time.sleep(0.06)
+    assert router.acquire("a")
+    router.record("a", 0.1, success=False)
+    assert router.stats()["models"]["a"]["state"] == "open"
+    assert router.order(["a"]) == []
+
+
+def test_order_keeps_preference_within_latency_tolerance():
+    router = ModelRouter("test-order")
+    for _ in range(5):
+        router.record("a", 1.5, success=True)
+        router.record("b", 1.0, success=True)
+    assert router.order(["a", "b"]) == ["a", "b"]
+
+
+def test_order_puts_clearly_slower_models_last():
+    router = ModelRouter("test-slow")
+    for _ in range(5):
+        router.record("a", 5.0, success=True)
+        router.record("b", 3.0, success=True)
+        router.record("c", 1.0, success=True)
+    # Untried models count as fast, so they keep their place
+    assert router.order(["a", "b", "new", "c"]) == ["new", "c", "b", "a"]
+
+
+def test_order_prefers_healthier_models():
+    router = ModelRouter("test-health", failure_threshold=100)
+    for _ in range(5):
+        router.record("a", 0.1, success=False)
+        router.record("b", 2.0, success=True)
+    assert router.order(["a", "b"]) == ["b", "a"]
+
+
+def test_hedged_request_goes_to_backup_when_primary_is_slow():
+    router = ModelRouter("test-hedge", hedging=True)
+    for _ in range(model_router.HEDGE_MIN_SAMPLES):
+        router.record("a", 0.01, success=True)
+        router.record("b", 0.01, success=True)
+    release = threading.Event()
+
+    def attempt(model):
+        if model == "a":
+            release.wait(5)
+            return "a"
+        return "b"
+
+    try:
+        assert router.call(["a", "b"], attempt) == "b"
+    finally:
+        release.set()
+    decisions = router.stats()["decisions"]
+    assert decisions["hedges"] == 1
+    assert decisions["hedge_wins"] == 1
+
+
+def test_no_hedge_without_enough_samples():
+    router = ModelRouter("test-no-hedge", hedging=True)
+    assert router.call(["a", "b"], lambda model: model) == "a"
+    assert router.stats()["decisions"]["hedges"] == 0
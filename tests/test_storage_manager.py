@@ -0,0 +1,75 @@
+import os
+import time
+
+import pytest
+
+from storage_manager import StorageManager, private_dir, open_private
+
+LEGACY_UPLOAD = "0a199641-95aa-4a66-9c50-88018705270c.jpeg"
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def write(storage, name, size=1, seconds_old=0):
+    path = os.path.join(storage.root, name)
+    with open(path, "wb") as f:
+        f.write(bytes(size))
+    age(path, seconds_old)
+    return path
+
+
+@pytest.fixture
+def storage(tmp_path):
+    return StorageManager(str(tmp_path / "uploads"), quota_bytes=100,
+                          ttls={"recording": 60, "response": 600, "legacy": 3600})
+
+
+def test_kind_of_recognizes_artifacts_and_legacy_names(storage):
+    name = os.path.basename(storage.new_path("response", ".mp3"))
+    assert storage.kind_of(name) == "response"
+    assert storage.kind_of(name.replace(".mp3", ".ogg")) == "response"
+    assert storage.kind_of(LEGACY_UPLOAD) == "legacy"
+    assert storage.kind_of("skin_rash.jpg") is None
+
+
+def test_cleanup_expires_by_kind(storage):
+    old_recording = write(storage, os.path.basename(storage.new_path("recording", ".wav")), seconds_old=120)
+    fresh_response = write(storage, os.path.basename(storage.new_path("response", ".mp3")), seconds_old=120)
+    old_legacy = write(storage, LEGACY_UPLOAD, seconds_old=7200)
+    other = write(storage, "notes.txt", seconds_old=10 ** 6)
+
+    assert storage.cleanup() == 2
+    assert not os.path.exists(old_recording)
+    assert not os.path.exists(old_legacy)
+    assert os.path.exists(fresh_response)
+    # Files this code didn't name are never removed
+    assert os.path.exists(other)
+
+
+def test_cleanup_evicts_oldest_over_quota(storage):
+    oldest = write(storage, os.path.basename(storage.new_path("response", ".mp3")), size=60, seconds_old=30)
+    newest = write(storage, os.path.basename(storage.new_path("response", ".mp3")), size=60, seconds_old=10)
+    assert storage.cleanup() == 1
+    assert not os.path.exists(oldest)
+    assert os.path.exists(newest)
+
+
+def test_root_and_artifacts_are_private(storage):
+    path = storage.new_path("recording", ".wav")
+    with open_private(path, "wb") as f:
+        f.write(b"x")
+    assert os.stat(storage.root).st_mode & 0o777 == 0o700
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+
+def test_private_dir_refuses_open_directory(tmp_path):
+    directory = tmp_path / "shared"
+    directory.mkdir()
+    os.chmod(directory, 0o755)
+    with pytest.raises(PermissionError):
+        private_dir(str(directory))
+    assert private_dir(str(directory), tighten=True) == str(directory)
+    assert os.stat(directory).st_mode & 0o777 == 0o700
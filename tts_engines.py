@@ -0,0 +1,187 @@
+#Registered text-to-speech engines and latency-based selection between them
+import os
+import shutil
+import logging
+import threading
+import subprocess
+from io import BytesIO
+
+from api_clients import get_elevenlabs_client, TTS_TIMEOUT
+from model_router import ModelRouter
+
+# Engine for responses when the request doesn't name one; "auto" picks the fastest measured engine
+TTS_ENGINE=os.environ.get("TTS_ENGINE", "gtts")
+# Weight of the newest sample in each engine's moving average of seconds per character
+TTS_LATENCY_SMOOTHING=float(os.environ.get("TTS_LATENCY_SMOOTHING", "0.2"))
+
+ELEVENLABS_API_KEY=os.environ.get("ELEVENLABS_API_KEY")
+ESPEAK_COMMAND=os.environ.get("ESPEAK_COMMAND", "espeak-ng")
+ESPEAK_VOICE=os.environ.get("ESPEAK_VOICE", "en-us")
+ESPEAK_WORDS_PER_MINUTE=int(os.environ.get("ESPEAK_WORDS_PER_MINUTE", "165"))
+FFMPEG_COMMAND=os.environ.get("FFMPEG_COMMAND", "ffmpeg")
+
+
+class TTSEngine:
+    """
+    One speech synthesizer. render() turns a single sentence into audio bytes in memory.
+
+    Segments from engines with the same output_format can be joined byte for byte, so a
+    response may mix them; output_format is also part of the phrase cache key.
+    """
+    name = None
+    voice = None
+    output_format = None
+    # Runs on this machine, with no network round trip
+    local = False
+
+    def available(self):
+        return True
+
+    def render(self, sentence):
+        raise NotImplementedError
+
+
+class GTTSEngine(TTSEngine):
+    name = "gtts"
+    voice = "en"
+    output_format = "mp3"
+
+    def render(self, sentence):
+        from gtts import gTTS
+
+        audio_buffer = BytesIO()
+        gTTS(text=sentence, lang=self.voice, slow=False).write_to_fp(audio_buffer)
+        return audio_buffer.getvalue()
+
+
+class ElevenLabsEngine(TTSEngine):
+    name = "elevenlabs"
+    voice = "Aria"
+    output_format = "mp3_22050_32"
+
+    def available(self):
+        return bool(ELEVENLABS_API_KEY) and ELEVENLABS_API_KEY != "your_elevenlabs_api_key_here"
+
+    def render(self, sentence):
+        client = get_elevenlabs_client(ELEVENLABS_API_KEY)
+        audio = client.generate(
+            text=sentence,
+            voice=self.voice,
+            output_format=self.output_format,
+            model="eleven_turbo_v2",
+            request_options={"timeout_in_seconds": int(TTS_TIMEOUT)}
+        )
+        return b"".join(audio)
+
+
+class EspeakEngine(TTSEngine):
+    """
+    Offline synthesis on the CPU with espeak-ng, piped through ffmpeg without temp files.
+
+    The WAV output is encoded to the same 24 kHz mono MP3 as gTTS, so either engine can
+    fill in sentences of a response started by the other.
+    """
+    name = "espeak"
+    voice = ESPEAK_VOICE
+    output_format = "mp3"
+    local = True
+
+    def available(self):
+        return shutil.which(ESPEAK_COMMAND) is not None and shutil.which(FFMPEG_COMMAND) is not None
+
+    def render(self, sentence):
+        wav = subprocess.run(
+            [ESPEAK_COMMAND, "-v", self.voice, "-s", str(ESPEAK_WORDS_PER_MINUTE), "--stdout", sentence],
+            capture_output=True, timeout=TTS_TIMEOUT, check=True
+        ).stdout
+        return subprocess.run(
+            [FFMPEG_COMMAND, "-hide_banner", "-loglevel", "error", "-f", "wav", "-i", "pipe:0",
+             "-ac", "1", "-ar", "24000", "-b:a", "32k",
+             # Bare MPEG frames: no ID3 tags and no Xing/LAME frame, whose frame count would make
+             # players cut a joined response short
+             "-write_xing", "0", "-id3v2_version", "0", "-write_id3v1", "0", "-f", "mp3", "pipe:1"],
+            input=wav, capture_output=True, timeout=TTS_TIMEOUT, check=True
+        ).stdout
+
+
+engines = {}
+
+def register_engine(engine):
+    """Add an engine (e.g. another local synthesizer) under engine.name; returns it."""
+    engines[engine.name] = engine
+    return engine
+
+register_engine(GTTSEngine())
+register_engine(ElevenLabsEngine())
+register_engine(EspeakEngine())
+
+
+class LatencyTracker:
+    """Moving average of render seconds per character, per engine; cache hits are not counted."""
+
+    def __init__(self, smoothing=TTS_LATENCY_SMOOTHING):
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._seconds_per_char = {}
+
+    def record(self, name, seconds, characters):
+        sample = seconds / max(1, characters)
+        with self._lock:
+            previous = self._seconds_per_char.get(name)
+            self._seconds_per_char[name] = sample if previous is None else previous + self.smoothing * (sample - previous)
+
+    def get(self, name):
+        with self._lock:
+            return self._seconds_per_char.get(name)
+
+
+latency = LatencyTracker()
+
+# Circuit breakers and fallback between engines, as for the vision models
+tts_router = ModelRouter("tts", hedging=False)
+
+
+def resolve_engine_name(requested):
+    """The engine name to use for a request's tts_engine value; unknown names get the default."""
+    if requested == "auto" or requested in engines:
+        return requested
+    return TTS_ENGINE
+
+
+def candidate_engines(requested=TTS_ENGINE, output_format=None):
+    """
+    Names of the available engines to try, in order.
+
+    With "auto", engines are ordered by measured latency; ones not measured yet come first so
+    each gets tried. Otherwise the requested engine comes first and the rest follow as
+    fallbacks, local ones first. output_format restricts them to engines that can be joined
+    with segments already rendered.
+    """
+    names = [name for name, engine in engines.items()
+             if engine.available() and (output_format is None or engine.output_format == output_format)]
+
+    def by_latency(name):
+        seconds_per_char = latency.get(name)
+        return (seconds_per_char is not None, seconds_per_char or 0)
+
+    if requested == "auto":
+        ordered = sorted(names, key=by_latency)
+    else:
+        fallbacks = sorted((name for name in names if name != requested),
+                           key=lambda name: (not engines[name].local, by_latency(name)))
+        ordered = ([requested] if requested in names else []) + fallbacks
+    return tts_router.order(ordered)
+
+
+def tts_stats():
+    return {
+        "default": TTS_ENGINE,
+        "engines": {
+            name: {
+                "available": engine.available(),
+                "local": engine.local,
+                "seconds_per_char": latency.get(name)
+            } for name, engine in engines.items()
+        },
+        "router": tts_router.stats()
+    }
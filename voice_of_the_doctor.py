@@ -1,18 +1,30 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
+# Loads .env and configures logging
+import environment
 
 #Step1a: Setup Text to Speech–TTS–model with gTTS
+# gTTS, pydub and elevenlabs are imported where they are used, to keep server start-up fast
 import os
+import re
+import time
 import logging
-from gtts import gTTS
-from pydub import AudioSegment
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from diagnosis_cache import phrase_cache, make_key
+from tts_engines import engines, candidate_engines, latency, tts_router, TTS_ENGINE
+from metrics import span, FALLBACKS, PAYLOAD_BYTES
+from logging_setup import carry_request_id
 
 # Helper function to convert MP3 to WAV
 def convert_mp3_to_wav(mp3_path, wav_path):
+    with span("convert"):
+        return _convert_mp3_to_wav(mp3_path, wav_path)
+
+def _convert_mp3_to_wav(mp3_path, wav_path):
     try:
         # Try using pydub first
         try:
+            from pydub import AudioSegment
             sound = AudioSegment.from_mp3(mp3_path)
             sound.export(wav_path, format="wav")
             logging.info(f"Converted {mp3_path} to {wav_path} using pydub")
@@ -43,6 +55,8 @@ def convert_mp3_to_wav(mp3_path, wav_path):
         return mp3_path  # Return the original MP3 path as a fallback
 
 def text_to_speech_with_gtts_old(input_text, output_filepath):
+    from gtts import gTTS
+
     language="en"
 
     audioobj= gTTS(
@@ -57,12 +71,12 @@ input_text="Hi this is Ai with Vikas!"
 #text_to_speech_with_gtts_old(input_text=input_text, output_filepath="gtts_testing.mp3")
 
 #Step1b: Setup Text to Speech–TTS–model with ElevenLabs
-import elevenlabs
-from elevenlabs.client import ElevenLabs
-
 ELEVENLABS_API_KEY=os.environ.get("ELEVENLABS_API_KEY")
 
 def text_to_speech_with_elevenlabs_old(input_text, output_filepath):
+    import elevenlabs
+    from elevenlabs.client import ElevenLabs
+
     client=ElevenLabs(api_key=ELEVENLABS_API_KEY)
     audio=client.generate(
         text= input_text,
@@ -81,7 +95,6 @@ import platform
 
 def text_to_speech_with_gtts(input_text, output_filepath):
     import logging
-    language="en"
 
     try:
         # Create MP3 file first
@@ -89,13 +102,9 @@ def text_to_speech_with_gtts(input_text, output_filepath):
         if not mp3_filepath.endswith('.mp3'):
             mp3_filepath = output_filepath + '.mp3'
 
-        # Generate MP3 with gTTS
-        audioobj = gTTS(
-            text=input_text,
-            lang=language,
-            slow=False
-        )
-        audioobj.save(mp3_filepath)
+        # Generate MP3 with gTTS, reusing cached audio for sentences spoken before
+        with open(mp3_filepath, "wb") as f:
+            f.write(text_to_speech_bytes_with_gtts(input_text))
         logging.info(f"Generated MP3 file with gTTS at: {mp3_filepath}")
 
         # Convert to WAV for better compatibility
@@ -127,14 +136,16 @@ def text_to_speech_with_gtts(input_text, output_filepath):
         return wav_path
     except Exception as e:
         logging.error(f"Error generating audio with gTTS: {e}")
+        FALLBACKS.inc(kind="error_audio")
         # Create a simple error message audio file
         try:
-            error_message = "Sorry, there was an error generating the audio response."
-            audioobj = gTTS(text=error_message, lang=language, slow=False)
+            # Pre-rendered at startup, so this path normally makes no network call
+            error_audio = error_audio_mp3()
             mp3_filepath = output_filepath
             if not mp3_filepath.endswith('.mp3'):
                 mp3_filepath = output_filepath + '.mp3'
-            audioobj.save(mp3_filepath)
+            with open(mp3_filepath, "wb") as f:
+                f.write(error_audio)
 
             # Convert to WAV
             wav_filepath = os.path.splitext(output_filepath)[0] + '.wav'
@@ -147,6 +158,287 @@ def text_to_speech_with_gtts(input_text, output_filepath):
             return None
 
 
+# Sentence boundary: terminal punctuation followed by whitespace, or a line break
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+|\n+')
+
+def iter_sentences(text_chunks):
+    """
+    Group a stream of text deltas (e.g. LLM tokens) into complete sentences.
+
+    Yields each sentence as soon as its boundary has been seen; whatever is left
+    when the stream ends is yielded as the final sentence.
+    """
+    buffer = ""
+    for chunk in text_chunks:
+        buffer += chunk
+        parts = SENTENCE_BOUNDARY.split(buffer)
+        # The last part may still be growing
+        buffer = parts.pop()
+        for sentence in parts:
+            if sentence.strip():
+                yield sentence.strip()
+    if buffer.strip():
+        yield buffer.strip()
+
+def split_sentences(text):
+    return list(iter_sentences([text]))
+
+def text_to_speech_bytes_with_gtts(input_text):
+    """Synthesize input_text with gTTS and return the MP3 bytes without touching disk."""
+    return synthesize_text(input_text, engine="gtts")
+
+#Step3: Phrase-level audio cache
+# Doctor responses repeat greetings, closings and disclaimers, so audio is cached per
+# sentence (or clause, for long sentences) and a response is assembled from cached and
+# freshly synthesized segments.
+# Engines are registered in tts_engines; segments sharing an output format can be joined byte for byte.
+
+ERROR_AUDIO_TEXT = "Sorry, there was an error generating the audio response."
+
+# gTTS sends text in pieces of about 100 characters one after another; chunks this size are
+# each a single request, and are synthesized in parallel instead
+TTS_CHUNK_MAX_CHARS=int(os.environ.get("TTS_CHUNK_MAX_CHARS", "100"))
+# Chunks being synthesized at once in this process, across all requests
+TTS_MAX_PARALLEL_CHUNKS=int(os.environ.get("TTS_MAX_PARALLEL_CHUNKS", "4"))
+TTS_CHUNK_RETRIES=int(os.environ.get("TTS_CHUNK_RETRIES", "2"))
+TTS_RETRY_BACKOFF_SECONDS=float(os.environ.get("TTS_RETRY_BACKOFF_SECONDS", "0.25"))
+# Shared by every synthesize_text call, so concurrent (and streamed) responses can't multiply the fan-out
+tts_chunk_executor = ThreadPoolExecutor(max_workers=TTS_MAX_PARALLEL_CHUNKS, thread_name_prefix="tts-chunk")
+CLAUSE_BOUNDARY = re.compile(r'(?<=[,;:])\s+|\s+(?=[-\u2013\u2014]\s)')
+
+def normalize_phrase(sentence):
+    return re.sub(r"\s+", " ", sentence).strip()
+
+def render_phrase(sentence, engine):
+    with span(f"tts_{engine.name}"):
+        start = time.perf_counter()
+        audio = engine.render(sentence)
+    latency.record(engine.name, time.perf_counter() - start, len(sentence))
+    return audio
+
+def synthesize_phrase(sentence, engine="gtts"):
+    """Return the audio for one sentence from the named engine, from the phrase cache when it has been spoken before."""
+    tts_engine = engines[engine]
+    sentence = normalize_phrase(sentence)
+    key = make_key(sentence, tts_engine.name, tts_engine.voice, tts_engine.output_format)
+    return phrase_cache.get_or_compute(
+        key,
+        lambda: render_phrase(sentence, tts_engine),
+        should_cache=lambda audio: len(audio) > 0
+    )
+
+def split_clauses(sentence, max_chars):
+    """Split an over-long sentence at clause boundaries (then at spaces) into pieces of at most max_chars."""
+    pieces = []
+    for clause in CLAUSE_BOUNDARY.split(sentence):
+        while len(clause) > max_chars:
+            cut = clause.rfind(" ", 0, max_chars + 1)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(clause[:cut].strip())
+            clause = clause[cut:].strip()
+        if clause:
+            pieces.append(clause)
+
+    # Pack neighbouring clauses back together while they fit
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) + 1 + len(piece) <= max_chars:
+            chunks[-1] += " " + piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+def split_for_tts(text, max_chars=TTS_CHUNK_MAX_CHARS):
+    """Sentences of text, with those longer than max_chars split further at clause boundaries."""
+    chunks = []
+    for sentence in split_sentences(text):
+        chunks.extend([sentence] if len(sentence) <= max_chars else split_clauses(sentence, max_chars))
+    return chunks
+
+def synthesize_chunk(chunk, candidates):
+    """One chunk from the first of candidates that renders it, retrying each engine TTS_CHUNK_RETRIES times."""
+    def attempt(name):
+        for retry in range(TTS_CHUNK_RETRIES + 1):
+            try:
+                return synthesize_phrase(chunk, engine=name)
+            except Exception as e:
+                if retry == TTS_CHUNK_RETRIES:
+                    raise
+                logging.warning(f"Retrying TTS chunk with {name} after error: {e}")
+                time.sleep(TTS_RETRY_BACKOFF_SECONDS * 2 ** retry)
+
+    return tts_router.call(candidates, attempt)
+
+def synthesize_text(input_text, engine=TTS_ENGINE, output_format=None):
+    """
+    Synthesize input_text chunk by chunk and join the segments, in order, into one MP3.
+
+    The text is split at sentence and clause boundaries (see split_for_tts) and the chunks are
+    synthesized in parallel on tts_chunk_executor, shared with every other caller. A chunk that keeps failing is retried on the next engine with the
+    same output format, so the segments can still be joined. Only when no such engine can
+    render it does the whole text move on to an engine with another format.
+
+    engine names a registered engine or "auto" (see tts_engines.candidate_engines).
+    output_format limits the engines to that format.
+    """
+    chunks = split_for_tts(input_text)
+    if not chunks:
+        raise ValueError("No text to speak")
+
+    candidates = candidate_engines(engine, output_format)
+    # Engines grouped by output format, groups in order of their best candidate
+    groups = {}
+    for name in candidates:
+        groups.setdefault(engines[name].output_format, []).append(name)
+
+    last_error = RuntimeError("No text-to-speech engine is available")
+    with span("tts"):
+        for group in groups.values():
+            try:
+                if len(chunks) == 1:
+                    segments = [synthesize_chunk(chunks[0], group)]
+                else:
+                    segments = list(tts_chunk_executor.map(carry_request_id(lambda chunk: synthesize_chunk(chunk, group)), chunks))
+                break
+            except Exception as e:
+                last_error = e
+                logging.warning(f"TTS with {group} failed: {e}")
+        else:
+            raise last_error
+
+    audio = b"".join(segments)
+    PAYLOAD_BYTES.observe(len(audio), kind="speech_mp3")
+    return audio
+
+def first_engine(engine=TTS_ENGINE):
+    """The engine synthesize_text would try first, e.g. to fix the format of a streamed response."""
+    candidates = candidate_engines(engine)
+    if not candidates:
+        raise RuntimeError("No text-to-speech engine is available")
+    return engines[candidates[0]]
+
+# The error message per audio format, rendered once and kept for the life of the process. Held here
+# rather than in the phrase cache, so neither eviction nor the cache's TTL can send the failure path
+# back to the network
+error_audio = {}
+
+# Last resort when the message was never rendered: a quarter second of silent MPEG frames (32 kbps mono)
+SILENT_MP3 = (b"\xff\xfb\x10\xc0" + bytes(100)) * 10
+
+def error_audio_mp3():
+    """The error message as MP3, rendered through the engines on first use. Raises when none can render it."""
+    audio = error_audio.get("mp3")
+    if audio is None:
+        audio = error_audio["mp3"] = synthesize_text(ERROR_AUDIO_TEXT)
+    return audio
+
+def prerender_error_audio(audio_format=None):
+    """Render the fixed error message once at startup (and convert it to AUDIO_OUTPUT_FORMAT) so the failure path needs no network."""
+    try:
+        error_audio_mp3()
+        audio_format = audio_format or AUDIO_OUTPUT_FORMAT
+        if audio_format not in error_audio:
+            error_audio[audio_format] = convert_audio(error_audio["mp3"], audio_format)
+        logging.info("Pre-rendered error message audio")
+    except Exception as e:
+        logging.warning(f"Could not pre-render error message audio: {e}")
+
+#Step4: In-memory audio output
+# gTTS already produces compact MP3, so responses are kept as bytes and served as MP3 unless
+# the client asks for something else. Only then is the audio converted, by pydub, which runs
+# an ffmpeg subprocess for each conversion (through temporary files of its own).
+
+AUDIO_FORMATS = {"mp3": "audio/mpeg", "opus": "audio/ogg", "wav": "audio/wav"}
+AUDIO_EXTENSIONS = {"mp3": ".mp3", "opus": ".ogg", "wav": ".wav"}
+AUDIO_OUTPUT_FORMAT=os.environ.get("AUDIO_OUTPUT_FORMAT", "mp3")
+
+def negotiate_audio_format(accept_header=None, requested=None, default=None):
+    """
+    Pick the response audio format from an explicit request or the client's Accept header.
+
+    default (a quality profile's format) applies when the client accepts any audio; otherwise AUDIO_OUTPUT_FORMAT.
+    """
+    default = default if default in AUDIO_FORMATS else AUDIO_OUTPUT_FORMAT
+    if requested in AUDIO_FORMATS:
+        return requested
+
+    accepted = {}
+    for item in (accept_header or "").split(","):
+        mime_type, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        accepted[mime_type.strip().lower()] = quality
+
+    if not accepted or accepted.get("*/*", 0) > 0 or accepted.get("audio/*", 0) > 0:
+        return default
+    # Prefer compressed formats; WAV only when nothing else is accepted
+    preferences = [default] + [audio_format for audio_format in ("mp3", "opus", "wav") if audio_format != default]
+    for audio_format in preferences:
+        if accepted.get(AUDIO_FORMATS[audio_format], 0) > 0:
+            return audio_format
+    return default
+
+# pydub/ffmpeg container name of each audio format
+AUDIO_CONTAINERS = {"mp3": "mp3", "opus": "ogg", "wav": "wav"}
+
+def convert_audio(mp3_bytes, audio_format, source_format="mp3"):
+    """
+    Convert MP3 bytes (or audio in another of AUDIO_FORMATS, per source_format) to audio_format.
+
+    Returns the input as it is when the formats match; otherwise pydub runs ffmpeg as a
+    subprocess, so each conversion costs a process start-up. Raises if ffmpeg fails.
+    """
+    if audio_format == source_format:
+        return mp3_bytes
+    if audio_format not in AUDIO_FORMATS or source_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unknown audio format: {audio_format if audio_format not in AUDIO_FORMATS else source_format}")
+    from pydub import AudioSegment
+
+    with span("convert"):
+        sound = AudioSegment.from_file(BytesIO(mp3_bytes), format=AUDIO_CONTAINERS[source_format])
+        output = BytesIO()
+        if audio_format == "opus":
+            sound.export(output, format="ogg", codec="libopus", bitrate="32k")
+        elif audio_format == "mp3":
+            sound.export(output, format="mp3", bitrate="32k")
+        else:
+            sound.export(output, format="wav")
+    return output.getvalue()
+
+def text_to_speech_bytes(input_text, audio_format="mp3", engine=TTS_ENGINE):
+    """Synthesize input_text with the named engine (or "auto") into an in-memory buffer in audio_format. Raises on failure."""
+    return convert_audio(synthesize_text(input_text, engine=engine), audio_format)
+
+def error_audio_bytes(audio_format="mp3"):
+    """
+    The fixed error message in audio_format, from memory: no engine, router or cache is involved,
+    and it never raises. Silence (or, for a format ffmpeg can't produce, nothing) stands in when
+    the message was never pre-rendered.
+    """
+    FALLBACKS.inc(kind="error_audio")
+    audio = error_audio.get(audio_format)
+    if audio is not None:
+        return audio
+    mp3 = error_audio.get("mp3")
+    if mp3 is None:
+        logging.error("Error message audio was never rendered; sending silence instead")
+        mp3 = SILENT_MP3
+    try:
+        audio = convert_audio(mp3, audio_format)
+    except Exception as e:
+        logging.error(f"Could not convert error message audio to {audio_format}: {e}")
+        return b""
+    if mp3 is not SILENT_MP3:
+        error_audio[audio_format] = audio
+    return audio
+
+
 input_text="Hi this is Ai with Vikas, autoplay testing!"
 #text_to_speech_with_gtts(input_text=input_text, output_filepath="gtts_testing_autoplay.mp3")
 
@@ -167,16 +459,10 @@ def text_to_speech_with_elevenlabs(input_text, output_filepath):
         if not mp3_filepath.endswith('.mp3'):
             mp3_filepath = output_filepath + '.mp3'
 
-        # Generate MP3 with ElevenLabs
-        client=ElevenLabs(api_key=ELEVENLABS_API_KEY)
+        # Generate MP3 with ElevenLabs, reusing cached audio for sentences spoken before
         logging.info(f"Sending text-to-speech request to ElevenLabs API with voice: Aria")
-        audio=client.generate(
-            text= input_text,
-            voice= "Aria",
-            output_format= "mp3_22050_32",
-            model= "eleven_turbo_v2"
-        )
-        elevenlabs.save(audio, mp3_filepath)
+        with open(mp3_filepath, "wb") as f:
+            f.write(synthesize_text(input_text, engine="elevenlabs"))
         logging.info(f"Generated MP3 file with ElevenLabs at: {mp3_filepath}")
 
         # Convert to WAV for better compatibility
@@ -1,16 +1,11 @@
-# if you dont use pipenv uncomment the following:
-from dotenv import load_dotenv
-load_dotenv()
+# Loads .env and configures logging
+import environment
 
 #Step1: Setup Audio recorder (ffmpeg & portaudio)
 # ffmpeg, portaudio, pyaudio
 import logging
-import speech_recognition as sr
-from pydub import AudioSegment
 from io import BytesIO
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
 def record_audio(file_path, timeout=20, phrase_time_limit=None):
     """
     Simplified function to record audio from the microphone and save it as an MP3 file.
@@ -20,6 +15,10 @@ def record_audio(file_path, timeout=20, phrase_time_limit=None):
     timeout (int): Maximum time to wait for a phrase to start (in seconds).
     phrase_time_lfimit (int): Maximum time for the phrase to be recorded (in seconds).
     """
+    # Only needed for local recording (PyAudio); the web entry points never import it
+    import speech_recognition as sr
+    from pydub import AudioSegment
+
     recognizer = sr.Recognizer()
 
     try:
@@ -47,30 +46,97 @@ audio_filepath="patient_voice_test_for_patient.mp3"
 
 #Step2: Setup Speech to text–STT–model for transcription
 import os
-from groq import Groq
+from api_clients import get_groq_client, STT_TIMEOUT
+from concurrent.futures import ThreadPoolExecutor
+from audio_preprocessing import prepare_audio_for_stt
+from storage_manager import input_bytes, input_name
+from stt_engines import candidate_engines, transcribe_chunk, STT_ENGINE
+from metrics import span, PAYLOAD_BYTES
+from logging_setup import phi, carry_request_id
 
 GROQ_API_KEY=os.environ.get("GROQ_API_KEY")
 stt_model="whisper-large-v3"
+STT_MAX_PARALLEL_CHUNKS=int(os.environ.get("STT_MAX_PARALLEL_CHUNKS", "4"))
+
+def recording_chunks(audio_filepath, preprocess=False):
+    """
+    The recording as a list of in-memory (filename, bytes) chunks in playback order, plus its
+    duration in seconds (None when it was not decoded). See prepare_audio_for_stt for preprocess.
+    """
+    if preprocess:
+        with span("stt_preprocess"):
+            chunks, report = prepare_audio_for_stt(audio_filepath)
+        PAYLOAD_BYTES.observe(report["bytes_before"], kind="recording_original")
+        for _, chunk in chunks:
+            PAYLOAD_BYTES.observe(len(chunk), kind="recording_upload")
+        duration_ms = report["duration_ms_after"]
+        return chunks, duration_ms / 1000 if duration_ms is not None else None
+    # Read once into memory, so a failed attempt can be retried on another engine
+    return [(os.path.basename(input_name(audio_filepath)), input_bytes(audio_filepath))], None
+
+def transcribe_chunks(chunks, transcribe):
+    """Transcribe the chunks, in parallel when there are several, and join the texts in order."""
+    if len(chunks) == 1:
+        return transcribe(chunks[0])
+    with ThreadPoolExecutor(max_workers=min(len(chunks), STT_MAX_PARALLEL_CHUNKS)) as executor:
+        texts = list(executor.map(carry_request_id(transcribe), chunks))
+    return " ".join(text.strip() for text in texts if text.strip())
+
+def transcribe_audio(audio_filepath, preprocess=False, engine=STT_ENGINE):
+    """
+    Transcribe a recording with the configured speech-to-text engines (see stt_engines).
 
-def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY):
+    Same contract as transcribe_with_groq: returns the text, or a message starting with
+    "ERROR:" instead of raising. engine names the engine to try first ("groq",
+    "faster_whisper" or "auto"); when it fails, the other available engines are tried.
+    """
+    try:
+        chunks, duration_seconds = recording_chunks(audio_filepath, preprocess)
+        candidates = candidate_engines(engine, duration_seconds)
+        if not candidates:
+            error_message = "ERROR: No speech-to-text engine is available. GROQ_API_KEY is not set and faster-whisper is not installed."
+            logging.error(error_message)
+            return error_message + "\n\nPlease add your actual GROQ API key to the .env file. You can get an API key from https://console.groq.com/"
+
+        result = transcribe_chunks(chunks, lambda chunk: transcribe_chunk(chunk, candidates))
+        logging.info(f"Received transcription (engines tried in order {candidates})", extra=phi(transcription=result))
+        return result
+    except Exception as e:
+        error_message = f"Error in transcribe_audio: {e}"
+        logging.error(error_message)
+        return f"ERROR: Failed to transcribe audio. {str(e)}\n\nPlease check your API key and internet connection."
+
+def transcribe_with_groq(stt_model, audio_filepath, GROQ_API_KEY, preprocess=False):
+    """
+    Transcribe a recording with GROQ's Whisper API.
+
+    With preprocess=True the recording is first normalized and trimmed by
+    prepare_audio_for_stt; long recordings come back in several chunks, which are
+    transcribed in parallel and joined in order.
+    """
     if not GROQ_API_KEY or GROQ_API_KEY == "your_groq_api_key_here":
         error_message = "ERROR: GROQ_API_KEY is not set or is using the default placeholder value."
         logging.error(error_message)
         return error_message + "\n\nPlease add your actual GROQ API key to the .env file. You can get an API key from https://console.groq.com/"
 
     try:
-        client=Groq(api_key=GROQ_API_KEY)
-
-        audio_file=open(audio_filepath, "rb")
-        logging.info(f"Sending audio transcription request to GROQ API with model: {stt_model}")
-        transcription=client.audio.transcriptions.create(
-            model=stt_model,
-            file=audio_file,
-            language="en"
-        )
-
-        result = transcription.text
-        logging.info(f"Received transcription from GROQ API: {result}")
+        client=get_groq_client(GROQ_API_KEY)
+
+        def transcribe(audio_file):
+            logging.info(f"Sending audio transcription request to GROQ API with model: {stt_model}")
+            with span("stt"):
+                transcription=client.audio.transcriptions.create(
+                    model=stt_model,
+                    file=audio_file,
+                    language="en",
+                    timeout=STT_TIMEOUT
+                )
+            return transcription.text
+
+        chunks, _ = recording_chunks(audio_filepath, preprocess)
+        result = transcribe_chunks(chunks, transcribe)
+
+        logging.info("Received transcription from GROQ API", extra=phi(transcription=result))
         return result
     except Exception as e:
         error_message = f"Error in transcribe_with_groq: {e}"
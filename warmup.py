@@ -0,0 +1,73 @@
+#Start-up warm-up of the SDKs and API clients that this deployment actually uses
+import os
+import time
+import logging
+import threading
+
+# off: load everything on first use; background: warm up on a thread while serving; blocking: before serving
+STARTUP_PREWARM=os.environ.get("STARTUP_PREWARM", "background")
+# Also make one cheap API call per configured client, so the first request finds an open connection
+PREWARM_CONNECTIONS=os.environ.get("PREWARM_CONNECTIONS", "0") == "1"
+
+# Seconds per warm-up step, or the error it failed with, e.g. for /api/stats
+warmup_report = {}
+
+
+def is_configured(api_key, placeholder):
+    return bool(api_key) and api_key != placeholder
+
+
+def warmup_steps(needs_pydub=True):
+    """(name, fn) pairs for the clients and libraries this process will need."""
+    from api_clients import get_groq_client, get_elevenlabs_client
+    from voice_of_the_doctor import prerender_error_audio
+
+    steps = []
+    groq_api_key = os.environ.get("GROQ_API_KEY")
+    if is_configured(groq_api_key, "your_groq_api_key_here"):
+        def groq():
+            client = get_groq_client(groq_api_key)
+            if PREWARM_CONNECTIONS:
+                client.models.list()
+        steps.append(("groq", groq))
+
+    elevenlabs_api_key = os.environ.get("ELEVENLABS_API_KEY")
+    if is_configured(elevenlabs_api_key, "your_elevenlabs_api_key_here"):
+        steps.append(("elevenlabs", lambda: get_elevenlabs_client(elevenlabs_api_key)))
+
+    from stt_engines import engines as stt_engines, STT_ENGINE
+
+    # Local Whisper is loaded ahead of time when it is the first choice; as a fallback only, on first use
+    local_stt = stt_engines["faster_whisper"]
+    if STT_ENGINE in ("faster_whisper", "auto") and local_stt.available():
+        steps.append(("stt_local", local_stt.load))
+
+    # gTTS is always the default voice; rendering the error message also loads it
+    steps.append(("error_audio", prerender_error_audio))
+    steps.append(("pillow", lambda: __import__("PIL.Image")))
+    if needs_pydub:
+        steps.append(("pydub", lambda: __import__("pydub")))
+    return steps
+
+
+def prewarm(needs_pydub=True):
+    start = time.perf_counter()
+    for name, step in warmup_steps(needs_pydub):
+        step_start = time.perf_counter()
+        try:
+            step()
+            warmup_report[name] = round(time.perf_counter() - step_start, 3)
+        except Exception as e:
+            logging.warning(f"Warm-up step {name} failed: {e}")
+            warmup_report[name] = f"failed: {e}"
+    logging.info(f"Warm-up finished in {time.perf_counter() - start:.2f}s: {warmup_report}")
+
+
+def start_prewarm(mode=STARTUP_PREWARM, needs_pydub=True):
+    """Warm up according to STARTUP_PREWARM; returns straight away unless the mode is "blocking"."""
+    if mode == "off":
+        return
+    if mode == "blocking":
+        prewarm(needs_pydub)
+        return
+    threading.Thread(target=prewarm, args=(needs_pydub,), name="prewarm", daemon=True).start()